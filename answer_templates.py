@@ -0,0 +1,158 @@
+"""
+Réponses rendues localement, en français ou en anglais, pour les recherches
+factuelles simples (cours, capitalisation, DCF...), sans second appel au LLM.
+"""
+from typing import Any, Callable, Dict, Optional
+
+
+def format_number(value: Any, language: str = "fr", decimals: int = 2) -> str:
+    """Format a number with the thousands and decimal separators of the language"""
+    number = float(value)
+    text = f"{number:,.{decimals}f}"
+    if language == "fr":
+        text = text.replace(",", " ").replace(".", ",")
+    return text
+
+
+def format_amount(value: Any, language: str = "fr", currency: str = "USD") -> str:
+    """Format a large amount with a scale word (millions, milliards / billions...)"""
+    number = float(value)
+    scales = {
+        "fr": ((1e12, "billions"), (1e9, "milliards"), (1e6, "millions")),
+        "en": ((1e12, "trillion"), (1e9, "billion"), (1e6, "million")),
+    }
+    for threshold, word in scales[language]:
+        if abs(number) >= threshold:
+            return f"{format_number(number / threshold, language)} {word} {currency}"
+    return f"{format_number(number, language)} {currency}"
+
+
+def format_percent(value: Any, language: str = "fr") -> str:
+    """Format a signed percentage"""
+    number = float(value)
+    sign = "+" if number > 0 else ""
+    unit = "\u202f%" if language == "fr" else "%"
+    return f"{sign}{format_number(number, language)}{unit}"
+
+
+def _first(result: Any) -> Dict:
+    """FMP returns either an object or a one-element list"""
+    if isinstance(result, list):
+        result = result[0] if result else {}
+    if not isinstance(result, dict) or "error" in result:
+        raise ValueError("résultat inutilisable")
+    return result
+
+
+def _stock_info(result: Any, language: str) -> str:
+    data = _first(result)
+    if language == "fr":
+        return (f"{data['companyName']} ({data['exchange']}) se négocie à "
+                f"{format_number(data['price'], language)} {data.get('currency', 'USD')}. "
+                f"Secteur : {data['sector']}, industrie : {data['industry']}, PDG : {data['ceo']}.")
+    return (f"{data['companyName']} ({data['exchange']}) trades at "
+            f"{format_number(data['price'], language)} {data.get('currency', 'USD')}. "
+            f"Sector: {data['sector']}, industry: {data['industry']}, CEO: {data['ceo']}.")
+
+
+def _stock_quote(result: Any, language: str) -> str:
+    data = _first(result)
+    name = data.get("name") or data["symbol"]
+    if language == "fr":
+        return (f"{name} ({data['symbol']}) cote {format_number(data['price'], language)} USD, "
+                f"soit {format_percent(data['changesPercentage'], language)} sur la séance "
+                f"(plage du jour : {format_number(data['dayLow'], language)} – {format_number(data['dayHigh'], language)}).")
+    return (f"{name} ({data['symbol']}) is trading at {format_number(data['price'], language)} USD, "
+            f"{format_percent(data['changesPercentage'], language)} on the day "
+            f"(day range: {format_number(data['dayLow'], language)} – {format_number(data['dayHigh'], language)}).")
+
+
+_PERIODS = {
+    "1D": ("1 jour", "1 day"), "5D": ("5 jours", "5 days"), "1M": ("1 mois", "1 month"),
+    "3M": ("3 mois", "3 months"), "6M": ("6 mois", "6 months"), "ytd": ("depuis janvier", "year to date"),
+    "1Y": ("1 an", "1 year"), "3Y": ("3 ans", "3 years"), "5Y": ("5 ans", "5 years"),
+}
+
+
+def _price_change(result: Any, language: str) -> str:
+    data = _first(result)
+    index = 0 if language == "fr" else 1
+    separator = " : " if language == "fr" else ": "
+    parts = [f"{labels[index]}{separator}{format_percent(data[key], language)}"
+             for key, labels in _PERIODS.items() if data.get(key) is not None]
+    if not parts:
+        raise ValueError("aucune période")
+    intro = f"Variations de {data['symbol']}" if language == "fr" else f"{data['symbol']} price changes"
+    return f"{intro} — " + ", ".join(parts) + "."
+
+
+def _stock_peers(result: Any, language: str) -> str:
+    if not isinstance(result, list) or not result or not all(isinstance(p, str) and p.isupper() for p in result):
+        raise ValueError("liste de pairs inutilisable")
+    peers = ", ".join(result)
+    return f"Entreprises comparables : {peers}." if language == "fr" else f"Comparable companies: {peers}."
+
+
+def _market_cap(result: Any, language: str) -> str:
+    data = _first(result)
+    amount = format_amount(data["marketCap"], language)
+    if language == "fr":
+        return f"La capitalisation boursière de {data['symbol']} est de {amount} (au {data['date']})."
+    return f"{data['symbol']}'s market capitalization is {amount} (as of {data['date']})."
+
+
+def _company_score(result: Any, language: str) -> str:
+    data = _first(result)
+    altman = format_number(data["altmanZScore"], language)
+    if language == "fr":
+        return f"{data['symbol']} : Altman Z-Score de {altman}, score de Piotroski de {data['piotroskiScore']}/9."
+    return f"{data['symbol']}: Altman Z-Score of {altman}, Piotroski score of {data['piotroskiScore']}/9."
+
+
+def _dcf_analysis(result: Any, language: str) -> str:
+    data = _first(result)
+    dcf = float(data["dcf"])
+    price = float(data["Stock Price"])
+    gap = (dcf - price) / price * 100
+    if language == "fr":
+        return (f"La valeur DCF de {data['symbol']} est estimée à {format_number(dcf, language)} USD "
+                f"pour un cours de {format_number(price, language)} USD, soit un écart de "
+                f"{format_percent(gap, language)} (au {data['date']}).")
+    return (f"{data['symbol']}'s DCF value is estimated at {format_number(dcf, language)} USD "
+            f"versus a share price of {format_number(price, language)} USD, a gap of "
+            f"{format_percent(gap, language)} (as of {data['date']}).")
+
+
+# Identifiants de functions_dict pour lesquels une réponse locale est possible
+answer_templates: Dict[int, Callable[[Any, str], str]] = {
+    1: _stock_info,
+    3: _stock_quote,
+    4: _price_change,
+    9: _stock_peers,
+    12: _market_cap,
+    14: _company_score,
+    15: _dcf_analysis,
+}
+
+
+def render_answer(function_id: int, result: Any, language: Optional[str] = "fr") -> Optional[str]:
+    """
+    Rend une réponse déterministe à partir du résultat d'une fonction.
+
+    Args:
+        function_id (int): Identifiant de la fonction dans functions_dict
+        result (Any): Résultat brut retourné par la fonction
+        language (str): 'fr' ou 'en' (défaut: 'fr')
+
+    Returns:
+        Optional[str]: Réponse rendue, ou None si aucun gabarit ne s'applique
+    """
+    template = answer_templates.get(function_id)
+    if template is None:
+        return None
+    language = language if language in ("fr", "en") else "fr"
+    try:
+        return template(result, language)
+    except (KeyError, TypeError, ValueError, IndexError, ZeroDivisionError):
+        # Données incomplètes ou erreur amont : on laisse le LLM répondre
+        return None
@@ -0,0 +1,117 @@
+"""
+Benchmark de l'extraction de champs (json_extract) sur des réponses SerpAPI
+et FMP volumineuses : temps d'analyse et pic mémoire de json.loads sur le
+corps entier, comparés à l'extraction en flux des seuls champs utilisés.
+
+Usage: python bench_extract.py [--results 400] [--runs 5]
+"""
+import argparse
+import io
+import json
+import random
+import time
+import tracemalloc
+
+import json_extract
+from fonction import OUTLOOK_FIELDS, SERPAPI_FIELDS
+
+
+def synthetic_serp(rng: random.Random, results: int) -> dict:
+    def result(i):
+        return {"position": i + 1, "title": f"Résultat {i}", "link": f"https://example.com/{i}",
+                "snippet": " ".join(rng.choice(("marché", "action", "bourse", "résultat")) for _ in range(40)),
+                "sitelinks": {"inline": [{"title": f"Lien {j}", "link": f"https://example.com/{i}/{j}"}
+                                         for j in range(4)]},
+                "rich_snippet": {"top": {"extensions": [str(rng.random()) for _ in range(6)]}}}
+
+    return {
+        "search_metadata": {"id": "x" * 24, "raw_html_file": "https://serpapi.com/raw/" + "y" * 40},
+        "search_parameters": {"engine": "google", "q": "bourse"},
+        "inline_images": [{"thumbnail": "data:image/jpeg;base64," + "A" * 4000} for _ in range(40)],
+        "organic_results": [result(i) for i in range(results)],
+        "related_questions": [{"question": f"Question {i}", "snippet": "x" * 300} for i in range(20)],
+        "pagination": {"next": "https://serpapi.com/search?start=10"},
+    }
+
+
+def synthetic_outlook(rng: random.Random, results: int) -> dict:
+    def statement(i):
+        return {"date": f"{2024 - i}-09-30", **{f"poste{k}": rng.random() * 1e9 for k in range(40)}}
+
+    return {
+        "profile": {"symbol": "AAPL", "companyName": "Apple Inc.", "description": "x" * 2000},
+        "metrics": {"dividendYielTTM": 0.5, "volume": 1e8},
+        "ratios": [{"peRatioTTM": 30.0, **{f"ratio{k}": rng.random() for k in range(50)}}],
+        "insideTrades": [{"transactionDate": "2024-01-01", "securitiesTransacted": i} for i in range(results * 5)],
+        "stockNews": [{"title": f"News {i}", "text": "y" * 500} for i in range(results)],
+        "financialsAnnual": {t: [statement(i) for i in range(30)] for t in ("income", "balance", "cash")},
+        "financialsQuarter": {t: [statement(i) for i in range(120)] for t in ("income", "balance", "cash")},
+    }
+
+
+class Network_Body(io.RawIOBase):
+    """Body read in chunks, as from a socket, without a second copy of it"""
+
+    def __init__(self, body: bytes):
+        self.view = memoryview(body)
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.view) - self.offset)
+        buffer[:size] = self.view[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+
+def measure(function, runs: int):
+    function()
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = function()
+    elapsed = (time.perf_counter() - start) / runs
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--results", type=int, default=400)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    backend = json_extract._load_ijson()
+    print(f"ijson: {backend.backend if backend else 'absent (repli sur json.loads)'}")
+    print(f"json.loads sous {json_extract.STREAM_THRESHOLD // 1024} KiB, flux au-delà")
+    cases = (
+        ("SerpAPI google", synthetic_serp(rng, args.results), SERPAPI_FIELDS["google"]),
+        ("FMP company-outlook", synthetic_outlook(rng, args.results), OUTLOOK_FIELDS),
+    )
+    for name, document, spec in cases:
+        body = json.dumps(document).encode()
+        # Avant : le corps entier est lu puis analysé à chaque response.json()
+        full, full_time, full_peak = measure(
+            lambda: json.loads(io.BufferedReader(Network_Body(body), 64 * 1024).read()), args.runs
+        )
+        streamed, stream_time, stream_peak = measure(
+            lambda: json_extract.extract(io.BufferedReader(Network_Body(body), 64 * 1024), spec), args.runs
+        )
+        assert streamed == json_extract.trim(full, spec), f"{name}: extraction différente"
+        kept = json.dumps(streamed).encode()
+        _, hit_full, _ = measure(lambda: json.loads(body), args.runs)
+        _, hit_kept, _ = measure(lambda: json.loads(kept), args.runs)
+        print(f"{name}: corps {len(body) / 1024:.0f} KiB, conservé {len(kept) / 1024:.0f} KiB")
+        print(f"  réponse amont   json.loads {full_time * 1000:7.2f} ms  pic {full_peak / 1024:6.0f} KiB"
+              f"  | extraction {stream_time * 1000:7.2f} ms  pic {stream_peak / 1024:6.0f} KiB")
+        print(f"  depuis le cache json.loads {hit_full * 1000:7.2f} ms"
+              f"              | extraction {hit_kept * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark mémoire de l'historique : listes de dicts imbriqués (ancien format)
+contre Message_Store (enregistrements __slots__, rôles internés).
+
+Usage: python bench_history_memory.py [--sessions 200] [--turns 20]
+"""
+import argparse
+import tracemalloc
+
+from messages import Message_Store
+
+
+def build_dict_history(texts):
+    history = [{"role": "system", "content": [{"type": "text", "text": texts[0]}]}]
+    for i, text in enumerate(texts[1:]):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": [{"type": "text", "text": text}]})
+    return history
+
+
+def build_store_history(texts):
+    store = Message_Store()
+    store.add("system", texts[0])
+    for i, text in enumerate(texts[1:]):
+        store.add("user" if i % 2 == 0 else "assistant", text)
+    return store
+
+
+def measure(builder, corpus) -> int:
+    """Return the bytes allocated by builder for all sessions, excluding message texts"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [builder(texts) for texts in corpus]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    # Les textes sont créés à l'avance : seule la structure est mesurée
+    corpus = [
+        [f"session {s} message {m} " * 4 for m in range(2 * args.turns + 1)]
+        for s in range(args.sessions)
+    ]
+
+    dict_bytes = measure(build_dict_history, corpus)
+    store_bytes = measure(build_store_history, corpus)
+    per_session_dict = dict_bytes / args.sessions
+    per_session_store = store_bytes / args.sessions
+
+    print(f"{args.sessions} sessions x {2 * args.turns + 1} messages (hors texte)")
+    print(f"  dicts imbriqués : {per_session_dict / 1024:.1f} KiB / session")
+    print(f"  Message_Store   : {per_session_store / 1024:.1f} KiB / session")
+    print(f"  économie        : {100 * (1 - store_bytes / dict_bytes):.0f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark de l'ordonnanceur amont : latence des appels FMP interactifs
+pendant qu'un lot de fond sature le quota du fournisseur (serveur factice
+limité à --quota requêtes simultanées), sans ordonnanceur puis avec, et
+partage de la capacité entre deux locataires de poids différents.
+
+Usage: python bench_scheduler.py [--quota 8] [--batch-threads 32] [--seconds 5]
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from mock_upstream import Mock_OpenAI_Server
+
+_unique = itertools.count()
+
+
+def fmp_call(symbol: str):
+    from resilience import http_get, revalidate
+
+    # Paramètre unique : chaque appel atteint l'amont
+    with revalidate():
+        http_get("fmp", f"https://financialmodelingprep.com/api/v3/quote/{symbol}",
+                 {"n": next(_unique), "apikey": "bench"})
+
+
+def run_load(seconds: float, interactive_users: int, batch_threads: int,
+             tenants: Optional[Dict[str, int]] = None) -> Dict:
+    from scheduler import BATCH, request_class
+
+    stop = threading.Event()
+    latencies: List[float] = []
+    errors = [0]
+    done: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def interactive():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                fmp_call("AAPL")
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            stop.wait(0.05)
+
+    def batch(tenant: str):
+        with request_class(BATCH, tenant=tenant):
+            while not stop.is_set():
+                try:
+                    fmp_call("MSFT")
+                    with lock:
+                        done[tenant] = done.get(tenant, 0) + 1
+                except Exception:
+                    pass
+
+    threads = [threading.Thread(target=interactive, daemon=True) for _ in range(interactive_users)]
+    for tenant, count in (tenants or {"lot": batch_threads}).items():
+        threads += [threading.Thread(target=batch, args=(tenant,), daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join(10)
+
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else float("nan")
+    return {"p50": pick(0.5), "p95": pick(0.95), "calls": len(ordered), "errors": errors[0], "batch": done}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quota", type=int, default=8, help="requêtes simultanées servies par l'amont")
+    parser.add_argument("--upstream-ms", type=float, default=50.0)
+    parser.add_argument("--interactive-users", type=int, default=4)
+    parser.add_argument("--batch-threads", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    mock = Mock_OpenAI_Server(upstream_delay=args.upstream_ms / 1000, upstream_concurrency=args.quota).start()
+    os.environ["FMP_BASE_URL"] = mock.base_url
+
+    import scheduler
+
+    def use_scheduler(capacity: int, weights: Optional[Dict[str, float]] = None):
+        scheduler.schedulers["fmp"] = scheduler.Upstream_Scheduler("fmp", capacity, weights=weights)
+
+    print(f"Amont factice: {args.upstream_ms:.0f} ms par appel, {args.quota} appels simultanés")
+    print(f"{'scénario':<32} {'p50 ms':>7} {'p95 ms':>7} {'appels':>7} {'erreurs':>7}  lot")
+    scenarios = (
+        ("interactif seul", args.quota, 0),
+        ("avec lot, sans ordonnanceur", 10 ** 6, args.batch_threads),
+        ("avec lot, ordonnanceur", args.quota, args.batch_threads),
+    )
+    for name, capacity, batch_threads in scenarios:
+        use_scheduler(capacity)
+        result = run_load(args.seconds, args.interactive_users, batch_threads)
+        print(f"{name:<32} {result['p50']:7.1f} {result['p95']:7.1f} {result['calls']:7d} "
+              f"{result['errors']:7d}  {sum(result['batch'].values())}")
+
+    use_scheduler(args.quota, weights={"A": 3.0, "B": 1.0})
+    half = args.batch_threads // 2
+    result = run_load(args.seconds, 0, 0, tenants={"A": half, "B": half})
+    a, b = result["batch"].get("A", 0), result["batch"].get("B", 0)
+    print(f"Lots de poids 3 et 1, {half} threads chacun: A {a} appels, B {b} appels "
+          f"(rapport {a / b if b else float('inf'):.2f})")
+    print(scheduler.schedulers["fmp"].stats())
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
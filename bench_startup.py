@@ -0,0 +1,63 @@
+"""
+Benchmark du démarrage à froid : temps entre le lancement de l'interpréteur
+et un Enhanced_OpenAI_Chatbot prêt (import de main.py).
+
+Usage: python bench_startup.py [--runs 20]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+TARGET_MS = 100.0
+
+# Mesure faite dans un interpréteur neuf, depuis un dossier vide
+_PROBE = r"""
+import sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import main
+elapsed = (time.perf_counter() - t0) * 1000
+heavy = [m for m in ("requests", "dotenv") if m in sys.modules]
+print(f"{{elapsed:.3f}} {{','.join(heavy) or '-'}}")
+"""
+
+
+def run_once(root: str) -> tuple:
+    """Run one cold start in a fresh interpreter and return (ms, heavy modules, files written)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-bench"))
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(root=root)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout.split()
+        written = os.listdir(workdir)
+    return float(output[0]), output[1], written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    heavy, written = "-", []
+    for _ in range(args.runs):
+        elapsed, heavy, written = run_once(root)
+        timings.append(elapsed)
+
+    timings.sort()
+    p50 = statistics.median(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"Démarrage jusqu'au chatbot prêt ({args.runs} runs)")
+    print(f"  p50: {p50:.1f} ms  p95: {p95:.1f} ms  max: {timings[-1]:.1f} ms  (cible < {TARGET_MS:.0f} ms)")
+    print(f"  modules lourds importés: {heavy}")
+    print(f"  fichiers écrits avant le premier message: {written or 'aucun'}")
+    sys.exit(0 if p95 < TARGET_MS else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark du moteur de métriques vectorisé : calcul des croissances, marges
+et ratios pour un grand ensemble de pairs à partir d'états financiers synthétiques.
+
+Usage: python bench_statements.py [--symbols 500] [--periods 10]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from statements_store import (
+    DEFAULT_METRICS, GROWTH_METRICS, RATIO_METRICS, Statement_Store, Symbol_Statements, compute_metrics
+)
+
+
+def synthetic_statements(symbol: str, periods: int, rng: np.random.Generator) -> Symbol_Statements:
+    items = sorted({i for pair in RATIO_METRICS.values() for i in pair} | set(GROWTH_METRICS.values()))
+    values = rng.uniform(1e6, 1e10, size=(len(items), periods))
+    dates = np.array([f"{2024 - p}-12-31" for p in range(periods)], dtype="U10")
+    return Symbol_Statements(symbol, "annual", dates, items, values, time.time())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--periods", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    statements = [synthetic_statements(f"S{i:04d}", args.periods, rng) for i in range(args.symbols)]
+    metrics = list(RATIO_METRICS) + list(GROWTH_METRICS)
+
+    compute_metrics(statements, metrics, args.periods - 1)
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        compute_metrics(statements, metrics, args.periods - 1)
+    elapsed = (time.perf_counter() - start) / runs * 1000
+    print(f"{len(metrics)} métriques x {args.symbols} symboles x {args.periods - 1} périodes: {elapsed:.2f} ms")
+
+    with tempfile.TemporaryDirectory() as root:
+        store = Statement_Store(root=root)
+        start = time.perf_counter()
+        for s in statements:
+            store.put(s)
+        write_ms = (time.perf_counter() - start) * 1000
+        size = sum(os.path.getsize(os.path.join(root, "annual", f)) for f in os.listdir(os.path.join(root, "annual")))
+
+        reloaded = Statement_Store(root=root)
+        start = time.perf_counter()
+        loaded = [reloaded.get(s.symbol) for s in statements]
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        compute_metrics(loaded, list(DEFAULT_METRICS), 3)
+        compare_ms = (time.perf_counter() - start) * 1000
+
+    print(f"écriture: {write_ms:.0f} ms, {size / args.symbols / 1024:.1f} KiB / symbole")
+    print(f"relecture depuis le disque: {load_ms:.0f} ms, comparaison des pairs: {compare_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
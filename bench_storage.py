@@ -0,0 +1,65 @@
+"""
+Benchmark des formats de stockage des conversations : octets sur disque et
+temps de relecture pour une conversation contenant des résultats de fonctions.
+
+Usage: python bench_storage.py [--turns 20]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import storage
+
+
+def synthetic_conversation(turns: int) -> dict:
+    rng = random.Random(0)
+    words = ("chiffre", "affaires", "marge", "croissance", "trimestre", "action", "résultat",
+             "bénéfice", "dette", "trésorerie", "dividende", "prévision", "analyse", "secteur")
+    history = [{"role": "system", "content": [{"type": "text", "text": "Tu es un assistant."}]}]
+    for turn in range(turns):
+        # Résultat de fonction typique : liste d'enregistrements FMP
+        records = [
+            {"date": f"{2024 - i}-09-30", "symbol": rng.choice(("AAPL", "MSFT", "NVDA")),
+             "revenue": rng.randint(10**10, 10**12), "grossProfit": rng.randint(10**9, 10**11),
+             "netIncome": rng.randint(10**8, 10**11), "eps": round(rng.uniform(0, 20), 2), "period": "FY"}
+            for i in range(5)
+        ]
+        question = f"Question: Quels sont les résultats ? ({turn})\nRésultat de la fonction 5: {records}"
+        answer = " ".join(rng.choice(words) for _ in range(120))
+        history.append({"role": "user", "content": [{"type": "text", "text": question}]})
+        history.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+    return {"provider": "openai", "conversation_id": "bench", "history": history}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    data = synthetic_conversation(args.turns)
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Conversation de {args.turns} tours")
+        baseline = None
+        for fmt in storage.FORMATS:
+            base = os.path.join(root, f"conversation_{fmt}")
+            start = time.perf_counter()
+            path = storage.write_file(base, data, fmt)
+            write_ms = (time.perf_counter() - start) * 1000
+            size = os.path.getsize(path)
+            baseline = baseline or size
+
+            runs = 50
+            start = time.perf_counter()
+            for _ in range(runs):
+                loaded = storage.read_file(path)
+            load_ms = (time.perf_counter() - start) / runs * 1000
+            assert loaded == json.loads(json.dumps(data))
+            print(f"  {fmt:8s} {size / 1024:8.1f} KiB ({size / baseline:4.0%})  "
+                  f"écriture {write_ms:6.2f} ms  relecture {load_ms:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
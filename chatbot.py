@@ -1,3 +1,18 @@
+import json
+import os
+import sys
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+from llm import OpenAI_LLM
+import storage
+from conversation_store import Conversation_Store, shared_writer
+from messages import Message_Store
+from resilience import turn_deadline
+from scheduler import DEFAULT_TENANT, request_class
+
+
 class OpenAI_Chatbot:
     _chatbot_counter = 0
     provider = "openai"
@@ -7,23 +22,59 @@ class OpenAI_Chatbot:
         llm: OpenAI_LLM,
         system_prompt: str = "You are a helpful assistant.",
         verbose: bool = True,
-        name: Optional[str] = None
+        name: Optional[str] = None,
+        turn_timeout: Optional[float] = None,
+        storage_format: str = "compact",
+        write_behind: bool = True,
+        tenant: str = DEFAULT_TENANT
     ):
         OpenAI_Chatbot._chatbot_counter += 1
         self.llm = llm
         self.system_prompt = system_prompt
         self.verbose = verbose
+        # Délai global d'un tour, propagé à tous les appels amont (None: illimité)
+        self.turn_timeout = turn_timeout
+        # Locataire auquel sont imputés les appels amont (partage équitable)
+        self.tenant = tenant
+        # Format des fichiers de conversation : "json", "compact" ou "gzip"
+        if storage_format not in storage.FORMATS:
+            raise ValueError(f"storage_format must be one of {storage.FORMATS}")
+        self.storage_format = storage_format
         self.chatbot_id = OpenAI_Chatbot._chatbot_counter
         self.name = name or f"chatbot_{self.chatbot_id}"
-        self.conversation_folder = self._create_conversation_folder()
-        self.history: List[Dict] = []
+        # Le dossier et les métadonnées ne sont écrits qu'à la première sauvegarde
+        self.conversation_folder = f"conversations/{self.provider}/{self.name}"
+        # Fichiers répartis par préfixe de hachage, conversations inactives archivées ;
+        # sauvegardes écrites en arrière-plan (write_behind) ou avant la fin du tour
+        self.store = Conversation_Store(self.conversation_folder,
+                                        writer=shared_writer() if write_behind else None)
+        self._folder_ready = False
+        self.messages = Message_Store()
         self._initialize_conversation()
 
+    @property
+    def history(self) -> List[Dict]:
+        """
+        Conversation history as a list of API-format message dicts.
+
+        A real list (json.dump works) whose edits, including append/pop/clear
+        and changes to a message dict, are written back to self.messages. It
+        is rebuilt only after the conversation changed; a list read before a
+        new turn raises RuntimeError when edited (see History_View).
+        """
+        return self.messages.view()
+
+    @history.setter
+    def history(self, value: List[Dict]):
+        self.messages = Message_Store(value)
+
     def _create_conversation_folder(self) -> str:
         """Create and return the path to this chatbot's conversation folder"""
-        base_folder = "conversations"
-        provider_folder = f"{base_folder}/{self.provider}"
-        chatbot_folder = f"{provider_folder}/{self.name}"
+        if self._folder_ready:
+            return self.conversation_folder
+
+        provider_folder = os.path.dirname(self.conversation_folder)
+        chatbot_folder = self.conversation_folder
         
         # Create necessary folders
         os.makedirs(provider_folder, exist_ok=True)
@@ -56,22 +107,22 @@ class OpenAI_Chatbot:
         
         with open(f"{chatbot_folder}/metadata.json", 'w') as f:
             json.dump(chatbot_metadata, f, indent=2)
-            
+
+        self._folder_ready = True
         return chatbot_folder
 
     def _initialize_conversation(self):
         """Initialize conversation with system prompt"""
         self.conversation_id = str(uuid.uuid4())
-        self.history = [{
-            "role": "system",
-            "content": [{"type": "text", "text": self.system_prompt}]
-        }]
-        self._save_conversation()
+        self.messages = Message_Store()
+        self.messages.add("system", self.system_prompt)
+
+    def _conversation_path(self, conversation_id: str) -> str:
+        """Path of a conversation file, without its format extension"""
+        return self.store.base_path(conversation_id)
 
     def _save_conversation(self):
-        """Save conversation history to JSON file"""
-        filename = f"{self.conversation_folder}/conversation_{self.conversation_id}.json"
-        
+        """Save conversation history in the configured storage format"""
         conversation_data = {
             "provider": self.provider,
             "conversation_id": self.conversation_id,
@@ -80,11 +131,12 @@ class OpenAI_Chatbot:
             "timestamp": datetime.now().isoformat(),
             "system_prompt": self.system_prompt,
             "model": self.llm.model,
-            "history": self.history
+            "history": self.messages.to_api()
         }
         
-        with open(filename, 'w') as f:
-            json.dump(conversation_data, f, indent=2)
+        # Dossier et métadonnées créés par l'écriture elle-même, hors du tour
+        prepare = None if self._folder_ready else self._create_conversation_folder
+        self.store.save(self.conversation_id, conversation_data, self.storage_format, prepare)
 
     def start_new_conversation(self):
         """Start a new conversation while maintaining chatbot identity"""
@@ -93,65 +145,94 @@ class OpenAI_Chatbot:
             print(f"\nStarted new conversation with ID: {self.conversation_id}")
 
     def list_conversations(self) -> List[str]:
-        """List all conversations for this chatbot"""
-        conversations = [f for f in os.listdir(self.conversation_folder) 
-                        if f.startswith('conversation_') and f.endswith('.json')]
-        return conversations
+        """List the conversation files of this chatbot (conversation_<id>.json[.gz])"""
+        names = {conversation_id: os.path.basename(path) for conversation_id, path in self.store.iter_files()}
+        # Sauvegardes encore en attente d'écriture : le fichier qu'elles vont créer
+        if self.store.writer is not None:
+            extension = storage.EXTENSIONS[self.storage_format]
+            for conversation_id in self.store.writer.pending_ids(self.store.folder):
+                names.setdefault(conversation_id, f"conversation_{conversation_id}{extension}")
+        return sorted(names.values())
+
+    def list_conversation_ids(self) -> List[str]:
+        """List the IDs of all conversations for this chatbot, archived ones included"""
+        return self.store.list_ids()
 
     def load_conversation(self, conversation_id: str):
-        """Load a specific conversation"""
-        filename = f"{self.conversation_folder}/conversation_{conversation_id}.json"
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                data = json.load(f)
-                self.conversation_id = data["conversation_id"]
-                self.history = data["history"]
-                if self.verbose:
-                    print(f"\nLoaded conversation: {conversation_id}")
-        else:
-            raise FileNotFoundError(f"Conversation {conversation_id} not found")
+        """Load a specific conversation, from its file or from the archive"""
+        data = self.store.load(conversation_id)
+        self.conversation_id = data["conversation_id"]
+        self.history = data["history"]
+        if self.verbose:
+            print(f"\nLoaded conversation: {conversation_id}")
 
     def _prepare_messages(self, message: str) -> List[Dict]:
         """Prepare messages for API request"""
-        self.history.append({
-            "role": "user",
-            "content": [{"type": "text", "text": message}]
-        })
-        return self.history
+        self.messages.add("user", message)
+        return self._api_history()
+
+    def _api_history(self) -> List[Dict]:
+        """History in the API wire format, as sent with the next request"""
+        return self.messages.to_api()
+
+    def _answer_locally(self, message: str, answer: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Record an answer produced without calling the LLM"""
+        self.messages.add("user", message)
+        if self.verbose:
+            print(f"\n{self.name} - User: ", message)
+            print(f"\n{self.name} - Assistant: ", answer + "\n")
+        if on_token is not None:
+            on_token(answer)
+        self.messages.add("assistant", answer)
+        self._save_conversation()
+        return answer
 
     def _print_streaming_response(self, content: str):
         """Print streaming response in a chat-like format"""
         sys.stdout.write(content)
         sys.stdout.flush()
 
-    def __call__(self, message: str) -> str:
-        """Process user message and return response"""
+    def _stream_deltas(self, response) -> Iterator[Dict]:
+        """Yield the delta of each chunk of a streamed completion"""
+        for line in response.iter_lines():
+            if line:
+                line = line.decode('utf-8')
+                if line.startswith("data: "):
+                    line = line[6:]
+                    if line != "[DONE]":
+                        try:
+                            data = json.loads(line)
+                            if "choices" in data and len(data["choices"]) > 0:
+                                yield data["choices"][0].get("delta", {})
+                        except json.JSONDecodeError:
+                            continue
+
+    def __call__(self, message: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Process user message and return response, passing each streamed chunk to on_token"""
+        with turn_deadline(self.turn_timeout), request_class(tenant=self.tenant):
+            return self._respond(message, on_token)
+
+    def _respond(self, message: str, on_token: Optional[Callable[[str], None]]) -> str:
+        """Send the message to the LLM and record the exchange"""
         messages = self._prepare_messages(message)
-        response = self.llm._make_request(messages)
+        # Options figées pour ce tour : le LLM peut être partagé entre threads
+        options = self.llm.request_options()
+        response = self.llm._make_request(messages, options=options)
 
         if self.verbose:
             print(f"\n{self.name} - User: ", message)
             print(f"\n{self.name} - Assistant: ", end="")
 
-        if self.llm.stream:
+        if options.stream:
             collected_messages = []
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith("data: "):
-                        line = line[6:]
-                        if line != "[DONE]":
-                            try:
-                                data = json.loads(line)
-                                if "choices" in data and len(data["choices"]) > 0:
-                                    delta = data["choices"][0].get("delta", {})
-                                    if "content" in delta:
-                                        content = delta["content"]
-                                        collected_messages.append(content)
-                                        if self.verbose:
-                                            self._print_streaming_response(content)
-                            except json.JSONDecodeError:
-                                continue
+            for delta in self._stream_deltas(response):
+                content = delta.get("content")
+                if content:
+                    collected_messages.append(content)
+                    if on_token is not None:
+                        on_token(content)
+                    if self.verbose:
+                        self._print_streaming_response(content)
 
             full_response = "".join(collected_messages)
             if self.verbose:
@@ -159,13 +240,12 @@ class OpenAI_Chatbot:
         else:
             response_data = response.json()
             full_response = response_data["choices"][0]["message"]["content"]
+            if on_token is not None:
+                on_token(full_response)
             if self.verbose:
                 print(full_response + "\n")
 
-        self.history.append({
-            "role": "assistant",
-            "content": [{"type": "text", "text": full_response}]
-        })
+        self.messages.add("assistant", full_response)
         self._save_conversation()
 
         return full_response
@@ -0,0 +1,592 @@
+"""
+Rangement des conversations d'un chatbot sur disque, en deux niveaux.
+
+- Conversations actives : un fichier par conversation, réparti dans 256
+  sous-dossiers selon un préfixe de hachage de l'identifiant :
+  <dossier>/<xx>/conversation_<id>.json[.gz]
+- Archives : les conversations inactives sont regroupées dans des segments
+  compressés <dossier>/archive/segment_<n>.seg (concaténation de blocs gzip),
+  chacun accompagné d'un index <n>.idx {id: [offset, longueur]}.
+
+La lecture cherche d'abord le fichier actif (nouveau puis ancien emplacement
+à plat), puis le segment le plus récent qui contient l'identifiant. Une
+conversation archivée puis reprise redevient un fichier actif, qui masque sa
+copie archivée.
+
+Les sauvegardes des chatbots passent par un Conversation_Writer : elles sont
+écrites en arrière-plan, hors du temps de réponse, et les sauvegardes
+successives d'une même conversation encore en attente n'en font qu'une. Une
+sauvegarde en attente est visible des lectures du même processus.
+
+Usage: python conversation_store.py [--root conversations] [--idle-days 7]
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import storage
+
+ARCHIVE_FOLDER = "archive"
+SEGMENT_PREFIX = "segment_"
+# Fichier actif mis de côté le temps de vérifier qu'il est bien celui archivé
+ARCHIVING_SUFFIX = ".archiving"
+_SHARD = re.compile(r"^[0-9a-f]{2}$")
+# Identifiants acceptés dans un nom de fichier (les clients peuvent les choisir)
+CONVERSATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_INDEX = re.compile(r"^segment_(\d+)\.idx$")
+
+
+def shard_of(conversation_id: str) -> str:
+    """Two hex characters spreading conversations over 256 subfolders"""
+    return hashlib.sha1(conversation_id.encode("utf-8")).hexdigest()[:2]
+
+
+def is_valid_conversation_id(conversation_id: Any) -> bool:
+    """True for an identifier that is safe in a file name (UUIDs are)"""
+    return isinstance(conversation_id, str) and CONVERSATION_ID_PATTERN.match(conversation_id) is not None
+
+
+def _check_id(conversation_id: Any) -> str:
+    if not is_valid_conversation_id(conversation_id):
+        raise ValueError(f"Identifiant de conversation invalide: {conversation_id!r}")
+    return conversation_id
+
+
+def _conversation_id(filename: str) -> Optional[str]:
+    if not filename.startswith("conversation_") or not filename.endswith(storage.SEARCH_EXTENSIONS):
+        return None
+    return storage.strip_extension(filename)[len("conversation_"):]
+
+
+class Conversation_Store:
+    """
+    Sharded conversation files of one chatbot folder, plus their archive segments.
+
+    Args:
+        folder (str): Chatbot conversation folder
+        writer (Conversation_Writer): Background writer used by save() (None: synchronous)
+    """
+
+    def __init__(self, folder: str, writer: Optional["Conversation_Writer"] = None):
+        self.folder = folder
+        self.writer = writer
+        self.archive_folder = os.path.join(folder, ARCHIVE_FOLDER)
+        # id -> (segment, offset, longueur), reconstruit quand les index changent
+        self._index: Dict[str, Tuple[str, int, int]] = {}
+        self._index_files: Tuple[str, ...] = ()
+        self._lock = threading.Lock()
+
+    # ---- fichiers actifs ---------------------------------------------
+
+    def base_path(self, conversation_id: str) -> str:
+        """Path of a conversation file, without its format extension (ValueError for an unsafe id)"""
+        _check_id(conversation_id)
+        return os.path.join(self.folder, shard_of(conversation_id), f"conversation_{conversation_id}")
+
+    def _legacy_path(self, conversation_id: str) -> str:
+        return os.path.join(self.folder, f"conversation_{_check_id(conversation_id)}")
+
+    def write(self, conversation_id: str, data: Any, fmt: str = "compact", fsync: bool = False) -> str:
+        """Write a conversation file in its shard, dropping any flat-layout copy"""
+        base = self.base_path(conversation_id)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        path = storage.write_file(base, data, fmt, fsync)
+        legacy = storage.find_file(self._legacy_path(conversation_id))
+        if legacy is not None:
+            os.remove(legacy)
+        return path
+
+    def save(self, conversation_id: str, data: Any, fmt: str = "compact",
+             prepare: Optional[Callable[[], Any]] = None):
+        """Write a conversation through the background writer, or right away without one"""
+        if self.writer is not None:
+            self.writer.submit(self, conversation_id, data, fmt, prepare)
+            return
+        if prepare is not None:
+            prepare()
+        self.write(conversation_id, data, fmt)
+
+    def _pending(self, conversation_id: str) -> Optional[Any]:
+        return self.writer.pending(self.folder, conversation_id) if self.writer is not None else None
+
+    def find_file(self, conversation_id: str) -> Optional[str]:
+        """Active file of a conversation, in the sharded or the flat layout"""
+        return (storage.find_file(self.base_path(conversation_id))
+                or storage.find_file(self._legacy_path(conversation_id)))
+
+    def iter_files(self) -> Iterator[Tuple[str, str]]:
+        """(conversation id, path) of every active conversation file"""
+        if not os.path.isdir(self.folder):
+            return
+        for entry in os.scandir(self.folder):
+            if entry.is_dir() and _SHARD.match(entry.name):
+                for shard_entry in os.scandir(entry.path):
+                    conversation_id = _conversation_id(shard_entry.name)
+                    if conversation_id is not None:
+                        yield conversation_id, shard_entry.path
+            elif entry.is_file():
+                conversation_id = _conversation_id(entry.name)
+                if conversation_id is not None:
+                    yield conversation_id, entry.path
+
+    # ---- lecture -------------------------------------------------------
+
+    def load(self, conversation_id: str) -> Any:
+        """Read a conversation from a pending save, its active file or its archive segment"""
+        pending = self._pending(conversation_id)
+        if pending is not None:
+            return pending
+        path = self.find_file(conversation_id)
+        if path is not None:
+            return storage.read_file(path)
+        location = self._archive_index().get(conversation_id)
+        if location is None:
+            raise FileNotFoundError(f"Conversation {conversation_id} not found")
+        segment, offset, length = location
+        with open(segment, "rb") as f:
+            f.seek(offset)
+            return storage.decode(f.read(length))
+
+    def exists(self, conversation_id: str) -> bool:
+        return (self._pending(conversation_id) is not None or self.find_file(conversation_id) is not None
+                or conversation_id in self._archive_index())
+
+    def list_ids(self) -> List[str]:
+        """Identifiers of all conversations, active, archived and pending"""
+        ids = {conversation_id for conversation_id, _ in self.iter_files()}
+        ids.update(self._archive_index())
+        if self.writer is not None:
+            ids.update(self.writer.pending_ids(self.folder))
+        return sorted(ids)
+
+    # ---- archives ------------------------------------------------------
+
+    def _index_names(self) -> Tuple[str, ...]:
+        if not os.path.isdir(self.archive_folder):
+            return ()
+        return tuple(sorted(
+            (name for name in os.listdir(self.archive_folder) if _INDEX.match(name)),
+            key=lambda name: int(_INDEX.match(name).group(1))
+        ))
+
+    def _archive_index(self) -> Dict[str, Tuple[str, int, int]]:
+        names = self._index_names()
+        with self._lock:
+            if names != self._index_files:
+                index = {}
+                # Segments du plus ancien au plus récent : la dernière copie gagne
+                for name in names:
+                    segment = os.path.join(self.archive_folder, name[:-len(".idx")] + ".seg")
+                    with open(os.path.join(self.archive_folder, name), "r", encoding="utf-8") as f:
+                        for conversation_id, (offset, length) in json.load(f).items():
+                            index[conversation_id] = (segment, offset, length)
+                self._index = index
+                self._index_files = names
+            return self._index
+
+    def _next_segment(self) -> int:
+        names = self._index_names()
+        return int(_INDEX.match(names[-1]).group(1)) + 1 if names else 1
+
+    def archive_idle(self, idle_after: float, segment_size: int = 64 << 20,
+                     now: Optional[float] = None) -> int:
+        """
+        Pack conversations untouched for idle_after seconds into new segments.
+
+        A segment is committed by writing its index last; the packed files are
+        then removed, except those modified while the segment was written.
+        Returns the number of archived conversations.
+        """
+        self._restore_set_aside()
+        cutoff = (now if now is not None else time.time()) - idle_after
+        candidates = []
+        for conversation_id, path in self.iter_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime < cutoff:
+                candidates.append((stat.st_mtime, conversation_id, path, stat))
+        candidates.sort()
+
+        archived = 0
+        batch: List[Tuple[str, str, os.stat_result, bytes]] = []
+        size = 0
+        for _, conversation_id, path, stat in candidates:
+            try:
+                blob = storage.encode(storage.read_file(path), "gzip")
+            except (OSError, ValueError):
+                continue
+            batch.append((conversation_id, path, stat, blob))
+            size += len(blob)
+            if size >= segment_size:
+                archived += self._write_segment(batch)
+                batch, size = [], 0
+        if batch:
+            archived += self._write_segment(batch)
+        return archived
+
+    def _write_segment(self, batch: List[Tuple[str, str, os.stat_result, bytes]]) -> int:
+        os.makedirs(self.archive_folder, exist_ok=True)
+        name = f"{SEGMENT_PREFIX}{self._next_segment():06d}"
+        segment_path = os.path.join(self.archive_folder, name + ".seg")
+        index: Dict[str, List[int]] = {}
+        offset = 0
+        with open(segment_path + ".tmp", "wb") as f:
+            for conversation_id, _, _, blob in batch:
+                f.write(blob)
+                index[conversation_id] = [offset, len(blob)]
+                offset += len(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(segment_path + ".tmp", segment_path)
+        index_path = os.path.join(self.archive_folder, name + ".idx")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + ".tmp", index_path)
+
+        for conversation_id, path, stat, _ in batch:
+            self._remove_archived(path, stat)
+        return len(batch)
+
+    def _remove_archived(self, path: str, stat: os.stat_result):
+        """Remove an archived active file, unless a save replaced it since it was read"""
+        # Le fichier est d'abord renommé : une sauvegarde qui arrive ensuite crée
+        # un nouveau fichier actif au lieu d'être supprimée avec l'ancien
+        aside = path + ARCHIVING_SUFFIX
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return
+        current = os.stat(aside)
+        if (current.st_mtime, current.st_size) == (stat.st_mtime, stat.st_size):
+            os.remove(aside)
+        else:
+            # Reprise pendant l'archivage : le fichier actif reste la référence
+            self._put_back(aside, path)
+
+    @staticmethod
+    def _put_back(aside: str, path: str):
+        """Restore a set-aside file, unless a newer save already recreated it"""
+        try:
+            # link échoue si le fichier existe : une sauvegarde plus récente n'est jamais écrasée
+            os.link(aside, path)
+        except FileExistsError:
+            pass
+        os.remove(aside)
+
+    def _restore_set_aside(self):
+        """Put back files left aside by an archiving pass that was interrupted"""
+        if not os.path.isdir(self.folder):
+            return
+        for entry in os.scandir(self.folder):
+            if entry.is_dir() and _SHARD.match(entry.name):
+                for shard_entry in os.scandir(entry.path):
+                    if shard_entry.name.endswith(ARCHIVING_SUFFIX):
+                        self._put_back(shard_entry.path, shard_entry.path[:-len(ARCHIVING_SUFFIX)])
+            elif entry.name.endswith(ARCHIVING_SUFFIX):
+                self._put_back(entry.path, entry.path[:-len(ARCHIVING_SUFFIX)])
+
+
+class _Pending_Write:
+    __slots__ = ("store", "conversation_id", "data", "fmt", "prepare", "due", "failures", "failed_at")
+
+    def __init__(self, store: Conversation_Store, conversation_id: str, data: Any, fmt: str,
+                 prepare: Optional[Callable[[], Any]], due: float):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.data = data
+        self.fmt = fmt
+        self.prepare = prepare
+        self.due = due
+        # Échecs consécutifs et date du dernier (time.monotonic)
+        self.failures = 0
+        self.failed_at: Optional[float] = None
+
+
+class Conversation_Writer:
+    """
+    Background thread writing conversation saves off the response path.
+
+    A save waits at most `delay` seconds; saves of a conversation still
+    waiting replace each other and are written once. Beyond `max_pending`
+    waiting conversations, submit() blocks until the writer catches up.
+    A failed save stays pending, and readable, and is retried with an
+    exponential backoff until it is written or replaced by a newer save.
+    Any store with a `folder` and a `write(id, data, fmt, fsync)` method can
+    be written through it (see result_store).
+
+    Args:
+        delay (float): Seconds a save may wait, so that close saves are coalesced
+        fsync (bool): Sync each file to disk before it replaces the previous one
+        max_pending (int): Waiting conversations before submit() blocks
+        retry_delay (float): Seconds before the first retry of a failed save
+        max_retry_delay (float): Upper bound of the delay between retries
+    """
+
+    def __init__(self, delay: float = 0.0, fsync: bool = False, max_pending: int = 1024,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.delay = delay
+        self.fsync = fsync
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # (dossier, id) -> sauvegarde en attente, dans l'ordre d'arrivée
+        self._pending: "OrderedDict[Tuple[str, str], _Pending_Write]" = OrderedDict()
+        # Sauvegardes en cours d'écriture, encore visibles des lectures
+        self._writing: Dict[Tuple[str, str], _Pending_Write] = {}
+        self._condition = threading.Condition()
+        self._flushing = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.lost = 0
+
+    def submit(self, store: Conversation_Store, conversation_id: str, data: Any, fmt: str = "compact",
+               prepare: Optional[Callable[[], Any]] = None):
+        """Queue a save; prepare() runs in the writer thread before the first write"""
+        key = (store.folder, conversation_id)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Conversation_Writer is closed")
+            self._start()
+            previous = self._pending.get(key)
+            if previous is not None:
+                previous.store, previous.data, previous.fmt = store, data, fmt
+                previous.prepare = previous.prepare or prepare
+                if previous.failures:
+                    # Nouvelles données : nouvel essai sans attendre la fin du délai de reprise
+                    previous.failures, previous.due = 0, time.monotonic() + self.delay
+                    self._condition.notify_all()
+                self.coalesced += 1
+                return
+            while len(self._pending) >= self.max_pending:
+                self._condition.notify_all()
+                self._condition.wait()
+            self._pending[key] = _Pending_Write(store, conversation_id, data, fmt, prepare,
+                                                time.monotonic() + self.delay)
+            self._condition.notify_all()
+
+    def pending(self, folder: str, conversation_id: str) -> Optional[Any]:
+        """Data of a save not yet on disk, None if there is none"""
+        key = (folder, conversation_id)
+        with self._condition:
+            item = self._pending.get(key) or self._writing.get(key)
+            return item.data if item is not None else None
+
+    def pending_ids(self, folder: str) -> List[str]:
+        with self._condition:
+            return [conversation_id for (item_folder, conversation_id) in (*self._pending, *self._writing)
+                    if item_folder == folder]
+
+    def failed_ids(self, folder: str) -> List[str]:
+        """Conversations whose last write attempt failed, still pending a retry"""
+        with self._condition:
+            return [conversation_id for (item_folder, conversation_id), item in self._pending.items()
+                    if item_folder == folder and item.failures]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Write every waiting save now, retrying failed ones once.
+
+        Returns False if timeout expired first or if a save could not be
+        written; such saves stay pending and keep being retried.
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        with self._condition:
+            self._flushing += 1
+            for item in self._pending.values():
+                item.due = min(item.due, started)
+            self._condition.notify_all()
+            try:
+                # Attente de chaque sauvegarde jusqu'à son écriture, ou son échec pendant ce flush
+                while any(item.failed_at is None or item.failed_at < started
+                          for item in (*self._pending.values(), *self._writing.values())):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return not (self._pending or self._writing)
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: Optional[float] = None):
+        """Flush, then stop the thread, giving up saves that still fail; later saves raise RuntimeError"""
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+            self._thread.start()
+
+    def _take_due(self) -> List[_Pending_Write]:
+        """Wait for saves to write, and move them to _writing (lock held)"""
+        while True:
+            if self._pending:
+                if self._closed and all(item.failures for item in self._pending.values()):
+                    # Arrêt : les sauvegardes encore en échec après le flush final sont perdues
+                    for item in self._pending.values():
+                        print(f"Conversation {item.conversation_id} non sauvegardée "
+                              f"après {item.failures} échecs")
+                    self.lost += len(self._pending)
+                    self._pending.clear()
+                    self._condition.notify_all()
+                    return []
+                urgent = self._flushing or self._closed or len(self._pending) >= self.max_pending
+                now = time.monotonic()
+                # Une sauvegarde en échec attend son délai de reprise, même pressée
+                due = [key for key, item in self._pending.items()
+                       if item.due <= now or (urgent and not item.failures)]
+                if due:
+                    batch = [self._pending.pop(key) for key in due]
+                    for key, item in zip(due, batch):
+                        self._writing[key] = item
+                    return batch
+                self._condition.wait(min(item.due for item in self._pending.values()) - now)
+            elif self._closed:
+                return []
+            else:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch = self._take_due()
+                if not batch:
+                    return
+                # Place libérée pour les sauvegardes bloquées sur max_pending
+                self._condition.notify_all()
+            failed = []
+            for item in batch:
+                try:
+                    if item.prepare is not None:
+                        item.prepare()
+                    item.store.write(item.conversation_id, item.data, item.fmt, self.fsync)
+                    self.written += 1
+                except Exception as e:
+                    self.errors += 1
+                    failed.append(item)
+                    print(f"Erreur d'écriture de la conversation {item.conversation_id}: {e}")
+            with self._condition:
+                for item in batch:
+                    self._writing.pop((item.store.folder, item.conversation_id), None)
+                for item in failed:
+                    self._retry(item)
+                self._condition.notify_all()
+
+    def _retry(self, item: _Pending_Write):
+        """Queue a failed save again, after a backoff (lock held)"""
+        key = (item.store.folder, item.conversation_id)
+        newer = self._pending.get(key)
+        if newer is not None:
+            # Une sauvegarde plus récente remplace celle-ci
+            newer.prepare = newer.prepare or item.prepare
+            return
+        item.failures += 1
+        item.failed_at = time.monotonic()
+        item.due = item.failed_at + min(self.max_retry_delay, self.retry_delay * 2 ** (item.failures - 1))
+        self._pending[key] = item
+
+
+_shared_writer: Optional[Conversation_Writer] = None
+_shared_writer_lock = threading.Lock()
+
+
+def shared_writer() -> Conversation_Writer:
+    """Process-wide writer used by the chatbots, flushed when the interpreter exits"""
+    global _shared_writer
+    with _shared_writer_lock:
+        if _shared_writer is None:
+            _shared_writer = Conversation_Writer()
+            atexit.register(_shared_writer.close)
+        return _shared_writer
+
+
+def iter_chatbot_folders(root: str) -> Iterator[str]:
+    """Chatbot folders under root/<provider>/<name>"""
+    if not os.path.isdir(root):
+        return
+    for provider in os.scandir(root):
+        if provider.is_dir():
+            for chatbot in os.scandir(provider.path):
+                if chatbot.is_dir():
+                    yield chatbot.path
+
+
+class Conversation_Archiver:
+    """
+    Background thread archiving idle conversations of every chatbot under root.
+
+    Args:
+        root (str): Conversations root folder
+        idle_after (float): Seconds without modification before a conversation is archived
+        interval (float): Seconds between two archiving passes
+        segment_size (int): Target compressed bytes per segment
+    """
+
+    def __init__(self, root: str = "conversations", idle_after: float = 7 * 24 * 3600.0,
+                 interval: float = 3600.0, segment_size: int = 64 << 20):
+        self.root = root
+        self.idle_after = idle_after
+        self.interval = interval
+        self.segment_size = segment_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def archive_once(self) -> int:
+        archived = 0
+        for folder in iter_chatbot_folders(self.root):
+            try:
+                archived += Conversation_Store(folder).archive_idle(self.idle_after, self.segment_size)
+            except OSError as e:
+                print(f"Erreur d'archivage dans {folder}: {e}")
+        return archived
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.archive_once()
+
+    def start(self) -> "Conversation_Archiver":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="conversation-archiver", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="conversations")
+    parser.add_argument("--idle-days", type=float, default=7.0)
+    parser.add_argument("--segment-mb", type=float, default=64.0)
+    args = parser.parse_args()
+
+    archiver = Conversation_Archiver(args.root, idle_after=args.idle_days * 86400,
+                                     segment_size=int(args.segment_mb * (1 << 20)))
+    print(f"{archiver.archive_once()} conversation(s) archivée(s) sous {args.root}")
+
+
+if __name__ == "__main__":
+    main()
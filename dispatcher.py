@@ -0,0 +1,407 @@
+"""
+Déploiement multi-processus : N processus de travail exécutent chacun un
+Chatbot_Server, derrière un répartiteur frontal qui expose les mêmes routes.
+
+Chaque conversation est attachée à un processus par hachage de rendez-vous
+de son identifiant : ses tours arrivent toujours au même processus, qui
+garde la session en mémoire. Le répartiteur attribue lui-même l'identifiant
+des nouvelles conversations, puis recopie telle quelle la réponse du
+processus (JSON ou flux SSE) vers le client, sans la décoder.
+
+Les sessions et l'historique en mémoire sont ainsi partitionnés par
+conversation ; les conversations sur disque sont partagées, si bien qu'un
+processus redémarré (ou un nombre de processus modifié) recharge les
+conversations qui lui reviennent. Les résultats des appels amont sont mis
+en commun dans un cache SQLite partagé (voir shared_cache), devant le cache
+en mémoire de chaque processus.
+
+Usage: python dispatcher.py [--workers 4] [--host 127.0.0.1] [--port 8000] [--tool-calling]
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from conversation_store import is_valid_conversation_id
+from server import Chatbot_Server, HTTP_Error, read_request, send_json, wait_disconnect
+from shared_cache import DEFAULT_PATH as SHARED_CACHE_PATH
+
+
+def worker_for(conversation_id: str, workers: int) -> int:
+    """Rendezvous hashing: the worker with the highest score for this ID"""
+    return max(
+        range(workers),
+        key=lambda index: hashlib.blake2b(f"{index}:{conversation_id}".encode(), digest_size=8).digest()
+    )
+
+
+def _worker_main(index: int, ready, options: Dict):
+    """Entry point of a worker process: a Chatbot_Server on an ephemeral local port"""
+    from conversation_store import shared_writer
+    from main import build_chatbot
+
+    writer = shared_writer()
+    writer.delay = options.pop("save_delay", writer.delay)
+    writer.fsync = options.pop("fsync", writer.fsync)
+    # Un seul cache amont pour tous les processus : un résultat n'est demandé qu'une fois
+    cache_path = options.pop("shared_cache", None)
+    if cache_path:
+        from resilience import use_shared_cache
+        from shared_cache import Shared_Cache
+
+        use_shared_cache(Shared_Cache(cache_path))
+    tool_calling = options.pop("tool_calling", False)
+    server = Chatbot_Server(
+        functools.partial(build_chatbot, tool_calling=tool_calling),
+        create_missing=True,
+        **options
+    )
+    try:
+        asyncio.run(server.serve_forever("127.0.0.1", 0, on_ready=lambda host, port: ready.put((index, os.getpid(), port))))
+    finally:
+        writer.close()
+
+
+class Worker:
+    __slots__ = ("index", "process", "port")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.port: Optional[int] = None
+
+
+class Dispatcher:
+    """
+    Front HTTP server routing each conversation to its worker process.
+
+    Args:
+        workers (int): Worker processes (default: one per CPU)
+        worker_options (Dict): Chatbot_Server arguments for the workers, plus tool_calling,
+            save_delay, fsync and shared_cache (SQLite path of the upstream cache shared by workers)
+        read_timeout (float): Seconds allowed to receive a client request
+        max_body_size (int): Largest accepted request body
+        start_timeout (float): Seconds allowed for a worker to start listening
+        shutdown_grace (float): Seconds given to in-flight requests on shutdown
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        worker_options: Optional[Dict] = None,
+        read_timeout: float = 10.0,
+        max_body_size: int = 1 << 20,
+        start_timeout: float = 60.0,
+        shutdown_grace: float = 30.0
+    ):
+        self.workers = [Worker(index) for index in range(workers or os.cpu_count() or 1)]
+        self.worker_options = dict(worker_options or {})
+        self.read_timeout = read_timeout
+        self.max_body_size = max_body_size
+        self.start_timeout = start_timeout
+        self.shutdown_grace = shutdown_grace
+        self.draining = False
+        # spawn : chaque processus repart d'un interpréteur neuf, sans threads hérités
+        self._context = multiprocessing.get_context("spawn")
+        self._ready = self._context.Queue()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = set()
+        self._monitor: Optional[asyncio.Task] = None
+
+    # ---- processus de travail ------------------------------------------
+
+    def _spawn(self, workers: List[Worker]):
+        """
+        Start processes for the given workers and wait until they listen.
+
+        Raises TimeoutError, after killing them, when some workers are not
+        listening within start_timeout.
+        """
+        for worker in workers:
+            worker.port = None
+            worker.process = self._context.Process(
+                target=_worker_main, args=(worker.index, self._ready, dict(self.worker_options)),
+                name=f"chatbot-worker-{worker.index}", daemon=True
+            )
+            worker.process.start()
+        # Les messages sont attribués par pid : celui, tardif, d'un processus remplacé est ignoré
+        waiting = {worker.process.pid: worker for worker in workers}
+        deadline = time.monotonic() + self.start_timeout
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                index, pid, port = self._ready.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                # Un processus mort avant d'écouter sera redémarré par la surveillance
+                for pid, worker in list(waiting.items()):
+                    if not worker.process.is_alive():
+                        del waiting[pid]
+                continue
+            worker = waiting.get(pid)
+            if worker is not None and worker.index == index:
+                worker.port = port
+                del waiting[pid]
+        if waiting:
+            for worker in waiting.values():
+                worker.process.kill()
+                worker.process.join(5.0)
+            late = sorted(worker.index for worker in waiting.values())
+            raise TimeoutError(f"processus {late} non prêts après {self.start_timeout:g} s")
+
+    async def _watch_workers(self):
+        """Restart workers whose process died"""
+        loop = asyncio.get_running_loop()
+        while not self.draining:
+            await asyncio.sleep(1.0)
+            dead = [w for w in self.workers if w.process is not None and not w.process.is_alive()]
+            if dead and not self.draining:
+                for worker in dead:
+                    print(f"Processus {worker.index} arrêté (code {worker.process.exitcode}), redémarrage")
+                try:
+                    await loop.run_in_executor(None, self._spawn, dead)
+                except Exception as e:
+                    # Les processus non prêts sont arrêtés : nouvel essai au tour suivant
+                    print(f"Redémarrage incomplet: {e}")
+
+    # ---- cycle de vie -------------------------------------------------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> Tuple[str, int]:
+        """Start the workers, then listen; return the bound (host, port)"""
+        await asyncio.get_running_loop().run_in_executor(None, self._spawn, self.workers)
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._monitor = asyncio.create_task(self._watch_workers())
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def shutdown(self):
+        """Stop accepting, let in-flight requests finish, then stop the workers gracefully"""
+        self.draining = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        if self._server is not None:
+            self._server.close()
+        pending = set(self._connections)
+        if pending:
+            _, still_pending = await asyncio.wait(pending, timeout=self.shutdown_grace)
+            for task in still_pending:
+                task.cancel()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGTERM)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is not None:
+                await loop.run_in_executor(None, worker.process.join, self.shutdown_grace)
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8000):
+        """Serve until SIGINT or SIGTERM, then shut down gracefully"""
+        bound_host, bound_port = await self.start(host, port)
+        print(f"Répartiteur sur http://{bound_host}:{bound_port}, {len(self.workers)} processus")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        print("Arrêt du répartiteur...")
+        await self.shutdown()
+
+    # ---- HTTP ---------------------------------------------------------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(
+                    read_request(reader, self.max_body_size), self.read_timeout
+                )
+                await self._dispatch(reader, writer, method, path, headers, body)
+            except HTTP_Error as e:
+                await send_json(writer, e.status, {"error": e.message})
+            except asyncio.TimeoutError:
+                await send_json(writer, 408, {"error": "Délai de lecture dépassé"})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                await send_json(writer, 500, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, reader, writer, method: str, path: str, headers: Dict[str, str], body: bytes):
+        route = path.split("?", 1)[0].rstrip("/") or "/"
+        if route == "/health":
+            await send_json(writer, 200, await self._health())
+            return
+        if self.draining:
+            raise HTTP_Error(503, "Serveur en cours d'arrêt")
+
+        if route == "/sessions" and method == "POST":
+            conversation_id = str(uuid.uuid4())
+            body = json.dumps({"conversation_id": conversation_id}).encode()
+        elif route.startswith("/sessions/") and method == "DELETE":
+            conversation_id = route[len("/sessions/"):]
+            if not is_valid_conversation_id(conversation_id):
+                raise HTTP_Error(400, "conversation_id invalide")
+        elif route == "/chat":
+            if method != "POST":
+                raise HTTP_Error(405, "Utiliser POST")
+            try:
+                data = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise HTTP_Error(400, "JSON invalide")
+            if not isinstance(data, dict):
+                raise HTTP_Error(400, "JSON invalide")
+            conversation_id = data.get("conversation_id")
+            if conversation_id is None or conversation_id == "":
+                # L'identifiant est fixé ici pour que le tour suivant revienne au même processus
+                conversation_id = data["conversation_id"] = str(uuid.uuid4())
+                body = json.dumps(data, ensure_ascii=False).encode()
+            elif not is_valid_conversation_id(conversation_id):
+                # Il devient un nom de fichier dans le processus : ni séparateur ni type inattendu
+                raise HTTP_Error(400, "conversation_id invalide (lettres, chiffres, _ et -, 64 au plus)")
+        else:
+            raise HTTP_Error(404, f"Route {route} inconnue")
+
+        worker = self.workers[worker_for(conversation_id, len(self.workers))]
+        await self._forward(worker, reader, writer, method, path, headers, body)
+
+    async def _forward(self, worker: Worker, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       method: str, path: str, headers: Dict[str, str], body: bytes):
+        """Send the request to the worker and copy its response back byte for byte"""
+        if worker.port is None:
+            raise HTTP_Error(503, f"Processus {worker.index} en cours de démarrage")
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", worker.port)
+        except OSError:
+            raise HTTP_Error(502, f"Processus {worker.index} injoignable")
+        try:
+            lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1",
+                     "Content-Type: application/json", f"Content-Length: {len(body)}", "Connection: close"]
+            if "accept" in headers:
+                lines.append(f"Accept: {headers['accept']}")
+            if "x-tenant" in headers:
+                lines.append(f"X-Tenant: {headers['x-tenant']}")
+            upstream_writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+            await upstream_writer.drain()
+            copy = asyncio.ensure_future(self._copy(upstream_reader, writer))
+            # Une réponse JSON n'écrit rien avant la fin du tour : le départ du
+            # client se voit à la fin de sa connexion
+            disconnected = asyncio.ensure_future(wait_disconnect(reader))
+            try:
+                await asyncio.wait({copy, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                disconnected.cancel()
+                if not copy.done():
+                    copy.cancel()
+            if not copy.cancelled():
+                copy.result()
+        finally:
+            # Client parti : fermer la connexion amont annule le tour côté processus
+            upstream_writer.close()
+
+    @staticmethod
+    async def _copy(upstream_reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Les processus ferment la connexion en fin de réponse
+        while True:
+            chunk = await upstream_reader.read(64 * 1024)
+            if not chunk:
+                break
+            writer.write(chunk)
+            await writer.drain()
+
+    async def _request_worker(self, worker: Worker, path: str) -> Dict:
+        reader, writer = await asyncio.open_connection("127.0.0.1", worker.port)
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        return json.loads(raw.partition(b"\r\n\r\n")[2] or b"{}")
+
+    async def _health(self) -> Dict:
+        async def worker_health(worker: Worker) -> Dict:
+            if worker.port is None:
+                return {"index": worker.index, "status": "starting"}
+            try:
+                health = await asyncio.wait_for(self._request_worker(worker, "/health"), 5.0)
+            except (OSError, asyncio.TimeoutError, ValueError):
+                return {"index": worker.index, "status": "unreachable"}
+            pid = worker.process.pid if worker.process is not None else None
+            return {"index": worker.index, "pid": pid, **health}
+
+        workers = await asyncio.gather(*(worker_health(w) for w in self.workers))
+        healthy = all(w.get("status") == "ok" for w in workers)
+        return {
+            "status": "draining" if self.draining else ("ok" if healthy else "degraded"),
+            "sessions": sum(w.get("sessions", 0) for w in workers),
+            "active_turns": sum(w.get("active_turns", 0) for w in workers),
+            "workers": workers
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-sessions", type=int, default=1000, help="par processus")
+    parser.add_argument("--max-concurrent-turns", type=int, default=32, help="par processus")
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--shutdown-grace", type=float, default=30.0)
+    parser.add_argument("--tool-calling", action="store_true",
+                        help="appel de fonctions natif au lieu du routeur")
+    parser.add_argument("--archive-idle-days", type=float, default=7.0,
+                        help="archiver les conversations inactives depuis N jours (0: jamais)")
+    parser.add_argument("--save-delay", type=float, default=0.0,
+                        help="secondes d'attente d'une sauvegarde, pour regrouper les tours rapprochés")
+    parser.add_argument("--fsync", action="store_true", help="synchroniser chaque sauvegarde sur disque")
+    parser.add_argument("--shared-cache", metavar="PATH", default=SHARED_CACHE_PATH,
+                        help="cache SQLite des résultats amont partagé par les workers ('': un cache par worker)")
+    args = parser.parse_args()
+
+    from conversation_store import Conversation_Archiver
+
+    dispatcher = Dispatcher(
+        args.workers,
+        worker_options={
+            "max_sessions": args.max_sessions,
+            "max_concurrent_turns": args.max_concurrent_turns,
+            "turn_timeout": args.turn_timeout,
+            "shutdown_grace": args.shutdown_grace,
+            "tool_calling": args.tool_calling,
+            "save_delay": args.save_delay,
+            "fsync": args.fsync,
+            "shared_cache": args.shared_cache,
+        },
+        shutdown_grace=args.shutdown_grace
+    )
+    # Un seul archiveur pour tous les processus
+    archiver = None
+    if args.archive_idle_days > 0:
+        archiver = Conversation_Archiver(idle_after=args.archive_idle_days * 86400).start()
+    try:
+        asyncio.run(dispatcher.serve_forever(args.host, args.port))
+    finally:
+        if archiver is not None:
+            archiver.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Synchronisation incrémentale des actualités et du calendrier des résultats.
+
+Chaque symbole garde localement ses éléments déjà reçus, dédupliqués, avec
+un point haut (date la plus récente reçue) et la date à partir de laquelle
+l'historique est complet. Une synchronisation ne demande à FMP que ce qui
+est postérieur au point haut, page par page, et s'arrête à la première page
+sans élément nouveau ; une plage plus ancienne que l'historique local est
+complétée une seule fois. Les fonctions servent ensuite depuis ce stock.
+
+- Actualités : éléments immuables, identifiés par leur URL.
+- Calendrier des résultats : une publication par date, mise à jour quand
+  l'estimation ou le résultat change ; l'historique complet est chargé une
+  fois, puis seules les dernières publications sont relues.
+
+Chaque flux est conservé dans data/feeds/<flux>/<SYMBOLE>.json.
+"""
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import storage
+from llm import get_env, requests
+
+# Fenêtre chargée à la première demande d'actualités sans date de début
+DEFAULT_NEWS_DAYS = 30
+# Symboles acceptés dans un chemin de fichier (ils viennent du routeur), comme statements_store
+SYMBOL_PATTERN = re.compile(r"^(?=.*[A-Z0-9])[A-Z0-9.\-^]{1,15}$")
+# Actualités servies par page locale
+NEWS_PAGE_SIZE = 50
+# Pages demandées au plus par synchronisation
+MAX_SYNC_PAGES = 10
+# Publications relues à chaque mise à jour du calendrier (à venir et récentes)
+EARNINGS_REFRESH = 8
+DEFAULT_EARNINGS_LIMIT = 5
+
+
+class Symbol_Feed:
+    """Deduplicated records of one symbol's feed, with its sync state"""
+    __slots__ = ("symbol", "records", "high_water", "covered_from", "complete", "synced_at", "mtime", "_sorted")
+
+    def __init__(self, symbol: str, records: Optional[Dict[str, Dict]] = None, high_water: str = "",
+                 covered_from: Optional[str] = None, complete: bool = False, synced_at: float = 0.0):
+        self.symbol = symbol
+        # clé de déduplication -> élément
+        self.records: Dict[str, Dict] = records or {}
+        self.high_water = high_water
+        self.covered_from = covered_from
+        self.complete = complete
+        self.synced_at = synced_at
+        self.mtime = 0.0
+        self._sorted: Optional[List[Dict]] = None
+
+    def merge(self, records: List[Dict], key_field: str, date_field: str, update: bool) -> int:
+        """Add new records (and replace changed ones if update); return how many changed"""
+        changed = 0
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            key = _record_key(record, key_field, date_field)
+            previous = self.records.get(key)
+            if previous is None or (update and previous != record):
+                self.records[key] = record
+                changed += 1
+            self.high_water = max(self.high_water, str(record.get(date_field, "")))
+        if changed:
+            self._sorted = None
+        return changed
+
+    def items(self, date_field: str) -> List[Dict]:
+        """Records, most recent first"""
+        if self._sorted is None:
+            self._sorted = sorted(self.records.values(), key=lambda r: str(r.get(date_field, "")), reverse=True)
+        return self._sorted
+
+    def window(self, date_field: str, from_date: Optional[str], to_date: Optional[str]) -> List[Dict]:
+        return [
+            r for r in self.items(date_field)
+            if (from_date is None or str(r.get(date_field, ""))[:10] >= from_date)
+            and (to_date is None or str(r.get(date_field, ""))[:10] <= to_date)
+        ]
+
+    def to_dict(self, date_field: str) -> Dict:
+        return {
+            "symbol": self.symbol, "high_water": self.high_water, "covered_from": self.covered_from,
+            "complete": self.complete, "synced_at": self.synced_at, "records": self.items(date_field)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, key_field: str, date_field: str) -> "Symbol_Feed":
+        records = {_record_key(r, key_field, date_field): r for r in data.get("records", [])}
+        return cls(data["symbol"], records, data.get("high_water", ""), data.get("covered_from"),
+                   data.get("complete", False), data.get("synced_at", 0.0))
+
+
+def _record_key(record: Dict, key_field: str, date_field: str) -> str:
+    key = record.get(key_field)
+    if key:
+        return str(key)
+    return f"{record.get(date_field, '')}|{record.get('title', '')}"
+
+
+class Feed_Store:
+    """
+    Per-symbol news and earnings calendar, synced incrementally from FMP.
+
+    Args:
+        root (str): Storage folder
+        refresh_interval (float): Seconds during which a synced feed is served without calling FMP
+        max_pages (int): Pages fetched at most per sync
+    """
+
+    # flux -> (endpoint, clé de déduplication, champ de date, éléments modifiables)
+    FEEDS = {
+        "news": ("https://financialmodelingprep.com/api/v3/stock_news", "url", "publishedDate", False),
+        "earnings": ("https://financialmodelingprep.com/api/v3/historical/earning_calendar/", "date", "date", True),
+    }
+
+    def __init__(self, root: str = "data/feeds", refresh_interval: float = 60.0, max_pages: int = MAX_SYNC_PAGES):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self.max_pages = max_pages
+        self._feeds: Dict[Tuple[str, str], Symbol_Feed] = {}
+        # Un verrou par flux : deux questions simultanées ne déclenchent qu'une synchronisation
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _path(self, feed: str, symbol: str) -> str:
+        if not SYMBOL_PATTERN.match(symbol):
+            raise ValueError(f"Symbole invalide: {symbol!r}")
+        return os.path.join(self.root, feed, symbol)
+
+    def _feed_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load(self, feed: str, symbol: str) -> Symbol_Feed:
+        """In-memory feed, reloaded when another process rewrote its file"""
+        _, key_field, date_field, _ = self.FEEDS[feed]
+        cached = self._feeds.get((feed, symbol))
+        path = storage.find_file(self._path(feed, symbol))
+        mtime = os.path.getmtime(path) if path is not None else 0.0
+        if cached is not None and mtime <= cached.mtime:
+            return cached
+        loaded = Symbol_Feed(symbol)
+        if path is not None:
+            try:
+                loaded = Symbol_Feed.from_dict(storage.read_file(path), key_field, date_field)
+            except (OSError, ValueError, KeyError):
+                pass
+        loaded.mtime = mtime
+        self._feeds[(feed, symbol)] = loaded
+        return loaded
+
+    def _save(self, feed: str, symbol_feed: Symbol_Feed):
+        _, _, date_field, _ = self.FEEDS[feed]
+        base = self._path(feed, symbol_feed.symbol)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        path = storage.write_file(base, symbol_feed.to_dict(date_field))
+        symbol_feed.mtime = os.path.getmtime(path)
+
+    def _get(self, url: str, params: Dict) -> Any:
+        from fonction import fmp_get
+
+        self.requests += 1
+        response = fmp_get(url, {**params, 'apikey': get_env('FMP_API_KEY')})
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_pages(self, symbol_feed: Symbol_Feed, from_date: str, to_date: str,
+                     forward: bool = False) -> Tuple[Optional[Any], str]:
+        """
+        Fetch news pages of a window, most recent first, until one brings nothing new.
+
+        Going forward from the high-water mark, a page holding any known item
+        is the last one. Returns an FMP error payload (or None) and the date
+        from which the window is now complete: from_date, or the oldest date
+        reached when the page budget ran out first.
+        """
+        url, key_field, date_field, update = self.FEEDS["news"]
+        oldest = to_date
+        for page in range(self.max_pages):
+            records = self._get(url, {'tickers': symbol_feed.symbol, 'from': from_date, 'to': to_date, 'page': page})
+            if not isinstance(records, list):
+                return records, from_date
+            records = [r for r in records if isinstance(r, dict)]
+            added = symbol_feed.merge(records, key_field, date_field, update)
+            if not added or (forward and added < len(records)):
+                return None, from_date
+            oldest = min([oldest] + [str(r.get(date_field, ""))[:10] for r in records])
+        return None, max(from_date, oldest)
+
+    def _sync(self, sync, feed: str, symbol: str, *args) -> Optional[Any]:
+        """Run a sync; on a network error, serve the local records if there are any"""
+        try:
+            return sync(symbol, *args)
+        except requests.exceptions.RequestException:
+            if not self._load(feed, symbol).records:
+                raise
+            return None
+
+    # ---- actualités ---------------------------------------------------
+
+    def sync_news(self, symbol: str, from_date: Optional[str] = None, to_date: Optional[str] = None) -> Optional[Any]:
+        """
+        Bring a symbol's news up to date for the window.
+
+        Only items after the high-water mark are requested, plus, once, any
+        part of the window older than the local history. Returns an FMP
+        error payload when nothing could be stored, None otherwise.
+        """
+        today = date.today().isoformat()
+        start = from_date or (date.today() - timedelta(days=DEFAULT_NEWS_DAYS)).isoformat()
+        with self._feed_lock(("news", symbol)):
+            symbol_feed = self._load("news", symbol)
+            changed = False
+            error = None
+            # Éléments postérieurs au point haut (inutile si la fenêtre s'arrête avant)
+            stale = time.time() - symbol_feed.synced_at >= self.refresh_interval
+            if stale and (to_date is None or not symbol_feed.high_water or to_date >= symbol_feed.high_water[:10]):
+                since = symbol_feed.high_water[:10] or start
+                error, complete_from = self._fetch_pages(symbol_feed, since, today, forward=True)
+                if error is None:
+                    symbol_feed.synced_at = time.time()
+                    # Budget de pages épuisé avant le point haut : l'historique n'est continu qu'à partir de là
+                    if symbol_feed.covered_from is None or complete_from > since:
+                        symbol_feed.covered_from = complete_from
+                    changed = True
+            # Partie de la fenêtre antérieure à l'historique local, chargée une fois
+            if error is None and symbol_feed.covered_from is not None and start < symbol_feed.covered_from:
+                error, complete_from = self._fetch_pages(symbol_feed, start, symbol_feed.covered_from)
+                if error is None:
+                    symbol_feed.covered_from = complete_from
+                    changed = True
+            if changed:
+                self._save("news", symbol_feed)
+            return error if not symbol_feed.records else None
+
+    def news(self, symbol: str, from_date: Optional[str] = None, to_date: Optional[str] = None,
+             page: int = 0) -> Any:
+        """One page of a symbol's news for the window, most recent first, after syncing"""
+        error = _date_error(from_date, to_date)
+        if error is not None:
+            return error
+        symbol = symbol.strip().upper()
+        error = self._sync(self.sync_news, "news", symbol, from_date, to_date)
+        if error is not None:
+            return error
+        items = self._feeds[("news", symbol)].window("publishedDate", from_date, to_date)
+        return items[page * NEWS_PAGE_SIZE:(page + 1) * NEWS_PAGE_SIZE]
+
+    # ---- calendrier des résultats ------------------------------------
+
+    def sync_earnings(self, symbol: str) -> Optional[Any]:
+        """Load the full calendar once, then re-read only the latest publications"""
+        url, key_field, date_field, update = self.FEEDS["earnings"]
+        key = ("earnings", symbol)
+        with self._feed_lock(key):
+            symbol_feed = self._load("earnings", symbol)
+            if symbol_feed.complete and time.time() - symbol_feed.synced_at < self.refresh_interval:
+                return None
+            params = {'limit': EARNINGS_REFRESH} if symbol_feed.complete else {}
+            records = self._get(f"{url}{symbol}", params)
+            if not isinstance(records, list):
+                return records if not symbol_feed.records else None
+            symbol_feed.merge(records, key_field, date_field, update)
+            symbol_feed.complete = True
+            symbol_feed.synced_at = time.time()
+            self._save("earnings", symbol_feed)
+            return None
+
+    def earnings(self, symbol: str, limit: Optional[int] = None, from_date: Optional[str] = None,
+                 to_date: Optional[str] = None) -> Any:
+        """Latest publications of a symbol, bounded by count and/or dates, after syncing"""
+        error = _date_error(from_date, to_date)
+        if error is not None:
+            return error
+        symbol = symbol.strip().upper()
+        if limit is None and from_date is None and to_date is None:
+            limit = DEFAULT_EARNINGS_LIMIT
+        error = self._sync(self.sync_earnings, "earnings", symbol)
+        if error is not None:
+            return error
+        items = self._feeds[("earnings", symbol)].window("date", from_date, to_date)
+        return items[:limit] if limit is not None else items
+
+
+def _date_error(from_date: Optional[str], to_date: Optional[str]) -> Optional[List[Dict]]:
+    """Same error payload as fmp_history for a bound that is not a YYYY-MM-DD date"""
+    from fonction import _is_date
+
+    for name, value in (("from_date", from_date), ("to_date", to_date)):
+        if not _is_date(value):
+            return [{"error": f"{name} invalide: {value!r} (format attendu: YYYY-MM-DD)"}]
+    return None
+
+
+_default_feed_store: Optional[Feed_Store] = None
+
+
+def default_feed_store() -> Feed_Store:
+    global _default_feed_store
+    if _default_feed_store is None:
+        _default_feed_store = Feed_Store()
+    return _default_feed_store
@@ -1,10 +1,161 @@
-import requests
-from typing import Optional, Dict, Union
-from dotenv import load_dotenv
+import importlib
+import time
+from datetime import date
+from typing import Optional, Dict, List, Union
+
+# requests et python-dotenv ne sont chargés qu'au premier appel d'une fonction
+from json_extract import Field_Spec
+from llm import get_env, requests
+from resilience import Stale_Cache, http_get
+
+# Champs conservés par moteur SerpAPI (voir json_extract) : les résultats
+# principaux tronqués, sans les métadonnées de recherche ni le HTML
+SERPAPI_FIELDS: Dict[str, Field_Spec] = {
+    "google": {"error": None, "search_information": None, "answer_box": None, "knowledge_graph": None,
+               "organic_results": 10, "top_stories": 5, "related_questions": 5},
+    "google_jobs": {"error": None, "jobs_results": 10},
+    "google_shopping": {"error": None, "shopping_results": 10, "inline_shopping_results": 5},
+    "google_news": {"error": None, "news_results": 15},
+    "google_trends": {"error": None, "interest_over_time": None, "related_queries": None,
+                      "related_topics": None, "interest_by_region": 10},
+    "google_scholar": {"error": None, "organic_results": 10},
+    "google_events": {"error": None, "events_results": 10},
+    "google_flights": {"error": None, "best_flights": 5, "other_flights": 5, "price_insights": None},
+    "google_hotels": {"error": None, "properties": 10},
+    "google_food": {"error": None, "local_results": 10, "food_results": 10},
+    "apple_app_store": {"error": None, "organic_results": 10},
+    "youtube": {"error": None, "video_results": 10},
+    "ebay": {"error": None, "organic_results": 10},
+}
+
+# Vue d'ensemble FMP : les historiques volumineux sont limités aux entrées récentes
+OUTLOOK_FIELDS: Field_Spec = {
+    "Error Message": None, "profile": None, "metrics": None, "ratios": 1, "rating": 1,
+    "keyExecutives": 10, "insideTrades": 5, "splitHistory": 5, "stockDividend": 4, "stockNews": 5,
+    "financialsAnnual": {"income": 2, "balance": 2, "cash": 2},
+}
+
+
+def fmp_get(url: str, params: Dict, fields: Field_Spec = None):
+    """GET sur l'API FMP avec délai, disjoncteur et cache stale-while-revalidate"""
+    return http_get("fmp", url, params, fields)
+
+
+def serpapi_get(url: str, params: Dict):
+    """GET sur SerpAPI, seuls les champs utiles au moteur demandé étant extraits du flux"""
+    return http_get("serpapi", url, params, SERPAPI_FIELDS.get(params.get("engine")))
+
+
+# Nombre de périodes retournées par défaut par les endpoints d'historique
+DEFAULT_HISTORY_LIMIT = 5
+# Les historiques changent au plus une fois par trimestre
+HISTORY_TTL = 3600.0
+_history_cache = Stale_Cache(max_entries=512, namespace="history")
+
+
+def _periods_since(from_date: str, period: Optional[str]) -> int:
+    """Nombre de périodes entre from_date et aujourd'hui, pour borner la requête"""
+    years = date.today().year - int(from_date[:4]) + 1
+    per_year = 1 if period == "annual" else 4
+    return max(1, years * per_year + per_year)
+
+
+def _coverage(limit: Optional[int], records: List[Dict]) -> float:
+    """Nombre de périodes garanties par un historique en cache (inf: historique complet)"""
+    if limit is None or len(records) < limit:
+        return float("inf")
+    return limit
+
+
+def _covers(limit: Optional[int], records: List[Dict], wanted: Optional[int], from_date: Optional[str],
+            to_date: Optional[str] = None) -> bool:
+    """Indique si un historique en cache contient toutes les périodes demandées"""
+    if _coverage(limit, records) == float("inf"):
+        return True
+    if wanted is None and from_date is None:
+        return False
+    if from_date is not None:
+        # Le cache contient les périodes les plus récentes : la plage est couverte jusqu'à sa plus ancienne
+        return bool(records) and str(records[-1].get("date", ""))[:10] <= from_date
+    # Les `wanted` dernières périodes avant to_date doivent toutes être en cache
+    available = sum(1 for r in records if to_date is None or str(r.get("date", ""))[:10] <= to_date)
+    return available >= wanted
+
+
+def _is_date(value: Optional[str]) -> bool:
+    """Indique si value est une date YYYY-MM-DD valide (None accepté)"""
+    if value is None:
+        return True
+    try:
+        return isinstance(value, str) and len(value) == 10 and date.fromisoformat(value) is not None
+    except ValueError:
+        return False
+
+
+def fmp_history(
+    url: str,
+    period: Optional[str] = None,
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
+    """
+    Récupère un historique FMP (périodes les plus récentes en premier) borné
+    par nombre de périodes et/ou par dates.
+
+    Un historique plus long déjà en cache sert les demandes plus courtes sans
+    nouvel appel; la clé de cache ignore donc limit et les dates.
+
+    Args:
+        url (str): URL de l'endpoint, symbole inclus
+        period (str): Période ('annual' ou 'quarter'), None si non applicable
+        limit (int): Nombre maximum de périodes (défaut: DEFAULT_HISTORY_LIMIT sans plage de dates)
+        from_date (str): Date de début incluse (YYYY-MM-DD)
+        to_date (str): Date de fin incluse (YYYY-MM-DD)
+
+    Returns:
+        List[Dict]: Périodes retenues
+    """
+    for name, value in (("from_date", from_date), ("to_date", to_date)):
+        if not _is_date(value):
+            return [{"error": f"{name} invalide: {value!r} (format attendu: YYYY-MM-DD)"}]
+    if limit is None and from_date is None and to_date is None:
+        limit = DEFAULT_HISTORY_LIMIT
+
+    key = (url, period)
+    entry = _history_cache.get(key, max_age=HISTORY_TTL)
+    fresh = entry is not None and time.time() - entry[0] < HISTORY_TTL
+    if fresh and _covers(entry[1][0], entry[1][1], limit, from_date, to_date):
+        records = entry[1][1]
+    else:
+        fetch_limit = limit
+        if from_date is not None:
+            # Une plage de dates se traduit en nombre de périodes à demander
+            fetch_limit = max(limit or 0, _periods_since(from_date, period))
+        elif to_date is not None:
+            fetch_limit = None
+        params = {'apikey': get_env('FMP_API_KEY')}
+        if period is not None:
+            params['period'] = period
+        if fetch_limit is not None:
+            params['limit'] = fetch_limit
+        response = fmp_get(url, params)
+        response.raise_for_status()
+        records = response.json()
+        if not isinstance(records, list):
+            return records
+        # On ne remplace pas un historique plus long encore valide
+        if not fresh or _coverage(fetch_limit, records) >= _coverage(*entry[1]):
+            _history_cache.put(key, (fetch_limit, records))
+
+    if from_date is not None or to_date is not None:
+        records = [
+            r for r in records
+            if (from_date is None or str(r.get("date", "")) >= from_date)
+            and (to_date is None or str(r.get("date", ""))[:10] <= to_date)
+        ]
+    return records[:limit] if limit is not None else list(records)
 
-# Charger les variables d'environnement
-load_dotenv()
-FMP_API_KEY = os.getenv('FMP_API_KEY')
 
 def get_stock_info(symbol: str) -> Dict[str, Union[str, float]]:
     """
@@ -19,9 +170,9 @@ def get_stock_info(symbol: str) -> Dict[str, Union[str, float]]:
     base_url = "https://financialmodelingprep.com/api/v3/profile/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         
@@ -61,13 +212,13 @@ def search_stocks(query: str, limit: int = 10, exchange: str = "NASDAQ") -> List
     base_url = "https://financialmodelingprep.com/api/v3/search"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             base_url,
-            params={
+            {
                 'query': query,
                 'limit': limit,
                 'exchange': exchange,
-                'apikey': FMP_API_KEY
+                'apikey': get_env('FMP_API_KEY')
             }
         )
         response.raise_for_status()
@@ -88,9 +239,9 @@ def get_stock_quote(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v3/quote/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         data = response.json()
@@ -111,9 +262,9 @@ def get_stock_price_change(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v3/stock-price-change/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         data = response.json()
@@ -121,7 +272,14 @@ def get_stock_price_change(symbol: str) -> Dict:
     except requests.exceptions.RequestException as e:
         return {"error": f"Erreur lors de la requête: {str(e)}"}
 
-def get_financial_statements(symbol: str, statement_type: str = "income", period: str = "annual") -> List[Dict]:
+def get_financial_statements(
+    symbol: str,
+    statement_type: str = "income",
+    period: str = "annual",
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
     """
     Obtient les états financiers d'une entreprise.
     
@@ -129,6 +287,9 @@ def get_financial_statements(symbol: str, statement_type: str = "income", period
         symbol (str): Symbole de l'action
         statement_type (str): Type d'état financier ('income', 'balance', 'cash')
         period (str): Période ('annual' ou 'quarter')
+        limit (int): Nombre de périodes les plus récentes (défaut: 5 sans plage de dates)
+        from_date (str): Date de début optionnelle (YYYY-MM-DD)
+        to_date (str): Date de fin optionnelle (YYYY-MM-DD)
     
     Returns:
         List[Dict]: États financiers
@@ -142,25 +303,26 @@ def get_financial_statements(symbol: str, statement_type: str = "income", period
     base_url = f"https://financialmodelingprep.com/api/v3/{statement_types.get(statement_type, 'income-statement')}/"
     
     try:
-        response = requests.get(
-            f"{base_url}{symbol}",
-            params={
-                'period': period,
-                'apikey': FMP_API_KEY
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return fmp_history(f"{base_url}{symbol}", period, limit, from_date, to_date)
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
-def get_key_metrics(symbol: str, period: str = "annual") -> List[Dict]:
+def get_key_metrics(
+    symbol: str,
+    period: str = "annual",
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
     """
     Obtient les métriques clés d'une entreprise.
     
     Args:
         symbol (str): Symbole de l'action
         period (str): Période ('annual' ou 'quarter')
+        limit (int): Nombre de périodes les plus récentes (défaut: 5 sans plage de dates)
+        from_date (str): Date de début optionnelle (YYYY-MM-DD)
+        to_date (str): Date de fin optionnelle (YYYY-MM-DD)
     
     Returns:
         List[Dict]: Métriques clés
@@ -168,25 +330,26 @@ def get_key_metrics(symbol: str, period: str = "annual") -> List[Dict]:
     base_url = "https://financialmodelingprep.com/api/v3/key-metrics/"
     
     try:
-        response = requests.get(
-            f"{base_url}{symbol}",
-            params={
-                'period': period,
-                'apikey': FMP_API_KEY
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return fmp_history(f"{base_url}{symbol}", period, limit, from_date, to_date)
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
-def get_financial_ratios(symbol: str, period: str = "annual") -> List[Dict]:
+def get_financial_ratios(
+    symbol: str,
+    period: str = "annual",
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
     """
     Obtient les ratios financiers d'une entreprise.
     
     Args:
         symbol (str): Symbole de l'action
         period (str): Période ('annual' ou 'quarter')
+        limit (int): Nombre de périodes les plus récentes (défaut: 5 sans plage de dates)
+        from_date (str): Date de début optionnelle (YYYY-MM-DD)
+        to_date (str): Date de fin optionnelle (YYYY-MM-DD)
     
     Returns:
         List[Dict]: Ratios financiers
@@ -194,15 +357,7 @@ def get_financial_ratios(symbol: str, period: str = "annual") -> List[Dict]:
     base_url = "https://financialmodelingprep.com/api/v3/ratios/"
     
     try:
-        response = requests.get(
-            f"{base_url}{symbol}",
-            params={
-                'period': period,
-                'apikey': FMP_API_KEY
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return fmp_history(f"{base_url}{symbol}", period, limit, from_date, to_date)
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
@@ -219,9 +374,10 @@ def get_company_outlook(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v4/company-outlook/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')},
+            OUTLOOK_FIELDS
         )
         response.raise_for_status()
         return response.json()
@@ -241,9 +397,9 @@ def get_stock_peers(symbol: str) -> List[str]:
     base_url = "https://financialmodelingprep.com/api/v4/stock_peers/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         data = response.json()
@@ -264,9 +420,9 @@ def get_company_notes(symbol: str) -> List[Dict]:
     base_url = "https://financialmodelingprep.com/api/v4/company-notes/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         return response.json()
@@ -286,9 +442,9 @@ def get_key_executives(symbol: str) -> List[Dict]:
     base_url = "https://financialmodelingprep.com/api/v3/key-executives/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         return response.json()
@@ -308,9 +464,9 @@ def get_market_cap(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v3/market-capitalization/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')}
         )
         response.raise_for_status()
         data = response.json()
@@ -318,13 +474,22 @@ def get_market_cap(symbol: str) -> Dict:
     except requests.exceptions.RequestException as e:
         return {"error": f"Erreur lors de la requête: {str(e)}"}
 
-def get_financial_growth(symbol: str, period: str = "annual") -> List[Dict]:
+def get_financial_growth(
+    symbol: str,
+    period: str = "annual",
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
     """
     Obtient les métriques de croissance financière.
     
     Args:
         symbol (str): Symbole de l'action
         period (str): Période ('annual' ou 'quarter')
+        limit (int): Nombre de périodes les plus récentes (défaut: 5 sans plage de dates)
+        from_date (str): Date de début optionnelle (YYYY-MM-DD)
+        to_date (str): Date de fin optionnelle (YYYY-MM-DD)
     
     Returns:
         List[Dict]: Métriques de croissance
@@ -332,15 +497,7 @@ def get_financial_growth(symbol: str, period: str = "annual") -> List[Dict]:
     base_url = "https://financialmodelingprep.com/api/v3/financial-growth/"
     
     try:
-        response = requests.get(
-            f"{base_url}{symbol}",
-            params={
-                'period': period,
-                'apikey': FMP_API_KEY
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return fmp_history(f"{base_url}{symbol}", period, limit, from_date, to_date)
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
@@ -357,11 +514,11 @@ def get_company_score(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v4/score"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             base_url,
-            params={
+            {
                 'symbol': symbol,
-                'apikey': FMP_API_KEY
+                'apikey': get_env('FMP_API_KEY')
             }
         )
         response.raise_for_status()
@@ -382,18 +539,23 @@ def get_dcf_analysis(symbol: str) -> Dict:
     base_url = "https://financialmodelingprep.com/api/v3/discounted-cash-flow/"
     
     try:
-        response = requests.get(
+        response = fmp_get(
             f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
+            {'apikey': get_env('FMP_API_KEY')},
+            1
         )
         response.raise_for_status()
-        return response.json()[0] if response.json() else {"error": "Aucune donnée DCF trouvée"}
+        data = response.json()
+        return data[0] if data else {"error": "Aucune donnée DCF trouvée"}
     except requests.exceptions.RequestException as e:
         return {"error": f"Erreur lors de la requête: {str(e)}"}
 
 def get_stock_news(symbol: str, from_date: str, to_date: str, page: int = 0) -> List[Dict]:
     """
     Obtient les actualités liées à l'action.
+
+    Servies depuis le stock local (feed_store), qui ne demande à FMP que les
+    actualités publiées depuis la dernière synchronisation.
     
     Args:
         symbol (str): Symbole de l'action
@@ -404,54 +566,51 @@ def get_stock_news(symbol: str, from_date: str, to_date: str, page: int = 0) ->
     Returns:
         List[Dict]: Actualités
     """
-    base_url = "https://financialmodelingprep.com/api/v3/stock_news"
-    
+    from feed_store import default_feed_store
+
     try:
-        response = requests.get(
-            base_url,
-            params={
-                'tickers': symbol,
-                'from': from_date,
-                'to': to_date,
-                'page': page,
-                'apikey': FMP_API_KEY
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return default_feed_store().news(symbol, from_date, to_date, page)
+    except ValueError as e:
+        return [{"error": str(e)}]
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
-def get_earnings_calendar(symbol: str) -> List[Dict]:
+def get_earnings_calendar(
+    symbol: str,
+    limit: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> List[Dict]:
     """
     Obtient le calendrier des résultats.
+
+    Servi depuis le stock local (feed_store) : l'historique est chargé une
+    fois, puis seules les dernières publications sont relues.
     
     Args:
         symbol (str): Symbole de l'action
+        limit (int): Nombre de publications les plus récentes (défaut: 5 sans plage de dates)
+        from_date (str): Date de début optionnelle (YYYY-MM-DD)
+        to_date (str): Date de fin optionnelle (YYYY-MM-DD)
     
     Returns:
         List[Dict]: Calendrier des résultats
     """
-    base_url = "https://financialmodelingprep.com/api/v3/historical/earning_calendar/"
-    
+    from feed_store import default_feed_store
+
     try:
-        response = requests.get(
-            f"{base_url}{symbol}",
-            params={'apikey': FMP_API_KEY}
-        )
-        response.raise_for_status()
-        return response.json()
+        return default_feed_store().earnings(symbol, limit, from_date, to_date)
+    except ValueError as e:
+        return [{"error": str(e)}]
     except requests.exceptions.RequestException as e:
         return [{"error": f"Erreur lors de la requête: {str(e)}"}]
 
-SERPAPI_API_KEY = os.getenv('SERPAPI_API_KEY')
-
 def google_search(query: str, domain: str = "google.com", country: str = "us", language: str = "en") -> Dict:
     """
     Effectue une recherche Google générale.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google',
         'q': query,
         'google_domain': domain,
@@ -459,7 +618,7 @@ def google_search(query: str, domain: str = "google.com", country: str = "us", l
         'hl': language
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_jobs_search(query: str, domain: str = "google.com") -> Dict:
@@ -467,13 +626,13 @@ def google_jobs_search(query: str, domain: str = "google.com") -> Dict:
     Recherche des offres d'emploi sur Google Jobs.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_jobs',
         'google_domain': domain,
         'q': query
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_shopping_search(query: str, domain: str = "google.com") -> Dict:
@@ -481,13 +640,13 @@ def google_shopping_search(query: str, domain: str = "google.com") -> Dict:
     Recherche des produits sur Google Shopping.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_shopping',
         'google_domain': domain,
         'q': query
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_news_search(language: str = "en", country: str = "us") -> Dict:
@@ -495,13 +654,13 @@ def google_news_search(language: str = "en", country: str = "us") -> Dict:
     Recherche des actualités sur Google News.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_news',
         'hl': language,
         'gl': country
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_trends_search(query: str) -> Dict:
@@ -509,12 +668,12 @@ def google_trends_search(query: str) -> Dict:
     Recherche des tendances sur Google Trends.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_trends',
         'q': query
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_scholar_search(query: str, language: str = "en") -> Dict:
@@ -522,13 +681,13 @@ def google_scholar_search(query: str, language: str = "en") -> Dict:
     Recherche des articles académiques sur Google Scholar.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_scholar',
         'q': query,
         'hl': language
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_events_search(query: str, language: str = "en", country: str = "us") -> Dict:
@@ -536,14 +695,14 @@ def google_events_search(query: str, language: str = "en", country: str = "us")
     Recherche des événements sur Google Events.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_events',
         'q': query,
         'hl': language,
         'gl': country
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_flights_search(
@@ -558,7 +717,7 @@ def google_flights_search(
     Recherche des vols sur Google Flights.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_flights',
         'hl': language,
         'gl': country,
@@ -568,7 +727,7 @@ def google_flights_search(
         'return_date': return_date
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_hotels_search(
@@ -581,7 +740,7 @@ def google_hotels_search(
     Recherche des hôtels sur Google Hotels.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_hotels',
         'q': query,
         'hl': language,
@@ -589,7 +748,7 @@ def google_hotels_search(
         'check_out_date': check_out
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def google_food_search(query: str, language: str = "en") -> Dict:
@@ -597,13 +756,13 @@ def google_food_search(query: str, language: str = "en") -> Dict:
     Recherche de nourriture sur Google Food.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'google_food',
         'q': query,
         'hl': language
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def apple_app_store_search(term: str, page: int = 0, num: int = 10) -> Dict:
@@ -611,14 +770,14 @@ def apple_app_store_search(term: str, page: int = 0, num: int = 10) -> Dict:
     Recherche des applications sur l'App Store d'Apple.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'apple_app_store',
         'term': term,
         'page': page,
         'num': num
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def youtube_search(query: str) -> Dict:
@@ -626,12 +785,12 @@ def youtube_search(query: str) -> Dict:
     Recherche des vidéos sur YouTube.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'youtube',
         'search_query': query
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
 
 def ebay_search(query: str) -> Dict:
@@ -639,20 +798,74 @@ def ebay_search(query: str) -> Dict:
     Recherche des produits sur eBay.
     """
     params = {
-        'api_key': SERPAPI_API_KEY,
+        'api_key': get_env('SERPAPI_API_KEY'),
         'engine': 'ebay',
         '_nkw': query
     }
     
-    response = requests.get('https://serpapi.com/search', params=params)
+    response = serpapi_get('https://serpapi.com/search', params)
     return response.json()
     
+class Function_Entry(dict):
+    """
+    Entrée du registre des fonctions dont l'implémentation est résolue à la demande.
+
+    La cible est un nom de fonction de ce module ou un chemin 'module:fonction';
+    le module n'est importé qu'au premier accès à la clé 'function'.
+    """
+
+    def __init__(self, target: str, **spec):
+        super().__init__(**spec)
+        self.target = target
+
+    def __missing__(self, key):
+        if key != "function":
+            raise KeyError(key)
+        module_name, _, attr = self.target.rpartition(":")
+        module = importlib.import_module(module_name or __name__)
+        func = getattr(module, attr)
+        self["function"] = func
+        return func
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key == "function" or super().__contains__(key)
+
+
+def register_function(
+    function_id: int,
+    target: str,
+    description: str,
+    parameters: Dict[str, str]
+) -> Function_Entry:
+    """
+    Enregistre une fonction dans functions_dict sans importer son implémentation.
+
+    Args:
+        function_id (int): Identifiant utilisé par le routeur
+        target (str): Nom de la fonction ou chemin 'module:fonction'
+        description (str): Description présentée au routeur
+        parameters (Dict[str, str]): Paramètres attendus
+
+    Returns:
+        Function_Entry: Entrée ajoutée au registre
+    """
+    entry = Function_Entry(target, description=description, parameters=parameters)
+    functions_dict[function_id] = entry
+    return entry
+
+
 # Mise à jour du dictionnaire des fonctions disponibles
-functions_dict = {
+_functions_specs = {
     1: {
         "description": "Obtenir les informations détaillées d'une action",
         "parameters": {"symbol": "str - symbole de l'action (ex: AAPL)"},
-        "function": get_stock_info
+        "target": "get_stock_info"
     },
     2: {
         "description": "Rechercher des actions par nom ou symbole",
@@ -661,85 +874,97 @@ functions_dict = {
             "limit": "int - nombre max de résultats (défaut: 10)",
             "exchange": "str - bourse (défaut: NASDAQ)"
         },
-        "function": search_stocks
+        "target": "search_stocks"
     },
     3: {
         "description": "Obtenir le cours actuel d'une action",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_stock_quote
+        "target": "get_stock_quote"
     },
     4: {
         "description": "Obtenir les variations de prix",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_stock_price_change
+        "target": "get_stock_price_change"
     },
     5: {
         "description": "Obtenir les états financiers",
         "parameters": {
             "symbol": "str - symbole de l'action",
             "statement_type": "str - type d'état ('income', 'balance', 'cash')",
-            "period": "str - période ('annual' ou 'quarter')"
+            "period": "str - période ('annual' ou 'quarter')",
+            "limit": "int - nombre de périodes les plus récentes (défaut: 5 sans plage de dates)",
+            "from_date": "str - date de début optionnelle (YYYY-MM-DD)",
+            "to_date": "str - date de fin optionnelle (YYYY-MM-DD)"
         },
-        "function": get_financial_statements
+        "target": "get_financial_statements"
     },
     6: {
         "description": "Obtenir les métriques clés",
         "parameters": {
             "symbol": "str - symbole de l'action",
-            "period": "str - période ('annual' ou 'quarter')"
+            "period": "str - période ('annual' ou 'quarter')",
+            "limit": "int - nombre de périodes les plus récentes (défaut: 5 sans plage de dates)",
+            "from_date": "str - date de début optionnelle (YYYY-MM-DD)",
+            "to_date": "str - date de fin optionnelle (YYYY-MM-DD)"
         },
-        "function": get_key_metrics
+        "target": "get_key_metrics"
     },
     7: {
         "description": "Obtenir les ratios financiers",
         "parameters": {
             "symbol": "str - symbole de l'action",
-            "period": "str - période ('annual' ou 'quarter')"
+            "period": "str - période ('annual' ou 'quarter')",
+            "limit": "int - nombre de périodes les plus récentes (défaut: 5 sans plage de dates)",
+            "from_date": "str - date de début optionnelle (YYYY-MM-DD)",
+            "to_date": "str - date de fin optionnelle (YYYY-MM-DD)"
         },
-        "function": get_financial_ratios
+        "target": "get_financial_ratios"
     },
     8: {
         "description": "Obtenir la vue d'ensemble de l'entreprise",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_company_outlook
+        "target": "get_company_outlook"
     },
     9: {
         "description": "Obtenir les entreprises similaires",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_stock_peers
+        "target": "get_stock_peers"
     },
     10: {
         "description": "Obtenir les notes d'entreprise",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_company_notes
+        "target": "get_company_notes"
     },
     11: {
         "description": "Obtenir les informations sur les dirigeants",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_key_executives
+        "target": "get_key_executives"
     },
     12: {
         "description": "Obtenir la capitalisation boursière",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_market_cap
+        "target": "get_market_cap"
     },
     13: {
         "description": "Obtenir les métriques de croissance financière",
         "parameters": {
             "symbol": "str - symbole de l'action",
-            "period": "str - période ('annual' ou 'quarter')"
+            "period": "str - période ('annual' ou 'quarter')",
+            "limit": "int - nombre de périodes les plus récentes (défaut: 5 sans plage de dates)",
+            "from_date": "str - date de début optionnelle (YYYY-MM-DD)",
+            "to_date": "str - date de fin optionnelle (YYYY-MM-DD)"
         },
-        "function": get_financial_growth
+        "target": "get_financial_growth"
     },
     14: {
         "description": "Obtenir le score de l'entreprise",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_company_score
+        "target": "get_company_score"
     },
     15: {
         "description": "Obtenir l'analyse DCF",
         "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_dcf_analysis
+        "target": "get_dcf_analysis"
     },
     16: {
         "description": "Obtenir les actualités de l'action",
@@ -749,12 +974,17 @@ functions_dict = {
             "to_date": "str - date de fin (YYYY-MM-DD)",
             "page": "int - numéro de page (défaut: 0)"
         },
-        "function": get_stock_news
+        "target": "get_stock_news"
     },
     17: {
         "description": "Obtenir le calendrier des résultats",
-        "parameters": {"symbol": "str - symbole de l'action"},
-        "function": get_earnings_calendar
+        "parameters": {
+            "symbol": "str - symbole de l'action",
+            "limit": "int - nombre de publications les plus récentes (défaut: 5 sans plage de dates)",
+            "from_date": "str - date de début optionnelle (YYYY-MM-DD)",
+            "to_date": "str - date de fin optionnelle (YYYY-MM-DD)"
+        },
+        "target": "get_earnings_calendar"
     },
     18: {
         "description": "Recherche Google générale",
@@ -764,7 +994,7 @@ functions_dict = {
             "country": "str - code pays (défaut: us)",
             "language": "str - code langue (défaut: en)"
         },
-        "function": google_search
+        "target": "google_search"
     },
     19: {
         "description": "Recherche d'emplois Google Jobs",
@@ -772,7 +1002,7 @@ functions_dict = {
             "query": "str - terme de recherche",
             "domain": "str - domaine Google (défaut: google.com)"
         },
-        "function": google_jobs_search
+        "target": "google_jobs_search"
     },
     20: {
         "description": "Recherche Google Shopping",
@@ -780,7 +1010,7 @@ functions_dict = {
             "query": "str - terme de recherche",
             "domain": "str - domaine Google (défaut: google.com)"
         },
-        "function": google_shopping_search
+        "target": "google_shopping_search"
     },
     21: {
         "description": "Recherche Google News",
@@ -788,14 +1018,14 @@ functions_dict = {
             "language": "str - code langue (défaut: en)",
             "country": "str - code pays (défaut: us)"
         },
-        "function": google_news_search
+        "target": "google_news_search"
     },
     22: {
         "description": "Recherche Google Trends",
         "parameters": {
             "query": "str - terme de recherche"
         },
-        "function": google_trends_search
+        "target": "google_trends_search"
     },
     23: {
         "description": "Recherche Google Scholar",
@@ -803,7 +1033,7 @@ functions_dict = {
             "query": "str - terme de recherche",
             "language": "str - code langue (défaut: en)"
         },
-        "function": google_scholar_search
+        "target": "google_scholar_search"
     },
     24: {
         "description": "Recherche Google Events",
@@ -812,7 +1042,7 @@ functions_dict = {
             "language": "str - code langue (défaut: en)",
             "country": "str - code pays (défaut: us)"
         },
-        "function": google_events_search
+        "target": "google_events_search"
     },
     25: {
         "description": "Recherche Google Flights",
@@ -824,7 +1054,7 @@ functions_dict = {
             "language": "str - code langue (défaut: en)",
             "country": "str - code pays (défaut: us)"
         },
-        "function": google_flights_search
+        "target": "google_flights_search"
     },
     26: {
         "description": "Recherche Google Hotels",
@@ -834,7 +1064,7 @@ functions_dict = {
             "check_out": "str - date de départ (YYYY-MM-DD)",
             "language": "str - code langue (défaut: en)"
         },
-        "function": google_hotels_search
+        "target": "google_hotels_search"
     },
     27: {
         "description": "Recherche Google Food",
@@ -842,7 +1072,7 @@ functions_dict = {
             "query": "str - terme de recherche",
             "language": "str - code langue (défaut: en)"
         },
-        "function": google_food_search
+        "target": "google_food_search"
     },
     28: {
         "description": "Recherche Apple App Store",
@@ -851,20 +1081,34 @@ functions_dict = {
             "page": "int - numéro de page (défaut: 0)",
             "num": "int - nombre de résultats (défaut: 10)"
         },
-        "function": apple_app_store_search
+        "target": "apple_app_store_search"
     },
     29: {
         "description": "Recherche YouTube",
         "parameters": {
             "query": "str - terme de recherche"
         },
-        "function": youtube_search
+        "target": "youtube_search"
     },
     30: {
         "description": "Recherche eBay",
         "parameters": {
             "query": "str - terme de recherche"
         },
-        "function": ebay_search
+        "target": "ebay_search"
+    },
+    31: {
+        "description": "Comparer des métriques dérivées des états financiers (croissance, marges, ratios) entre plusieurs entreprises",
+        "parameters": {
+            "symbols": "list[str] - symboles à comparer (ex: ['AAPL', 'MSFT', 'GOOGL'])",
+            "metrics": "list[str] - métriques parmi revenueGrowth, grossProfitGrowth, operatingIncomeGrowth, netIncomeGrowth, epsGrowth, freeCashFlowGrowth, totalAssetsGrowth, grossMargin, operatingMargin, netMargin, ebitdaMargin, freeCashFlowMargin, rdToRevenue, currentRatio, debtToEquity, debtToAssets, returnOnEquity, returnOnAssets, cashConversion (défaut: principales)",
+            "period": "str - période ('annual' ou 'quarter')",
+            "periods": "int - nombre de périodes les plus récentes (défaut: 3)"
+        },
+        "target": "statements_store:compare_financials"
     }
 }
+
+functions_dict: Dict[int, Function_Entry] = {}
+for _function_id, _spec in _functions_specs.items():
+    register_function(_function_id, **_spec)
@@ -0,0 +1,288 @@
+"""
+Requêtes couvertes (hedged requests) pour l'API chat completions : si le
+premier octet tarde au-delà d'un seuil adaptatif, une requête identique est
+lancée et la première à répondre est utilisée. Chaque tentative a sa propre
+session HTTP : celle de la perdante est fermée dès que la gagnante est
+connue, même si elle attend encore ses en-têtes.
+"""
+import contextvars
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from llm import requests
+
+
+class Hedged_Response:
+    """
+    Winning response of a hedged call.
+
+    For streamed calls the first line was already read to time the first
+    byte; iter_lines() yields it back before the rest of the stream.
+    """
+
+    def __init__(self, response: "requests.Response", first_lines: Optional[Iterator] = None,
+                 first_line: Optional[bytes] = None):
+        self._response = response
+        self._lines = first_lines
+        self._first_line = first_line
+
+    def iter_lines(self, *args, **kwargs) -> Iterator[bytes]:
+        if self._lines is None:
+            yield from self._response.iter_lines(*args, **kwargs)
+            return
+        if self._first_line is not None:
+            yield self._first_line
+        yield from self._lines
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+_adapter_class = None
+
+
+def _tracking_pool(pool_class, adapter):
+    """Connection pool class registering checked-out connections on the adapter"""
+
+    class Tracking_Pool(pool_class):
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            with adapter.connections_lock:
+                if adapter.cancelled:
+                    conn.close()
+                    raise ConnectionAbortedError("tentative annulée")
+                adapter.connections.add(conn)
+            return conn
+
+        def _put_conn(self, conn):
+            with adapter.connections_lock:
+                adapter.connections.discard(conn)
+            super()._put_conn(conn)
+
+    return Tracking_Pool
+
+
+def _cancellable_adapter():
+    """HTTPAdapter class whose in-flight connections can be closed from another thread"""
+    global _adapter_class
+    if _adapter_class is None:
+        # Import différé, comme requests dans llm
+        from requests.adapters import HTTPAdapter
+
+        class Cancellable_Adapter(HTTPAdapter):
+            def __init__(self, *args, **kwargs):
+                self.connections = set()
+                self.connections_lock = threading.Lock()
+                self.cancelled = False
+                super().__init__(*args, **kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                manager = self.poolmanager
+                manager.pool_classes_by_scheme = {
+                    scheme: _tracking_pool(pool_class, self)
+                    for scheme, pool_class in manager.pool_classes_by_scheme.items()
+                }
+
+            def cancel(self):
+                with self.connections_lock:
+                    self.cancelled = True
+                    connections = list(self.connections)
+                    self.connections.clear()
+                for conn in connections:
+                    # shutdown réveille le thread bloqué en lecture, close seul ne le fait pas
+                    sock = getattr(conn, "sock", None)
+                    if sock is not None:
+                        try:
+                            sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                    conn.close()
+
+        _adapter_class = Cancellable_Adapter
+    return _adapter_class
+
+
+class _Attempt:
+    __slots__ = ("session", "adapter", "response", "lines", "first_line", "error", "done", "hedge")
+
+    def __init__(self, hedge: bool):
+        self.session = requests.Session()
+        self.adapter = _cancellable_adapter()()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.response = None
+        self.lines = None
+        self.first_line = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.hedge = hedge
+
+    def cancel(self):
+        """Abort the attempt, including a request still waiting for its headers"""
+        # Lu par l'appelant : l'erreur de connexion qui suit n'est pas une panne amont
+        self.session.cancelled = True
+        self.adapter.cancel()
+        self.session.close()
+
+
+class Hedging_Policy:
+    """
+    Fire a duplicate request when the first byte is late, within a load budget.
+
+    Each attempt goes through send() on its own, so a hedge takes a second
+    scheduler slot of the caller's class (an interactive slot for chat
+    turns) while both attempts run. budget_ratio bounds that extra load:
+    with the default 0.05, about 5 % more requests, plus `burst` hedges.
+    A cancelled loser has `session.cancelled` set; send() should not count
+    its connection error against the provider's circuit breaker.
+
+    Args:
+        percentile (float): Percentile of recent first-byte latencies used as threshold
+        min_delay (float): Lower bound of the threshold, in seconds
+        initial_delay (float): Threshold used until `min_samples` latencies are known
+        min_samples (int): Observations needed before the threshold adapts
+        window (int): Number of recent latencies kept
+        budget_ratio (float): Maximum extra requests, as a fraction of all requests
+        burst (float): Hedges allowed ahead of the budget
+        max_workers (int): Attempts running at once, across all calls
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 0.05,
+        initial_delay: float = 2.0,
+        min_samples: int = 20,
+        window: int = 500,
+        budget_ratio: float = 0.05,
+        burst: float = 2.0,
+        max_workers: int = 32
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._latencies = deque(maxlen=window)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def threshold(self) -> float:
+        """Current first-byte delay after which a hedge is fired"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        return max(self.min_delay, ordered[index])
+
+    def metrics(self) -> Dict[str, float]:
+        """Counters on hedging activity and how often the hedge answered first"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "hedge_rate": self.hedges_fired / self.requests if self.requests else 0.0,
+                "win_rate": self.hedge_wins / self.hedges_fired if self.hedges_fired else 0.0,
+            }
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedges_fired += 1
+                return True
+            self.budget_denied += 1
+            return False
+
+    def _submit(self, function, *args):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+        # Le contexte (délai du tour) suit la requête dans son thread
+        context = contextvars.copy_context()
+        self._pool.submit(context.run, function, *args)
+
+    def execute(self, send: Callable[["requests.Session"], "requests.Response"], stream: bool):
+        """
+        Run send(session), hedging it once if no first byte arrives within threshold().
+
+        Each attempt sends through its own session; the loser's session is
+        closed as soon as a winner is known, aborting its request. If every
+        attempt fails, the first error is raised.
+        """
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget_ratio)
+
+        condition = threading.Condition()
+        attempts: List[_Attempt] = []
+        winner: List[_Attempt] = []
+
+        def run(attempt: _Attempt):
+            started = time.monotonic()
+            try:
+                response = send(attempt.session)
+                if stream:
+                    lines = response.iter_lines()
+                    attempt.first_line = next(lines, None)
+                    attempt.lines = lines
+                else:
+                    # Corps complet : la réponse non streamée n'a pas de premier octet utile
+                    response.content
+                attempt.response = response
+                self._record(time.monotonic() - started)
+            except BaseException as e:
+                attempt.error = e
+            with condition:
+                attempt.done = True
+                lost = bool(winner)
+                if not lost and attempt.error is None:
+                    winner.append(attempt)
+                condition.notify_all()
+            if lost and attempt.response is not None:
+                attempt.response.close()
+
+        def launch(hedge: bool):
+            attempt = _Attempt(hedge)
+            attempts.append(attempt)
+            self._submit(run, attempt)
+
+        with condition:
+            launch(hedge=False)
+            condition.wait_for(lambda: winner or attempts[0].done, timeout=self.threshold())
+            if not winner and not attempts[0].done and self._take_budget():
+                launch(hedge=True)
+            condition.wait_for(lambda: winner or all(a.done for a in attempts))
+
+        if not winner:
+            raise attempts[0].error
+
+        chosen = winner[0]
+        for attempt in attempts:
+            if attempt is not chosen:
+                attempt.cancel()
+        if chosen.hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        if stream:
+            return Hedged_Response(chosen.response, chosen.lines, chosen.first_line)
+        return chosen.response
@@ -1,16 +1,72 @@
+import importlib
 import json
-import requests
-import uuid
 import os
-from typing import Optional, Dict, List
-from datetime import datetime
-from dotenv import load_dotenv
-import sys
+from typing import Optional, Dict, List, NamedTuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+    from hedging import Hedging_Policy
+
+
+class Lazy_Module:
+    """Module proxy imported on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Import différé : requests coûte ~100 ms au démarrage
+if not TYPE_CHECKING:
+    requests = Lazy_Module("requests")
+
+_env_loaded = False
+
+
+def load_env():
+    """Load environment variables from .env once, on first need"""
+    global _env_loaded
+    if not _env_loaded:
+        # Import différé : python-dotenv n'est chargé que si une clé manque
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_env(name: str) -> Optional[str]:
+    """Return an environment variable, falling back to .env if it is not set"""
+    value = os.getenv(name)
+    if value is None:
+        load_env()
+        value = os.getenv(name)
+    return value
+
+
+class Request_Options(NamedTuple):
+    """Immutable sampling options of one completion request"""
+    stream: bool
+    temperature: float
+    max_tokens: int
+    top_p: float
+    frequency_penalty: Optional[float] = None
+    presence_penalty: Optional[float] = None
 
-# Load environment variables
-load_dotenv()
 
 class OpenAI_LLM:
+    """
+    Client for the chat completions API.
+
+    The constructor arguments are defaults. Per-request options are resolved
+    once per call into an immutable Request_Options and never written back to
+    the instance, so a single OpenAI_LLM (or Function_Router_LLM) can be
+    shared by any number of threads.
+    """
+
     def __init__(
         self,
         model: str = "gpt-3.5-turbo",
@@ -20,6 +76,8 @@ class OpenAI_LLM:
         top_p: float = 0,
         frequency_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
+        api_base: Optional[str] = None,
+        hedging: Optional["Hedging_Policy"] = None,
     ):
         self.model = model
         self.temperature = temperature
@@ -28,32 +86,94 @@ class OpenAI_LLM:
         self.top_p = top_p
         self.frequency_penalty = frequency_penalty
         self.presence_penalty = presence_penalty
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        
+        self.api_key = get_env('OPENAI_API_KEY')
+
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
 
-    def _make_request(self, messages: List[Dict]) -> requests.Response:
-        """Make request to OpenAI API"""
-        url = "https://api.openai.com/v1/chat/completions"
+        # Permet de viser un serveur compatible (proxy, serveur factice local)
+        self.api_base = (api_base or os.getenv('OPENAI_API_BASE') or "https://api.openai.com/v1").rstrip("/")
+        # Politique optionnelle de requêtes couvertes contre la latence de queue
+        self.hedging = hedging
+
+    def request_options(self, **overrides) -> Request_Options:
+        """Snapshot the instance defaults, with per-call overrides (None values are ignored)"""
+        options = Request_Options(
+            stream=self.stream,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            frequency_penalty=self.frequency_penalty,
+            presence_penalty=self.presence_penalty
+        )
+        overrides = {k: v for k, v in overrides.items() if v is not None}
+        return options._replace(**overrides) if overrides else options
+
+    def _make_request(
+        self,
+        messages: List[Dict],
+        options: Optional[Request_Options] = None,
+        tools: Optional[List[Dict]] = None,
+        **overrides
+    ) -> "requests.Response":
+        """Make request to OpenAI API, with options scoped to this call and optional tool schemas"""
+        if options is None:
+            options = self.request_options(**overrides)
+        elif overrides:
+            options = options._replace(**{k: v for k, v in overrides.items() if v is not None})
+
+        url = f"{self.api_base}/chat/completions"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-        
+
         payload = {
             "model": self.model,
             "messages": messages,
             "response_format": {"type": "text"},
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "top_p": self.top_p,
-            "stream": self.stream
+            "temperature": options.temperature,
+            "max_tokens": options.max_tokens,
+            "top_p": options.top_p,
+            "stream": options.stream
         }
 
-        if self.frequency_penalty is not None:
-            payload["frequency_penalty"] = self.frequency_penalty
-        if self.presence_penalty is not None:
-            payload["presence_penalty"] = self.presence_penalty
+        if options.frequency_penalty is not None:
+            payload["frequency_penalty"] = options.frequency_penalty
+        if options.presence_penalty is not None:
+            payload["presence_penalty"] = options.presence_penalty
+        if tools:
+            payload["tools"] = tools
+
+        if self.hedging is not None:
+            return self.hedging.execute(lambda session: self._post(url, headers, payload, session),
+                                        stream=options.stream)
+        return self._post(url, headers, payload)
+
+    def _post(self, url: str, headers: Dict, payload: Dict,
+              session: Optional["requests.Session"] = None) -> "requests.Response":
+        """Send one completion request through the scheduler, deadline and circuit breaker"""
+        from resilience import get_breaker, is_upstream_failure, providers, request_timeout
+        from scheduler import get_scheduler
 
-        return requests.post(url, headers=headers, json=payload, stream=self.stream)
+        # Le délai suit celui du tour en cours ; le disjoncteur coupe les appels
+        # tant que l'API est en échec. La place est rendue à l'arrivée des
+        # en-têtes : un flux en cours de lecture n'en occupe plus
+        with get_scheduler("openai").slot(timeout=request_timeout(providers["openai"].timeout)):
+            breaker = get_breaker("openai")
+            breaker.check()
+            try:
+                response = (session or requests).post(
+                    url, headers=headers, json=payload, stream=payload["stream"],
+                    timeout=request_timeout(providers["openai"].timeout)
+                )
+            except requests.exceptions.RequestException:
+                # Perdante d'une requête couverte, annulée : l'API n'y est pour rien
+                if not getattr(session, "cancelled", False):
+                    breaker.record_failure()
+                raise
+        if is_upstream_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
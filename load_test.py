@@ -0,0 +1,507 @@
+"""
+Générateur de charge : N utilisateurs simulés posent des questions réalistes
+(mélange pondéré, temps de réflexion aléatoires) à Enhanced_OpenAI_Chatbot,
+contre les serveurs amont factices locaux (OpenAI, FMP, SerpAPI). La charge
+monte par paliers ; chaque palier rapporte le débit, les percentiles de
+latence (tour complet et premier token), le taux d'erreur et la mémoire par
+session.
+
+Modes:
+    inproc  un chatbot par utilisateur, dans ce processus (LLM et router partagés)
+    server  Chatbot_Server démarré dans ce processus, piloté en HTTP/SSE
+    dispatcher  dispatcher.py et --workers processus Chatbot_Server (chatbots de main.py)
+    --url   un serveur déjà lancé (ses amonts doivent pointer vers mock_upstream.py)
+
+Usage: python load_test.py [--mode inproc] [--workers 4] [--users 1,8,32,64] [--stage-seconds 15]
+                           [--think-time 2] [--first-token-ms 300] [--token-ms 10] [--upstream-ms 40]
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from mock_upstream import Mock_OpenAI_Server, default_reply
+from tools import build_tools
+
+SYMBOLS = ("AAPL", "MSFT", "NVDA", "GOOGL", "AMZN", "META", "TSLA", "AMD", "NFLX", "ORCL",
+           "INTC", "IBM", "CRM", "ADBE", "QCOM", "AVGO", "SAP", "ASML", "SHOP", "UBER")
+
+# (poids, question, function_id, arguments) ; {symbol} est tiré au hasard,
+# les symboles du début de liste étant plus demandés
+QUESTION_MIX: Tuple[Tuple[float, str, int, Optional[Dict]], ...] = (
+    (0.22, "Quel est le cours de {symbol} ?", 3, {"symbol": "{symbol}"}),
+    (0.10, "Présente-moi l'entreprise {symbol}", 1, {"symbol": "{symbol}"}),
+    (0.08, "Quelle est la capitalisation boursière de {symbol} ?", 12, {"symbol": "{symbol}"}),
+    (0.06, "Comment a évolué le cours de {symbol} cette année ?", 4, {"symbol": "{symbol}"}),
+    (0.08, "Analyse le compte de résultat annuel de {symbol}",
+     5, {"symbol": "{symbol}", "statement_type": "income", "period": "annual"}),
+    (0.05, "Quels sont les ratios financiers de {symbol} ?", 7, {"symbol": "{symbol}", "period": "annual"}),
+    (0.06, "Qui sont les concurrents de {symbol} ?", 9, {"symbol": "{symbol}"}),
+    (0.04, "{symbol} est-elle sous-évaluée selon le DCF ?", 15, {"symbol": "{symbol}"}),
+    (0.05, "Cherche sur Google les dernières nouvelles de {symbol}", 18, {"query": "{symbol} news"}),
+    (0.16, "Explique-moi simplement ce qu'est le ratio cours/bénéfice", 0, None),
+    (0.10, "Quelle différence entre une action et une obligation ?", 0, None),
+)
+
+
+def _fill(value, symbol: str):
+    if isinstance(value, dict):
+        return {k: _fill(v, symbol) for k, v in value.items()}
+    return value.replace("{symbol}", symbol) if isinstance(value, str) else value
+
+
+class Question_Mix:
+    """Weighted question generator; also answers the mock router for generated questions"""
+
+    def __init__(self, mix=QUESTION_MIX, symbols=SYMBOLS, template_answers: bool = False,
+                 tool_names: Optional[Dict[int, str]] = None):
+        self.mix = mix
+        # Noms d'outils par function_id, pour répondre en mode appel de fonctions natif
+        self.tool_names = tool_names or {}
+        self.symbols = symbols
+        self.template_answers = template_answers
+        self.weights = [entry[0] for entry in mix]
+        # Popularité des symboles en loi de Zipf
+        self.symbol_weights = [1 / (rank + 1) for rank in range(len(symbols))]
+        self.routes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def draw(self, rng: random.Random) -> str:
+        _, question, function_id, arguments = rng.choices(self.mix, weights=self.weights)[0]
+        symbol = rng.choices(self.symbols, weights=self.symbol_weights)[0]
+        text = question.format(symbol=symbol)
+        route = {"function_id": function_id, "input": _fill(arguments, symbol)}
+        if self.template_answers and function_id:
+            route.update(answer_mode="template", language="fr")
+        with self._lock:
+            self.routes[text] = route
+        return text
+
+    def reply(self, payload: Dict) -> str:
+        """Reply function for Mock_OpenAI_Server"""
+        messages = payload.get("messages", [])
+        system = messages[0].get("content", "") if messages else ""
+        if isinstance(system, str) and system.startswith("Vous êtes un routeur"):
+            route = self.routes.get(messages[-1].get("content", ""))
+            if route is not None:
+                return json.dumps(route)
+        if payload.get("tools") and messages and messages[-1].get("role") == "user":
+            content = messages[-1].get("content", "")
+            if isinstance(content, list):
+                content = " ".join(part.get("text", "") for part in content)
+            route = self.routes.get(content)
+            if route is not None and route["function_id"]:
+                name = self.tool_names[route["function_id"]]
+                return {"tool_calls": [{"name": name, "arguments": route["input"]}]}
+        text = default_reply(payload)
+        # Réponses de longueur réaliste (~80 tokens)
+        return text[:200] + " " + " ".join(["analyse"] * 80)
+
+
+class Turn_Record:
+    __slots__ = ("start", "latency", "first_token", "error")
+
+    def __init__(self, start: float, latency: float, first_token: Optional[float], error: Optional[str]):
+        self.start = start
+        self.latency = latency
+        self.first_token = first_token
+        self.error = error
+
+
+# ---- clients ----------------------------------------------------------
+
+class Inproc_Client:
+    """One simulated user's conversation, run directly on an Enhanced_OpenAI_Chatbot"""
+
+    def __init__(self, factory: Callable):
+        self.chatbot = factory(verbose=False, name="load_test")
+
+    def ask(self, message: str, on_token: Callable[[str], None]) -> str:
+        return self.chatbot(message, on_token=on_token)
+
+
+class HTTP_Client:
+    """One simulated user's conversation through the server's streaming /chat route"""
+
+    def __init__(self, url: str, timeout: float = 120.0):
+        split = urlsplit(url)
+        self.host, self.port = split.hostname, split.port or 80
+        self.timeout = timeout
+        self.conversation_id: Optional[str] = None
+
+    def ask(self, message: str, on_token: Callable[[str], None]) -> str:
+        body = {"message": message, "stream": True}
+        if self.conversation_id is not None:
+            body["conversation_id"] = self.conversation_id
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("POST", "/chat", json.dumps(body), {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {response.read()[:200].decode(errors='replace')}")
+            event = None
+            for raw in response:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    data = json.loads(line[6:])
+                    if event == "session":
+                        self.conversation_id = data["conversation_id"]
+                    elif event == "token":
+                        on_token(data["token"])
+                    elif event == "done":
+                        return data["response"]
+                    elif event == "error":
+                        raise RuntimeError(data["error"])
+            raise RuntimeError("flux interrompu avant l'événement done")
+        finally:
+            connection.close()
+
+    def health(self) -> Dict:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("GET", "/health")
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+
+# ---- utilisateurs simulés ----------------------------------------------
+
+class Load_Generator:
+    """
+    Ramps simulated users and collects one record per turn.
+
+    Args:
+        client_factory (Callable): Builds a new conversation client
+        mix (Question_Mix): Question generator
+        think_time (float): Mean seconds between two turns of a user (exponential)
+        turns_per_session (int): Turns before a user starts a new conversation
+        session_count (Callable): Returns the number of sessions held in memory
+    """
+
+    def __init__(self, client_factory: Callable, mix: Question_Mix, think_time: float = 2.0,
+                 turns_per_session: int = 8, session_count: Optional[Callable[[], int]] = None):
+        self.client_factory = client_factory
+        self.mix = mix
+        self.think_time = think_time
+        self.turns_per_session = turns_per_session
+        self.session_count = session_count
+        self.records: List[Turn_Record] = []
+        self.users = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def add_users(self, count: int):
+        for _ in range(count):
+            seed = len(self._threads)
+            thread = threading.Thread(target=self._user, args=(seed,), daemon=True, name=f"user-{seed}")
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _think(self, rng: random.Random):
+        if self.think_time > 0:
+            self._stop.wait(min(rng.expovariate(1 / self.think_time), 5 * self.think_time))
+
+    def _user(self, seed: int):
+        rng = random.Random(seed)
+        with self._lock:
+            self.users += 1
+        client = None
+        turns = 0
+        # Arrivées étalées : pas de rafale synchronisée au début du palier
+        self._stop.wait(rng.uniform(0, self.think_time))
+        while not self._stop.is_set():
+            if client is None or turns >= self.turns_per_session:
+                try:
+                    client = self.client_factory()
+                except Exception as e:
+                    self._record(time.perf_counter(), 0.0, None, f"{type(e).__name__}: {e}")
+                    self._think(rng)
+                    continue
+                turns = 0
+            self._turn(client, self.mix.draw(rng))
+            turns += 1
+            self._think(rng)
+        with self._lock:
+            self.users -= 1
+
+    def _turn(self, client, question: str):
+        start = time.perf_counter()
+        first = []
+
+        def on_token(token: str):
+            if not first:
+                first.append(time.perf_counter() - start)
+
+        error = None
+        try:
+            answer = client.ask(question, on_token)
+            if not answer:
+                error = "réponse vide"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self._record(start, time.perf_counter() - start, first[0] if first else None, error)
+
+    def _record(self, start: float, latency: float, first_token: Optional[float], error: Optional[str]):
+        with self._lock:
+            self.records.append(Turn_Record(start, latency, first_token, error))
+
+    def window(self, start: float, end: float) -> List[Turn_Record]:
+        """Turns that started in [start, end)"""
+        with self._lock:
+            return [r for r in self.records if start <= r.start < end]
+
+
+# ---- mesures ------------------------------------------------------------
+
+def rss_bytes(pid: str = "self") -> Optional[int]:
+    """Current resident memory of a process, None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _ms(value: Optional[float]) -> str:
+    return "     -" if value is None else f"{value * 1000:6.0f}"
+
+
+def stage_report(users: int, records: List[Turn_Record], seconds: float,
+                 memory: Optional[int], sessions: Optional[int]) -> Dict:
+    ok = [r for r in records if r.error is None]
+    latencies = [r.latency for r in ok]
+    first_tokens = [r.first_token for r in ok if r.first_token is not None]
+    return {
+        "users": users,
+        "turns": len(records),
+        "throughput": len(ok) / seconds if seconds else 0.0,
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(first_tokens, 50), "ttft_p95": percentile(first_tokens, 95),
+        "sessions": sessions,
+        "memory_per_session": memory / sessions if memory is not None and sessions else None,
+        "errors": sorted({r.error for r in records if r.error})[:3],
+    }
+
+
+def print_header():
+    print(f"{'users':>5} {'tours':>6} {'tours/s':>8} {'erreurs':>8} "
+          f"{'p50 ms':>6} {'p95 ms':>6} {'p99 ms':>6} {'ttft50':>6} {'ttft95':>6} {'sessions':>8} {'KiB/sess':>8}")
+
+
+def print_stage(report: Dict):
+    per_session = report["memory_per_session"]
+    print(f"{report['users']:5d} {report['turns']:6d} {report['throughput']:8.2f} {report['error_rate']:8.1%} "
+          f"{_ms(report['p50'])} {_ms(report['p95'])} {_ms(report['p99'])} "
+          f"{_ms(report['ttft_p50'])} {_ms(report['ttft_p95'])} "
+          f"{report['sessions'] if report['sessions'] is not None else '-':>8} "
+          f"{per_session / 1024 if per_session is not None else float('nan'):8.1f}")
+    for error in report["errors"]:
+        print(f"      erreur: {error[:120]}")
+
+
+# ---- serveur embarqué ---------------------------------------------------
+
+def start_embedded_server(factory: Callable, max_concurrent_turns: int, max_sessions: int):
+    """Run a Chatbot_Server on its own event loop thread; return (server, url, stop)"""
+    from server import Chatbot_Server
+
+    server = Chatbot_Server(factory, name="load_test", max_sessions=max_sessions,
+                            max_concurrent_turns=max_concurrent_turns)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True, name="chatbot-server")
+    thread.start()
+    host, port = asyncio.run_coroutine_threadsafe(server.start("127.0.0.1", 0), loop).result()
+
+    def stop():
+        server.shutdown_grace = 5.0
+        asyncio.run_coroutine_threadsafe(server.shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return server, f"http://{host}:{port}", stop
+
+
+def start_embedded_dispatcher(workers: int, tool_calling: bool, max_concurrent_turns: int, max_sessions: int):
+    """Run a Dispatcher and its worker processes; return (dispatcher, url, stop)"""
+    from dispatcher import Dispatcher
+    from shared_cache import DEFAULT_PATH as SHARED_CACHE_PATH
+
+    dispatcher = Dispatcher(workers, worker_options={
+        "max_sessions": max_sessions, "max_concurrent_turns": max_concurrent_turns, "tool_calling": tool_calling,
+        "shared_cache": SHARED_CACHE_PATH
+    })
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True, name="dispatcher")
+    thread.start()
+    host, port = asyncio.run_coroutine_threadsafe(dispatcher.start("127.0.0.1", 0), loop).result()
+
+    def stop():
+        dispatcher.shutdown_grace = 5.0
+        asyncio.run_coroutine_threadsafe(dispatcher.shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return dispatcher, f"http://{host}:{port}", stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inproc", "server", "dispatcher"), default="inproc")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processus du mode dispatcher")
+    parser.add_argument("--url", help="serveur déjà lancé (remplace --mode)")
+    parser.add_argument("--users", default="1,8,32,64", help="utilisateurs cumulés par palier")
+    parser.add_argument("--stage-seconds", type=float, default=15.0)
+    parser.add_argument("--think-time", type=float, default=2.0, help="moyenne en secondes")
+    parser.add_argument("--turns-per-session", type=int, default=8)
+    parser.add_argument("--fast-answers", action="store_true", help="réponses par gabarit pour les recherches simples")
+    parser.add_argument("--tool-calling", action="store_true", help="appel de fonctions natif au lieu du routeur")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="latence simulée d'OpenAI")
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--upstream-ms", type=float, default=40.0, help="latence simulée de FMP/SerpAPI")
+    parser.add_argument("--max-concurrent-turns", type=int, default=32)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--json", help="écrire les résultats des paliers dans ce fichier")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.json) if args.json else None
+    stages = [int(n) for n in args.users.split(",") if n.strip()]
+    if not stages or stages != sorted(stages):
+        sys.exit("--users attend des effectifs croissants, par ex. 1,8,32")
+
+    mix = Question_Mix(template_answers=args.fast_answers)
+    mock = None
+    if args.url is None:
+        mock = Mock_OpenAI_Server(
+            reply=mix.reply,
+            first_token_delay=args.first_token_ms / 1000,
+            token_delay=args.token_ms / 1000,
+            upstream_delay=args.upstream_ms / 1000
+        ).start()
+        os.environ["OPENAI_API_BASE"] = mock.api_base
+        os.environ["FMP_BASE_URL"] = mock.base_url
+        os.environ["SERPAPI_BASE_URL"] = mock.base_url
+        for name in ("OPENAI_API_KEY", "FMP_API_KEY", "SERPAPI_API_KEY"):
+            os.environ[name] = "load-test"
+
+    from fonction import functions_dict
+    from llm import OpenAI_LLM
+    from rag_chatbot import Enhanced_OpenAI_Chatbot
+    from routeur import Function_Router_LLM
+
+    mix.tool_names = {function_id: name for name, function_id in build_tools(functions_dict)[1].items()}
+
+    # Un seul LLM et un seul router partagés, comme dans main.py
+    llm = OpenAI_LLM(model="gpt-4o-mini", temperature=0.7, max_tokens=1500, stream=True)
+    router_llm = Function_Router_LLM(functions_dict, model="gpt-4o-mini", temperature=0.2, stream=False,
+                                     signal_simple_lookups=args.fast_answers)
+
+    def chatbot_factory(**kwargs):
+        return Enhanced_OpenAI_Chatbot(llm=llm, router_llm=router_llm, functions_dict=functions_dict,
+                                       fast_answers=args.fast_answers, tool_calling=args.tool_calling, **kwargs)
+
+    # Conversations et caches disque du test dans un dossier jetable
+    workdir = tempfile.TemporaryDirectory(prefix="load_test_")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir.name)
+
+    stop_server = None
+    session_count: Optional[Callable[[], int]] = None
+    memory_used: Callable[[], Optional[int]] = rss_bytes
+    if args.url is not None:
+        url = args.url
+        client_factory = lambda: HTTP_Client(url)
+        print(f"Cible: {url} (mémoire non mesurée)")
+    elif args.mode == "server":
+        server, url, stop_server = start_embedded_server(
+            chatbot_factory, args.max_concurrent_turns, args.max_sessions
+        )
+        client_factory = lambda: HTTP_Client(url)
+        session_count = lambda: len(server.sessions)
+        print(f"Chatbot_Server embarqué sur {url}")
+    elif args.mode == "dispatcher":
+        dispatcher, url, stop_server = start_embedded_dispatcher(
+            args.workers, args.tool_calling, args.max_concurrent_turns, args.max_sessions
+        )
+        client_factory = lambda: HTTP_Client(url)
+        session_count = lambda: HTTP_Client(url).health()["sessions"]
+        # Mémoire de tous les processus : répartiteur et processus de travail
+        memory_used = lambda: sum(rss_bytes(pid) or 0 for pid in
+                                  ["self"] + [w.process.pid for w in dispatcher.workers if w.process])
+        print(f"Répartiteur embarqué sur {url}, {args.workers} processus")
+    else:
+        client_factory = lambda: Inproc_Client(chatbot_factory)
+        # Chaque utilisateur ne garde en mémoire que sa conversation courante
+        session_count = lambda: generator.users
+
+    generator = Load_Generator(client_factory, mix, args.think_time, args.turns_per_session, session_count)
+    baseline = memory_used()
+    if mock is not None:
+        print(f"Amonts factices: OpenAI {args.first_token_ms:.0f} ms + {args.token_ms:.0f} ms/token, "
+              f"FMP/SerpAPI {args.upstream_ms:.0f} ms")
+    print(f"Mode {args.mode if args.url is None else 'url'}, paliers {stages}, "
+          f"{args.stage_seconds:.0f} s par palier, réflexion {args.think_time:.1f} s en moyenne")
+    print_header()
+
+    reports = []
+    try:
+        for users in stages:
+            generator.add_users(users - len(generator._threads))
+            start = time.perf_counter()
+            time.sleep(args.stage_seconds)
+            end = time.perf_counter()
+            memory = None
+            if session_count is not None and baseline is not None:
+                current = memory_used()
+                memory = current - baseline if current is not None else None
+            report = stage_report(users, generator.window(start, end), end - start,
+                                  memory, session_count() if session_count else None)
+            reports.append(report)
+            print_stage(report)
+    except KeyboardInterrupt:
+        print("Interrompu")
+    finally:
+        generator.stop()
+        if stop_server is not None:
+            stop_server()
+        if mock is not None:
+            mock.stop()
+        os.chdir(previous_cwd)
+        workdir.cleanup()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    if mock is not None:
+        print(f"{mock.request_count} requêtes servies par les amonts factices")
+    sys.exit(1 if any(r["error_rate"] > 0 for r in reports) else 0)
+
+
+if __name__ == "__main__":
+    main()
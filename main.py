@@ -1,6 +1,9 @@
-# Charger les variables d'environnement
-from dotenv import load_dotenv
-load_dotenv()
+from fonction import functions_dict
+from llm import OpenAI_LLM
+from rag_chatbot import Enhanced_OpenAI_Chatbot
+from routeur import Function_Router_LLM
+
+# Les variables d'environnement (.env) sont chargées à la demande par OpenAI_LLM
 
 # Créer une instance de OpenAI_LLM avec les paramètres souhaités
 llm = OpenAI_LLM(
@@ -17,14 +20,24 @@ router_llm = Function_Router_LLM(
     functions_dict=functions_dict,
     model="gpt-4o-mini",
     temperature=0.2,
-    stream=False
+    stream=False,
+    plan_calls=True
 )
 
+SYSTEM_PROMPT = "Tu es un assistant qui est en agent, pour ton info nous sommes le 28 novembre 2024, et tu utilise info donnée dans context de quesiton poour repondre"
+
+
+def build_chatbot(**kwargs) -> Enhanced_OpenAI_Chatbot:
+    """Crée un Enhanced_OpenAI_Chatbot partageant le LLM et le router de ce module"""
+    kwargs.setdefault("system_prompt", SYSTEM_PROMPT)
+    return Enhanced_OpenAI_Chatbot(
+        llm=llm,
+        router_llm=router_llm,
+        functions_dict=functions_dict,
+        **kwargs
+    )
+
+
 # Créer une instance de Enhanced_OpenAI_Chatbot en utilisant le LLM et le router
-chatbot = Enhanced_OpenAI_Chatbot(
-    llm=llm,
-    router_llm=router_llm,
-    functions_dict=functions_dict,
-    system_prompt="Tu es un assistant qui est en agent, pour ton info nous sommes le 28 novembre 2024, et tu utilise info donnée dans context de quesiton poour repondre"
-)
+chatbot = build_chatbot()
 
@@ -0,0 +1,198 @@
+import sys
+from collections.abc import MutableSequence
+from typing import Dict, Iterable, List, Optional, Union
+
+
+class Message:
+    """Compact conversation message, converted to the API wire format on demand"""
+    __slots__ = ("role", "text", "parts")
+
+    def __init__(self, role: str, text: str = "", parts: Optional[List[Dict]] = None):
+        # Les rôles sont peu nombreux : une seule chaîne partagée par rôle
+        self.role = sys.intern(role)
+        self.text = text
+        # Contenu brut conservé uniquement s'il ne s'agit pas d'un simple texte
+        self.parts = parts
+
+    @classmethod
+    def from_api(cls, data: Dict) -> "Message":
+        """Build a message from an API-format dict"""
+        content = data.get("content", "")
+        if isinstance(content, str):
+            return cls(data["role"], content)
+        if len(content) == 1 and content[0].get("type") == "text" and len(content[0]) == 2:
+            return cls(data["role"], content[0]["text"])
+        return cls(data["role"], parts=content)
+
+    def to_api(self) -> Dict:
+        """Return the message in the chat completions wire format"""
+        if self.parts is not None:
+            return {"role": self.role, "content": self.parts}
+        return {"role": self.role, "content": [{"type": "text", "text": self.text}]}
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, text={self.text[:40]!r})"
+
+
+def _to_message(item: Union[Message, Dict]) -> Message:
+    if isinstance(item, Message):
+        return item
+    # Une copie simple : le message ne partage rien avec une vue de l'historique
+    return Message.from_api(_plain(item) if isinstance(item, _Tracked_Dict) else item)
+
+
+def _plain(value):
+    """Deep copy of tracked containers as plain dicts and lists"""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+class Message_Store(MutableSequence):
+    """
+    List of compact messages exposed as API-format dicts.
+
+    Indexing returns a fresh dict in the historical format; mutating that
+    returned dict does not change the stored message, assign it back
+    instead. Use `to_api()` to build the payload of a request, and `view()`
+    for a list whose edits are written back (the chatbots' `history`).
+    """
+
+    def __init__(self, messages: Iterable[Union[Message, Dict]] = ()):
+        self._messages: List[Message] = [_to_message(m) for m in messages]
+        # Incrémenté à chaque modification : une vue construite avant est périmée
+        self._version = 0
+        self._view: Optional["History_View"] = None
+
+    @property
+    def messages(self) -> List[Message]:
+        return self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [m.to_api() for m in self._messages[index]]
+        return self._messages[index].to_api()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._messages[index] = [_to_message(m) for m in value]
+        else:
+            self._messages[index] = _to_message(value)
+        self._version += 1
+
+    def __delitem__(self, index):
+        del self._messages[index]
+        self._version += 1
+
+    def insert(self, index, value):
+        self._messages.insert(index, _to_message(value))
+        self._version += 1
+
+    def __eq__(self, other):
+        if isinstance(other, (Message_Store, list)):
+            return self.to_api() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Message_Store({len(self._messages)} messages)"
+
+    def add(self, role: str, text: str) -> Message:
+        """Append a text message and return it"""
+        message = Message(role, text)
+        self._messages.append(message)
+        self._version += 1
+        return message
+
+    def to_api(self) -> List[Dict]:
+        """Serialize all messages to the chat completions wire format"""
+        return [m.to_api() for m in self._messages]
+
+    def view(self) -> "History_View":
+        """List of the messages whose edits are written back, rebuilt only after a change"""
+        if self._view is None or self._view.version != self._version:
+            self._view = History_View(self)
+        return self._view
+
+
+_LIST_MUTATORS = ("append", "extend", "insert", "pop", "remove", "clear", "sort", "reverse",
+                  "__setitem__", "__delitem__", "__iadd__", "__imul__")
+_DICT_MUTATORS = ("__setitem__", "__delitem__", "pop", "popitem", "clear", "update", "setdefault", "__ior__")
+
+
+def _write_back(base: type, name: str):
+    method = getattr(base, name)
+
+    def mutator(self, *args, **kwargs):
+        self._root.check()
+        result = method(self, *args, **kwargs)
+        self._root.sync()
+        return result
+
+    mutator.__name__ = name
+    return mutator
+
+
+class _Tracked_List(list):
+    __slots__ = ("_root",)
+
+
+class _Tracked_Dict(dict):
+    __slots__ = ("_root",)
+
+
+for _name in _LIST_MUTATORS:
+    setattr(_Tracked_List, _name, _write_back(list, _name))
+for _name in _DICT_MUTATORS:
+    setattr(_Tracked_Dict, _name, _write_back(dict, _name))
+
+
+def _track(value, root: "History_View"):
+    """Tracked version of a container and, in place, of everything inside it"""
+    if isinstance(value, dict):
+        if not isinstance(value, _Tracked_Dict):
+            value = _Tracked_Dict(value)
+        value._root = root
+        for key, item in value.items():
+            dict.__setitem__(value, key, _track(item, root))
+    elif isinstance(value, list):
+        if not isinstance(value, _Tracked_List):
+            value = _Tracked_List(value)
+        value._root = root
+        for index, item in enumerate(value):
+            list.__setitem__(value, index, _track(item, root))
+    return value
+
+
+class History_View(_Tracked_List):
+    """
+    Messages of a Message_Store as a real list of API-format dicts.
+
+    json.dump and list operations work as on the historical `history` list.
+    Edits, to the list, to a message dict or to its content parts, are
+    written back to the store. Once the store changed (a new turn), the view
+    is stale: editing it raises RuntimeError instead of overwriting the
+    newer messages; read `history` again.
+    """
+    __slots__ = ("store", "version")
+
+    def __init__(self, store: Message_Store):
+        super().__init__(store.to_api())
+        self.store = store
+        self.version = store._version
+        _track(self, self)
+
+    def check(self):
+        if self.version != self.store._version:
+            raise RuntimeError("Historique périmé (la conversation a changé) : relire chatbot.history")
+
+    def sync(self):
+        """Rebuild the store's messages from the edited list"""
+        _track(self, self)
+        self.store._messages = [Message.from_api(_plain(m)) for m in self]
+        self.store._version += 1
+        self.version = self.store._version
@@ -0,0 +1,65 @@
+"""
+Convertit un arbre conversations/ existant vers un format de stockage
+(voir storage.py), en vérifiant chaque fichier réécrit avant de supprimer
+l'original.
+
+Usage: python migrate_conversations.py [--root conversations] [--format gzip] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+import storage
+
+
+def iter_conversation_files(root: str):
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.startswith("conversation_") and name.endswith(storage.SEARCH_EXTENSIONS):
+                yield os.path.join(folder, name)
+
+
+def migrate_file(path: str, fmt: str, dry_run: bool = False) -> tuple:
+    """Rewrite one conversation file in fmt; return (bytes before, bytes after)"""
+    before = os.path.getsize(path)
+    data = storage.read_file(path)
+    encoded = storage.encode(data, fmt)
+    if storage.decode(encoded) != data:
+        raise ValueError(f"Relecture différente après conversion: {path}")
+    if not dry_run:
+        base = os.path.join(os.path.dirname(path), storage.strip_extension(os.path.basename(path)))
+        storage.write_file(base, data, fmt)
+    return before, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="conversations")
+    parser.add_argument("--format", default="gzip", choices=storage.FORMATS)
+    parser.add_argument("--dry-run", action="store_true", help="mesurer sans réécrire")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        sys.exit(f"Dossier introuvable: {args.root}")
+
+    count = errors = total_before = total_after = 0
+    for path in list(iter_conversation_files(args.root)):
+        try:
+            before, after = migrate_file(path, args.format, args.dry_run)
+        except (OSError, ValueError) as e:
+            errors += 1
+            print(f"Erreur: {path}: {e}", file=sys.stderr)
+            continue
+        count += 1
+        total_before += before
+        total_after += after
+
+    ratio = total_after / total_before if total_before else 1.0
+    action = "mesurées" if args.dry_run else "converties"
+    print(f"{count} conversations {action} vers '{args.format}', {errors} erreur(s)")
+    print(f"{total_before / 1024:.1f} KiB -> {total_after / 1024:.1f} KiB ({ratio:.0%})")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
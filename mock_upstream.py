@@ -0,0 +1,346 @@
+"""
+Serveur factice compatible avec l'API chat completions d'OpenAI, pour
+exercer les chatbots en local sans réseau ni clé API. Il répond aussi aux
+GET des endpoints FMP (/api/v3, /api/v4) et SerpAPI (/search) avec des
+données synthétiques déterministes.
+
+Usage: python mock_upstream.py [--port 8900] [--first-token-ms 50] [--token-ms 5] [--upstream-ms 20]
+puis OPENAI_API_BASE=http://127.0.0.1:8900/v1 OPENAI_API_KEY=test
+     FMP_BASE_URL=http://127.0.0.1:8900 SERPAPI_BASE_URL=http://127.0.0.1:8900 ...
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+def tool_call(name: str, **arguments) -> Dict:
+    """Reply asking the client to call one tool"""
+    return {"tool_calls": [{"name": name, "arguments": arguments}]}
+
+
+def estimate_tokens(payload: Dict) -> int:
+    """Rough prompt size in tokens (4 characters per token), tools included"""
+    size = len(json.dumps(payload.get("messages", []), ensure_ascii=False))
+    size += len(json.dumps(payload.get("tools", []), ensure_ascii=False))
+    return size // 4
+
+
+def default_reply(payload: Dict) -> str:
+    """Answer router prompts with 'no function' and echo the last user message otherwise"""
+    messages = payload.get("messages", [])
+    system = messages[0].get("content", "") if messages else ""
+    if isinstance(system, str) and system.startswith("Vous êtes un routeur"):
+        return json.dumps({"function_id": 0, "input": None})
+
+    last = messages[-1].get("content", "") if messages else ""
+    if isinstance(last, list):
+        last = " ".join(part.get("text", "") for part in last)
+    return f"Réponse simulée à : {last}"
+
+
+# Postes numériques renvoyés par les endpoints d'historique FMP
+_HISTORY_FIELDS = ("revenue", "grossProfit", "operatingIncome", "netIncome", "ebitda", "eps",
+                   "totalAssets", "totalCurrentAssets", "totalCurrentLiabilities", "totalDebt",
+                   "totalStockholdersEquity", "operatingCashFlow", "freeCashFlow")
+
+
+def _history(rng: random.Random, symbol: str, count: int, quarterly: bool) -> List[Dict]:
+    step = 91 if quarterly else 365
+    scale = rng.uniform(1e9, 1e11)
+    records = []
+    for i in range(count):
+        day = date(2024, 9, 30) - timedelta(days=step * i)
+        record = {"date": day.isoformat(), "symbol": symbol, "period": "Q" if quarterly else "FY"}
+        for field in _HISTORY_FIELDS:
+            record[field] = round(scale * rng.uniform(0.05, 1.0), 2 if field == "eps" else 0)
+        records.append(record)
+    return records
+
+
+# Une actualité factice toutes les 6 heures, jusqu'à l'heure courante
+NEWS_INTERVAL = 6 * 3600
+
+
+def _news(query: Dict[str, str]) -> List[Dict]:
+    """One page of synthetic news, most recent first, within from/to"""
+    symbol = query.get("tickers", "AAPL").split(",")[0].upper()
+    latest = int(time.time()) // NEWS_INTERVAL
+    size = int(query.get("limit", 20))
+    start = int(query.get("page", 0)) * size
+    items = []
+    for n in range(latest, latest - 400, -1):
+        published = datetime.fromtimestamp(n * NEWS_INTERVAL, timezone.utc)
+        day = published.date().isoformat()
+        if "to" in query and day > query["to"]:
+            continue
+        if "from" in query and day < query["from"]:
+            break
+        items.append({"symbol": symbol, "publishedDate": published.strftime("%Y-%m-%d %H:%M:%S"),
+                      "title": f"Actualité {n} sur {symbol}", "text": "Contenu synthétique.",
+                      "site": "example.com", "url": f"https://example.com/news/{symbol}/{n}"})
+    return items[start:start + size]
+
+
+def fmp_payload(path: str, query: Dict[str, str]) -> Any:
+    """Synthetic FMP body for a request path, stable for a given symbol"""
+    parts = [part for part in path.split("/") if part]
+    symbol = (query.get("symbol") or (parts[-1] if len(parts) > 2 else "AAPL")).upper()
+    rng = random.Random(zlib.crc32(path.encode()))
+    price = round(rng.uniform(10, 900), 2)
+    endpoint = parts[2] if len(parts) > 2 else ""
+
+    if endpoint == "quote":
+        return [{"symbol": symbol, "name": f"{symbol} Inc.", "price": price,
+                 "changesPercentage": round(rng.uniform(-5, 5), 2), "change": round(rng.uniform(-9, 9), 2),
+                 "dayLow": round(price * 0.98, 2), "dayHigh": round(price * 1.02, 2),
+                 "marketCap": int(price * 1e9), "volume": rng.randint(10**5, 10**8), "exchange": "NASDAQ"}]
+    if endpoint == "profile":
+        return [{"symbol": symbol, "companyName": f"{symbol} Inc.", "price": price, "currency": "USD",
+                 "exchange": "NASDAQ", "industry": "Technology", "sector": "Technology",
+                 "description": f"{symbol} Inc. conçoit et vend des produits fictifs.",
+                 "ceo": "Jane Doe", "website": f"https://{symbol.lower()}.example", "mktCap": int(price * 1e9)}]
+    if endpoint == "market-capitalization":
+        return [{"symbol": symbol, "date": "2024-09-30", "marketCap": int(price * 1e9)}]
+    if endpoint == "discounted-cash-flow":
+        return [{"symbol": symbol, "date": "2024-09-30", "dcf": round(price * rng.uniform(0.7, 1.3), 2),
+                 "Stock Price": price}]
+    if endpoint == "stock-price-change":
+        return [{"symbol": symbol, **{k: round(rng.uniform(-30, 60), 2)
+                                      for k in ("1D", "5D", "1M", "3M", "6M", "ytd", "1Y", "5Y")}}]
+    if endpoint == "stock_peers":
+        return [{"symbol": symbol, "peersList": ["MSFT", "GOOGL", "AMZN", "META"]}]
+    if endpoint == "score":
+        return [{"symbol": symbol, "altmanZScore": round(rng.uniform(1, 10), 2), "piotroskiScore": rng.randint(1, 9)}]
+    if endpoint == "search":
+        return [{"symbol": symbol, "name": f"{symbol} Inc.", "exchangeShortName": "NASDAQ"}]
+    if endpoint == "stock_news":
+        return _news(query)
+    if endpoint == "historical" and "earning_calendar" in parts:
+        return [{"symbol": symbol, "date": (date(2024, 10, 30) - timedelta(days=91 * i)).isoformat(),
+                 "eps": round(rng.uniform(0, 5), 2), "epsEstimated": round(rng.uniform(0, 5), 2)}
+                for i in range(int(query.get("limit", 8)))]
+    if endpoint in ("income-statement", "balance-sheet-statement", "cash-flow-statement",
+                    "key-metrics", "ratios", "financial-growth"):
+        count = int(query.get("limit", 5))
+        return _history(rng, symbol, count, query.get("period") == "quarter")
+    return [{"symbol": symbol, "date": "2024-09-30", "value": price}]
+
+
+def serpapi_payload(query: Dict[str, str]) -> Dict:
+    """Synthetic SerpAPI body: a few organic results for the query"""
+    q = query.get("q") or query.get("term") or query.get("engine", "")
+    return {
+        "search_metadata": {"status": "Success"},
+        "search_parameters": {"engine": query.get("engine", "google"), "q": q},
+        "organic_results": [
+            {"position": i + 1, "title": f"Résultat {i + 1} pour {q}",
+             "link": f"https://example.com/{i + 1}", "snippet": "Extrait synthétique."}
+            for i in range(5)
+        ],
+    }
+
+
+class Mock_OpenAI_Server:
+    """
+    Threaded local HTTP server answering POST /v1/chat/completions, and GET
+    on FMP and SerpAPI paths.
+
+    Args:
+        reply (Callable): Builds the answer from the request payload: a text, or
+            {"tool_calls": [{"name": ..., "arguments": {...}}]} to call tools
+        first_token_delay (float): Seconds before the first byte of a response
+        token_delay (float): Seconds between streamed chunks
+        upstream_delay (float): Seconds before answering an FMP or SerpAPI GET
+        upstream_concurrency (int): FMP/SerpAPI requests served at once, the others
+            queue as behind a provider quota (None: unlimited)
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        reply: Callable[[Dict], str] = default_reply,
+        first_token_delay: float = 0.0,
+        token_delay: float = 0.0,
+        upstream_delay: float = 0.0,
+        upstream_concurrency: Optional[int] = None
+    ):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.upstream_delay = upstream_delay
+        self._upstream_slots = threading.Semaphore(upstream_concurrency) if upstream_concurrency else None
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def base_url(self) -> str:
+        """Value for FMP_BASE_URL / SERPAPI_BASE_URL"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "Mock_OpenAI_Server":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                split = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(split.query).items()}
+                if split.path.startswith("/api/"):
+                    data = fmp_payload(split.path, query)
+                elif split.path == "/search":
+                    data = serpapi_payload(query)
+                else:
+                    self.send_error(404)
+                    return
+                if server._upstream_slots is not None:
+                    with server._upstream_slots:
+                        time.sleep(server.upstream_delay)
+                elif server.upstream_delay:
+                    time.sleep(server.upstream_delay)
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.request_count += 1
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+
+                reply = server.reply(payload)
+                tool_calls = None
+                if isinstance(reply, dict):
+                    tool_calls = [
+                        {"id": f"call_{i}", "type": "function",
+                         "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}}
+                        for i, call in enumerate(reply.get("tool_calls", []))
+                    ]
+                    reply = reply.get("content") or ""
+                time.sleep(server.first_token_delay)
+                if payload.get("stream"):
+                    self._stream(payload, reply, tool_calls)
+                else:
+                    self._complete(payload, reply, tool_calls)
+
+            def _complete(self, payload: Dict, text: str, tool_calls: Optional[List[Dict]] = None):
+                message = {"role": "assistant", "content": text or None}
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                body = json.dumps({
+                    "object": "chat.completion",
+                    "model": payload.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if tool_calls else "stop"
+                    }],
+                    "usage": {"prompt_tokens": estimate_tokens(payload), "completion_tokens": len(text.split())}
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, payload: Dict, text: str, tool_calls: Optional[List[Dict]] = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                # Découpage en mots pour simuler des tokens
+                chunks = [word + " " for word in text.split(" ")] if text else []
+                if chunks:
+                    chunks[-1] = chunks[-1][:-1]
+                deltas = [{"content": chunk} for chunk in chunks]
+                # Appels d'outils : nom d'abord, arguments en fragments, comme l'API
+                for index, call in enumerate(tool_calls or ()):
+                    deltas.append({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                                   "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                    arguments = call["function"]["arguments"]
+                    for start in range(0, len(arguments), 16):
+                        deltas.append({"tool_calls": [{"index": index,
+                                                       "function": {"arguments": arguments[start:start + 16]}}]})
+                try:
+                    for delta in deltas:
+                        event = {"choices": [{"index": 0, "delta": delta}]}
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                        if server.token_delay:
+                            time.sleep(server.token_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--first-token-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--upstream-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = Mock_OpenAI_Server(
+        args.host, args.port,
+        first_token_delay=args.first_token_ms / 1000,
+        token_delay=args.token_ms / 1000,
+        upstream_delay=args.upstream_ms / 1000
+    )
+    print(f"Serveur factice OpenAI sur {server.api_base}, FMP/SerpAPI sur {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
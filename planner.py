@@ -0,0 +1,196 @@
+"""
+Plans d'appels dépendants : le routeur décrit une question à plusieurs
+étapes (concurrents d'une action, puis le cours de chacun) par un petit
+graphe d'appels, exécuté niveau par niveau, les appels d'un même niveau en
+parallèle.
+
+Un plan est une liste d'étapes :
+
+    {"plan": [
+        {"id": "peers", "function_id": 9, "input": {"symbol": "AAPL"}},
+        {"id": "quotes", "function_id": 3, "for_each": "$peers", "input": {"symbol": "$item"}}
+    ]}
+
+- "$<id>" reprend le résultat d'une étape précédente, "$<id>.<clé>" un de
+  ses champs (ou un indice de liste) ;
+- "for_each" exécute l'étape pour chaque élément d'une liste (au plus
+  max_fan_out), l'élément courant étant "$item" ; le résultat est alors un
+  dictionnaire élément -> résultat.
+
+Deux appels identiques d'un même plan ne sont exécutés qu'une fois ; entre
+les tours, les appels amont passent par le cache de resilience.
+"""
+import contextvars
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+ITEM = "item"
+MAX_PLAN_STEPS = 8
+DEFAULT_FAN_OUT = 8
+
+
+class Plan_Step:
+    """One function call of a plan, possibly repeated for each element of an earlier output"""
+    __slots__ = ("id", "function_id", "input", "for_each", "depends")
+
+    def __init__(self, step_id: str, function_id: int, function_input: Optional[Dict],
+                 for_each: Optional[str] = None):
+        self.id = step_id
+        self.function_id = function_id
+        self.input = function_input or {}
+        self.for_each = for_each
+        # Étapes dont les résultats sont référencés
+        self.depends: Set[str] = _references(self.input) | _references(for_each)
+
+    def __repr__(self):
+        return f"Plan_Step({self.id!r}, function_id={self.function_id}, depends={sorted(self.depends)})"
+
+
+def _references(value: Any) -> Set[str]:
+    """Step ids referenced by "$<id>" strings inside a value"""
+    if isinstance(value, str):
+        if value.startswith("$"):
+            name = value[1:].split(".", 1)[0]
+            return set() if name == ITEM else {name}
+        return set()
+    if isinstance(value, dict):
+        return set().union(*(_references(v) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(_references(v) for v in value))
+    return set()
+
+
+def parse_plan(plan: Any, functions_dict: Dict[int, Dict], max_steps: int = MAX_PLAN_STEPS) -> List[List[Plan_Step]]:
+    """
+    Validate a router plan and group its steps into levels.
+
+    Args:
+        plan (list): Steps as emitted by the router
+        functions_dict (Dict[int, Dict]): Available functions
+        max_steps (int): Steps allowed at most
+
+    Returns:
+        List[List[Plan_Step]]: Levels, each depending only on earlier ones
+
+    Raises:
+        ValueError: Malformed plan, unknown function or step, or a cycle
+    """
+    if not isinstance(plan, list) or not plan:
+        raise ValueError("le plan doit être une liste d'étapes non vide")
+    if len(plan) > max_steps:
+        raise ValueError(f"plan trop long ({len(plan)} étapes, {max_steps} au plus)")
+
+    steps: Dict[str, Plan_Step] = {}
+    for index, raw in enumerate(plan):
+        if not isinstance(raw, dict):
+            raise ValueError(f"étape {index}: un dictionnaire est attendu")
+        step_id = str(raw.get("id") or f"step{index}")
+        function_id = raw.get("function_id")
+        if function_id not in functions_dict:
+            raise ValueError(f"étape {step_id}: fonction {function_id} inconnue")
+        if step_id in steps or step_id == ITEM:
+            raise ValueError(f"étape {step_id}: identifiant en double ou réservé")
+        function_input = raw.get("input")
+        if function_input is not None and not isinstance(function_input, dict):
+            raise ValueError(f"étape {step_id}: 'input' doit être un dictionnaire")
+        for_each = raw.get("for_each")
+        if for_each is not None and not (isinstance(for_each, str) and for_each.startswith("$")):
+            raise ValueError(f"étape {step_id}: 'for_each' doit référencer une étape ($<id>)")
+        steps[step_id] = Plan_Step(step_id, function_id, function_input, for_each)
+
+    for step in steps.values():
+        unknown = step.depends - set(steps)
+        if unknown:
+            raise ValueError(f"étape {step.id}: référence à des étapes inconnues {sorted(unknown)}")
+
+    # Niveaux de Kahn : une étape part dès que toutes ses dépendances sont faites
+    levels: List[List[Plan_Step]] = []
+    done: Set[str] = set()
+    remaining = list(steps.values())
+    while remaining:
+        level = [step for step in remaining if step.depends <= done]
+        if not level:
+            raise ValueError(f"dépendances circulaires entre {[step.id for step in remaining]}")
+        levels.append(level)
+        done.update(step.id for step in level)
+        remaining = [step for step in remaining if step.id not in done]
+    return levels
+
+
+def resolve(value: Any, outputs: Dict[str, Any], item: Any = None) -> Any:
+    """Replace "$<id>[.<key>...]" references by the outputs (or fan-out item) they name"""
+    if isinstance(value, str) and value.startswith("$"):
+        name, *path = value[1:].split(".")
+        current = item if name == ITEM else outputs.get(name)
+        for key in path:
+            if isinstance(current, dict):
+                current = current.get(key)
+            elif isinstance(current, list) and key.lstrip("-").isdigit() and -len(current) <= int(key) < len(current):
+                current = current[int(key)]
+            else:
+                return None
+        return current
+    if isinstance(value, dict):
+        return {k: resolve(v, outputs, item) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, outputs, item) for v in value]
+    return value
+
+
+class Plan_Executor:
+    """
+    Runs plan levels one after the other, the calls of a level in parallel.
+
+    Args:
+        run_function (Callable): Runs one call, (function_id, input) -> result
+        max_workers (int): Calls running at once
+        max_fan_out (int): Elements of a for_each list a step is run for at most
+    """
+
+    def __init__(self, run_function: Callable[[int, Dict], Any], max_workers: int = 8,
+                 max_fan_out: int = DEFAULT_FAN_OUT):
+        self.run_function = run_function
+        self.max_workers = max_workers
+        self.max_fan_out = max_fan_out
+
+    def _calls(self, step: Plan_Step, outputs: Dict[str, Any]) -> Tuple[Optional[List[Any]], List[Dict]]:
+        """Fan-out items (None for a single call) and resolved inputs of a step"""
+        if step.for_each is None:
+            return None, [resolve(step.input, outputs)]
+        items = resolve(step.for_each, outputs)
+        if isinstance(items, dict):
+            items = list(items)
+        elif not isinstance(items, list):
+            items = [] if items is None else [items]
+        items = items[:self.max_fan_out]
+        return items, [resolve(step.input, outputs, item) for item in items]
+
+    def execute(self, levels: List[List[Plan_Step]]) -> Dict[str, Any]:
+        """Run every step; return step id -> result (element -> result for for_each steps)"""
+        outputs: Dict[str, Any] = {}
+        # Appels identiques du plan partagés : (function_id, arguments) -> Future
+        calls: Dict[Tuple[int, str], Future] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="plan") as pool:
+            for level in levels:
+                pending = []
+                for step in level:
+                    items, inputs = self._calls(step, outputs)
+                    futures = []
+                    for function_input in inputs:
+                        key = (step.function_id, json.dumps(function_input, sort_keys=True, default=str))
+                        future = calls.get(key)
+                        if future is None:
+                            # Chaque appel garde le contexte de l'appelant (délai du tour, classe d'ordonnancement)
+                            context = contextvars.copy_context()
+                            future = pool.submit(context.run, self.run_function, step.function_id, function_input)
+                            calls[key] = future
+                        futures.append(future)
+                    pending.append((step, items, futures))
+                for step, items, futures in pending:
+                    results = [future.result() for future in futures]
+                    if items is None:
+                        outputs[step.id] = results[0]
+                    else:
+                        outputs[step.id] = {str(item): result for item, result in zip(items, results)}
+        return outputs
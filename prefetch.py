@@ -0,0 +1,135 @@
+"""
+Préchargement en arrière-plan des symboles les plus demandés : la popularité
+est mesurée sur les appels routés et les fonctions de marché correspondantes
+sont rafraîchies dans le cache avant que les utilisateurs ne les demandent.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from resilience import revalidate
+from scheduler import BATCH, request_class
+
+# get_stock_quote, get_stock_price_change, get_key_metrics, get_stock_peers
+DEFAULT_PREFETCH_FUNCTIONS = (3, 4, 6, 9)
+
+
+class Rate_Budget:
+    """Token bucket limiting the number of upstream calls per minute"""
+
+    def __init__(self, calls_per_minute: float):
+        self.capacity = calls_per_minute
+        self.rate = calls_per_minute / 60.0
+        self.tokens = calls_per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class Ticker_Prefetcher:
+    """
+    Keeps the hottest symbols warm in the upstream cache.
+
+    Args:
+        functions_dict (Dict): Function registry (see fonction.functions_dict)
+        function_ids (Iterable[int]): Functions refreshed for each hot symbol
+        top_n (int): Number of symbols kept warm
+        interval (float): Seconds between refresh rounds; keep it below the FMP fresh_ttl
+        calls_per_minute (float): Upstream calls the prefetcher may spend per minute
+        half_life (float): Seconds after which a symbol's popularity is halved
+    """
+
+    def __init__(
+        self,
+        functions_dict: Dict[int, Dict],
+        function_ids: Iterable[int] = DEFAULT_PREFETCH_FUNCTIONS,
+        top_n: int = 30,
+        interval: float = 45.0,
+        calls_per_minute: float = 120.0,
+        half_life: float = 1800.0
+    ):
+        self.functions_dict = functions_dict
+        self.function_ids = tuple(function_ids)
+        self.top_n = top_n
+        self.interval = interval
+        self.budget = Rate_Budget(calls_per_minute)
+        self.half_life = half_life
+        self.scores: Dict[str, float] = {}
+        self.refreshed = 0
+        self.skipped = 0
+        self._last_decay = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, function_id: int, function_input: Optional[Dict]):
+        """Count a routed call towards its symbol's popularity"""
+        if not isinstance(function_input, dict):
+            return
+        symbol = function_input.get("symbol")
+        if not isinstance(symbol, str) or not symbol:
+            return
+        symbol = symbol.strip().upper()
+        with self._lock:
+            self.scores[symbol] = self.scores.get(symbol, 0.0) + 1.0
+
+    def hot_symbols(self) -> List[str]:
+        """Most popular symbols, hottest first"""
+        self._decay()
+        with self._lock:
+            ranked = sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+        return [symbol for symbol, _ in ranked[:self.top_n]]
+
+    def _decay(self):
+        with self._lock:
+            now = time.monotonic()
+            factor = 0.5 ** ((now - self._last_decay) / self.half_life)
+            self._last_decay = now
+            # Les symboles devenus négligeables sont oubliés
+            self.scores = {s: v * factor for s, v in self.scores.items() if v * factor >= 0.05}
+
+    def refresh_once(self) -> int:
+        """Refresh the hot symbols once, within the rate budget; return the calls made"""
+        calls = 0
+        for symbol in self.hot_symbols():
+            for function_id in self.function_ids:
+                if self._stop.is_set():
+                    return calls
+                if not self.budget.try_take():
+                    self.skipped += 1
+                    continue
+                try:
+                    # Classe de fond : ne prend que la capacité laissée libre par les utilisateurs
+                    with revalidate(), request_class(BATCH, tenant="prefetch"):
+                        self.functions_dict[function_id]["function"](symbol=symbol)
+                except Exception:
+                    # Le préchargement ne doit jamais interrompre le service
+                    pass
+                calls += 1
+        self.refreshed += calls
+        return calls
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh_once()
+
+    def start(self) -> "Ticker_Prefetcher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticker-prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -1,41 +1,298 @@
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from answer_templates import render_answer
+from chatbot import OpenAI_Chatbot
+from llm import OpenAI_LLM
+from messages import Message
+from planner import DEFAULT_FAN_OUT, Plan_Executor, parse_plan
+from resilience import turn_deadline
+from result_store import RESULTS_FOLDER, Result_Store
+from scheduler import request_class
+from routeur import Function_Router_LLM
+from tools import build_tools
+
+if TYPE_CHECKING:
+    from prefetch import Ticker_Prefetcher
+
+
 class Enhanced_OpenAI_Chatbot(OpenAI_Chatbot):
     def __init__(
         self,
         llm: OpenAI_LLM,
-        router_llm: Function_Router_LLM,
+        router_llm: Optional[Function_Router_LLM],
         functions_dict: Dict[int, Dict],
+        fast_answers: bool = False,
+        prefetcher: Optional["Ticker_Prefetcher"] = None,
+        tool_calling: bool = False,
+        max_tool_rounds: int = 3,
+        result_recency: int = 1,
+        result_relevance: bool = True,
+        max_fan_out: int = DEFAULT_FAN_OUT,
         **kwargs
     ):
         super().__init__(llm=llm, **kwargs)
+        if router_llm is None and not tool_calling:
+            raise ValueError("router_llm is required unless tool_calling is enabled")
         self.router_llm = router_llm
         self.functions_dict = functions_dict
+        # Appel de fonctions natif : une seule requête choisit la fonction et
+        # répond, sans passer par le routeur
+        self.tool_calling = tool_calling
+        self.max_tool_rounds = max_tool_rounds
+        self.tools, self.tool_ids = build_tools(functions_dict) if tool_calling else ([], {})
+        # Réponses par gabarit pour les recherches simples signalées par le routeur
+        # (nécessite Function_Router_LLM(signal_simple_lookups=True))
+        self.fast_answers = fast_answers
+        # Suivi de popularité des symboles pour le préchargement (optionnel)
+        self.prefetcher = prefetcher
+        # Résultats de fonctions stockés à part, référencés dans l'historique et
+        # renvoyés en entier seulement pour le tour courant, les `result_recency`
+        # tours de fonction précédents et, avec result_relevance, ceux dont les
+        # arguments (symbole...) figurent dans la nouvelle question
+        self.result_store = Result_Store(os.path.join(self.conversation_folder, RESULTS_FOLDER),
+                                         writer=self.store.writer)
+        self.result_recency = result_recency
+        self.result_relevance = result_relevance
+        self._turn_results: List[Tuple[int, Any, Any]] = []
+        # Plans d'appels dépendants émis par le routeur (Function_Router_LLM(plan_calls=True))
+        self.plan_executor = Plan_Executor(self._run_function, max_fan_out=max_fan_out)
 
     def execute_function(self, function_id: int, function_input: Dict) -> str:
         """Exécute la fonction spécifiée avec les paramètres donnés"""
+        return str(self._run_function(function_id, function_input))
+
+    def _run_function(self, function_id: int, function_input: Dict) -> Any:
+        """Exécute la fonction et retourne son résultat brut, ou un message d'erreur"""
         if function_id not in self.functions_dict:
             return f"Erreur: Fonction {function_id} non trouvée"
         
         try:
             func = self.functions_dict[function_id]["function"]
-            result = func(**function_input)
-            return str(result)
+            return func(**function_input)
         except Exception as e:
             return f"Erreur lors de l'exécution de la fonction {function_id}: {e}"
 
-    def __call__(self, message: str) -> str:
+    def __call__(self, message: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        # Le délai du tour couvre le routage, la fonction et la réponse
+        with turn_deadline(self.turn_timeout), request_class(tenant=self.tenant):
+            if self.tool_calling:
+                return self._respond_with_tools(message, on_token)
+            return self._route_and_respond(message, on_token)
+
+    @staticmethod
+    def _enhanced_message(message: str, results: List[Tuple[int, Any]]) -> str:
+        """Question followed by the function results it is answered from"""
+        lines = [f"Question: {message}"]
+        for function_id, result in results:
+            lines.append(f"Résultat de la fonction {function_id}: {result}")
+        lines.append("Veuillez répondre à la question en utilisant ces informations.")
+        return "\n".join(lines)
+
+    def _route_and_respond(self, message: str, on_token: Optional[Callable[[str], None]]) -> str:
         # Utiliser le router pour déterminer quelle fonction utiliser
         route_result = self.router_llm.route_question(message)
+        if route_result.get("plan"):
+            return self._respond_with_plan(message, route_result["plan"], on_token)
         function_id = route_result.get("function_id", 0)
         function_input = route_result.get("input")
+        if self.prefetcher is not None and function_id:
+            self.prefetcher.record(function_id, function_input)
 
         # Si function_id est 0, traiter normalement
         if function_id == 0:
-            return super().__call__(message)
+            return super().__call__(message, on_token=on_token)
 
         # Sinon, exécuter la fonction et inclure le résultat dans le contexte
-        function_result = self.execute_function(function_id, function_input)
-        enhanced_message = f"""Question: {message}
-Résultat de la fonction {function_id}: {function_result}
-Veuillez répondre à la question en utilisant ces informations."""
+        raw_result = self._run_function(function_id, function_input)
+
+        # Recherche factuelle simple : réponse rendue localement, sans second appel
+        if self.fast_answers and route_result.get("answer_mode") == "template":
+            answer = render_answer(function_id, raw_result, route_result.get("language"))
+            if answer is not None:
+                return self._answer_locally(message, answer, on_token)
+
+        # La question est enregistrée avec la référence du résultat (voir _prepare_messages)
+        self._turn_results = [(function_id, function_input, raw_result)]
+        try:
+            return super().__call__(message, on_token=on_token)
+        finally:
+            self._turn_results = []
+
+    def _respond_with_plan(self, message: str, plan: Any, on_token: Optional[Callable[[str], None]]) -> str:
+        """Run a plan of dependent calls, then answer from all of their results"""
+        try:
+            levels = parse_plan(plan, self.functions_dict)
+        except ValueError as e:
+            if self.verbose:
+                print(f"Plan ignoré: {e}")
+            return super().__call__(message, on_token=on_token)
+        if self.prefetcher is not None:
+            for step in levels[0]:
+                if step.for_each is None:
+                    self.prefetcher.record(step.function_id, step.input)
+
+        outputs = self.plan_executor.execute(levels)
+        self._turn_results = [
+            (step.function_id, step.input, outputs[step.id]) for level in levels for step in level
+        ]
+        try:
+            return super().__call__(message, on_token=on_token)
+        finally:
+            self._turn_results = []
+
+    def _prepare_messages(self, message: str) -> List[Dict]:
+        if self._turn_results:
+            self.messages.append(self._result_message(message, self._turn_results))
+            return self._api_history()
+        return super()._prepare_messages(message)
+
+    def _result_message(self, message: str, results: List[Tuple[int, Any, Any]]) -> Message:
+        """User message holding the question and references to its stored function results"""
+        parts = [{"type": "text", "text": message}]
+        for function_id, function_input, result in results:
+            parts.append({"type": "function_result", "function_id": function_id, "input": function_input,
+                          "result_id": self.result_store.put(str(result))})
+        return Message("user", parts=parts)
+
+    def _api_history(self) -> List[Dict]:
+        """History with function results inlined only while recent or relevant"""
+        messages = self.messages.messages
+        with_results = [i for i, m in enumerate(messages) if _result_refs(m)]
+        if not with_results:
+            return self.messages.to_api()
+        # Tour courant : dernière question de l'utilisateur
+        current = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].role == "user"), -1)
+        earlier = [i for i in with_results if i != current]
+        inlined = set(earlier[-self.result_recency:] if self.result_recency > 0 else ()) | {current}
+        question = _question(messages[current]) if current >= 0 else ""
+
+        history = []
+        for index, m in enumerate(messages):
+            refs = _result_refs(m)
+            if not refs:
+                history.append(m.to_api())
+                continue
+            results = []
+            for ref in refs:
+                text = None
+                if index in inlined or (self.result_relevance and _is_relevant(ref, question)):
+                    text = self.result_store.get(ref["result_id"])
+                if text is None:
+                    arguments = json.dumps(ref.get("input"), ensure_ascii=False)
+                    text = f"[omis de l'historique ({arguments}), référence {ref['result_id']}]"
+                results.append((ref["function_id"], text))
+            history.append({"role": m.role, "content": [
+                {"type": "text", "text": self._enhanced_message(_question(m), results)}
+            ]})
+        return history
+
+    def _respond_with_tools(self, message: str, on_token: Optional[Callable[[str], None]]) -> str:
+        """Answer with native tool calling: one completion when no function is needed"""
+        messages = self._prepare_messages(message)
+        options = self.llm.request_options()
+        results: List[Tuple[int, Any, Any]] = []
+
+        if self.verbose:
+            print(f"\n{self.name} - User: ", message)
+            print(f"\n{self.name} - Assistant: ", end="")
+
+        for round_index in range(self.max_tool_rounds + 1):
+            # Dernier tour sans outils : le modèle doit répondre avec ce qu'il a
+            tools = self.tools if round_index < self.max_tool_rounds else None
+            response = self.llm._make_request(messages, options=options, tools=tools)
+            answer, tool_calls = self._read_completion(response, options.stream, on_token)
+            if not tool_calls:
+                break
+            messages.append({"role": "assistant", "content": answer or None, "tool_calls": tool_calls})
+            for call in tool_calls:
+                function_id, function_input, result = self._run_tool_call(call)
+                if function_id is not None:
+                    results.append((function_id, function_input, result))
+                messages.append({"role": "tool", "tool_call_id": call["id"], "content": str(result)})
+
+        if self.verbose:
+            print("\n")
+        if results:
+            # Historique au même format qu'avec le routeur : question et références des résultats
+            self.messages[-1] = self._result_message(message, results)
+        self.messages.add("assistant", answer)
+        self._save_conversation()
+        return answer
+
+    def _read_completion(self, response, stream: bool,
+                         on_token: Optional[Callable[[str], None]]) -> Tuple[str, List[Dict]]:
+        """Text and tool calls of a completion, streamed text being passed to on_token"""
+        if not stream:
+            message = response.json()["choices"][0]["message"]
+            text = message.get("content") or ""
+            if text:
+                if on_token is not None:
+                    on_token(text)
+                if self.verbose:
+                    self._print_streaming_response(text)
+            return text, message.get("tool_calls") or []
+
+        chunks = []
+        calls: Dict[int, Dict] = {}
+        for delta in self._stream_deltas(response):
+            content = delta.get("content")
+            if content:
+                chunks.append(content)
+                if on_token is not None:
+                    on_token(content)
+                if self.verbose:
+                    self._print_streaming_response(content)
+            # Les appels d'outils arrivent par fragments, regroupés par index
+            for fragment in delta.get("tool_calls") or ():
+                call = calls.setdefault(fragment.get("index", 0), {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""}
+                })
+                if fragment.get("id"):
+                    call["id"] = fragment["id"]
+                function = fragment.get("function") or {}
+                call["function"]["name"] += function.get("name") or ""
+                call["function"]["arguments"] += function.get("arguments") or ""
+        return "".join(chunks), [calls[index] for index in sorted(calls)]
+
+    def _run_tool_call(self, call: Dict) -> Tuple[Optional[int], Any, Any]:
+        """Run the function named by a tool call; returns (function_id, input, result or error message)"""
+        name = call["function"]["name"]
+        function_id = self.tool_ids.get(name)
+        if function_id is None:
+            return None, None, f"Erreur: outil {name} inconnu"
+        try:
+            function_input = json.loads(call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError as e:
+            return function_id, None, f"Erreur: arguments invalides pour {name}: {e}"
+        if self.prefetcher is not None:
+            self.prefetcher.record(function_id, function_input)
+        return function_id, function_input, self._run_function(function_id, function_input)
+
+
+def _result_refs(message: Message) -> List[Dict]:
+    """Function result references of a message (none for plain text)"""
+    if not message.parts:
+        return []
+    return [part for part in message.parts if part.get("type") == "function_result"]
+
+
+def _question(message: Message) -> str:
+    if message.parts is None:
+        return message.text
+    return "".join(part.get("text", "") for part in message.parts if part.get("type") == "text")
+
 
-        return super().__call__(enhanced_message)
+def _is_relevant(ref: Dict, question: str) -> bool:
+    """True if one of the call's arguments (symbol, query...) appears in the question"""
+    values = ref.get("input")
+    if not isinstance(values, dict):
+        return False
+    for value in values.values():
+        for item in value if isinstance(value, list) else (value,):
+            if isinstance(item, str) and len(item) >= 2 and \
+                    re.search(rf"(?<!\w){re.escape(item)}(?!\w)", question, re.IGNORECASE):
+                return True
+    return False
@@ -0,0 +1,422 @@
+"""
+Délais par tour, disjoncteurs par fournisseur et cache stale-while-revalidate
+pour les appels amont (OpenAI, FMP, SerpAPI).
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as Future_Timeout
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple, TYPE_CHECKING
+
+from json_extract import Field_Spec, extract
+from llm import requests
+from scheduler import INTERACTIVE, Ticket, current_class, get_scheduler
+
+if TYPE_CHECKING:
+    from shared_cache import Shared_Cache
+
+# ---- Délai par tour -------------------------------------------------------
+
+_deadline: ContextVar[Optional[float]] = ContextVar("turn_deadline", default=None)
+
+
+@contextlib.contextmanager
+def turn_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bound everything run inside the block to `seconds`.
+
+    Nested deadlines never extend an outer one. None leaves the current
+    deadline unchanged.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current turn deadline, or None without deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def request_timeout(default: float) -> float:
+    """Timeout for the next upstream call: `default`, capped by the turn deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise requests.exceptions.Timeout("Délai du tour dépassé")
+    return min(default, remaining)
+
+
+# ---- Disjoncteurs ---------------------------------------------------------
+
+class Circuit_Breaker:
+    """
+    Per-provider circuit breaker.
+
+    Opens after `failure_threshold` consecutive failures, rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through
+    (half-open) whose outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Return True if a call may be attempted now"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def check(self):
+        """Raise a requests ConnectionError if the circuit rejects the call"""
+        if not self.allow():
+            raise requests.exceptions.ConnectionError(f"Circuit {self.name} ouvert")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+breakers: Dict[str, Circuit_Breaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> Circuit_Breaker:
+    """Return the shared circuit breaker of a provider"""
+    breaker = breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = breakers.setdefault(provider, Circuit_Breaker(provider))
+    return breaker
+
+
+def is_upstream_failure(status_code: int) -> bool:
+    """Server errors and rate limiting count against the breaker, client errors do not"""
+    return status_code >= 500 or status_code == 429
+
+
+# ---- Cache stale-while-revalidate -----------------------------------------
+
+class Cached_Response:
+    """Minimal stand-in for requests.Response built from a cached body"""
+    __slots__ = ("status_code", "content", "url", "stale")
+
+    def __init__(self, status_code: int, content: bytes, url: str, stale: bool = False):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.stale = stale
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Provider_Config:
+    """
+    Upstream settings of one provider.
+
+    Args:
+        timeout (float): Seconds allowed per call, capped by the turn deadline
+        fresh_ttl (float): Seconds a cached body is served without revalidation
+        max_stale (float): Seconds a cached body may still be served when upstream fails
+        revalidate_timeout (float): Seconds to wait for a revalidation before serving stale
+        origin (str): Public origin of the provider's URLs
+        base_url_env (str): Environment variable replacing `origin` when set (local mocks)
+        concurrency (int): Simultaneous calls allowed by the provider's scheduler
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        fresh_ttl: float = 60.0,
+        max_stale: float = 24 * 3600.0,
+        revalidate_timeout: float = 1.0,
+        origin: Optional[str] = None,
+        base_url_env: Optional[str] = None,
+        concurrency: int = 16
+    ):
+        self.timeout = timeout
+        self.fresh_ttl = fresh_ttl
+        self.max_stale = max_stale
+        self.revalidate_timeout = revalidate_timeout
+        self.origin = origin
+        self.base_url_env = base_url_env
+        self.concurrency = concurrency
+
+    def resolve(self, url: str) -> str:
+        """Point url at the overriding base URL, if one is configured"""
+        base = os.getenv(self.base_url_env) if self.base_url_env else None
+        if base and self.origin and url.startswith(self.origin):
+            return base.rstrip("/") + url[len(self.origin):]
+        return url
+
+
+providers: Dict[str, Provider_Config] = {
+    "openai": Provider_Config(timeout=60.0, fresh_ttl=0.0, max_stale=0.0),
+    "fmp": Provider_Config(timeout=10.0, fresh_ttl=60.0,
+                           origin="https://financialmodelingprep.com", base_url_env="FMP_BASE_URL"),
+    "serpapi": Provider_Config(timeout=15.0, fresh_ttl=300.0, concurrency=8,
+                               origin="https://serpapi.com", base_url_env="SERPAPI_BASE_URL"),
+}
+
+
+# Cache partagé entre processus (voir shared_cache), derrière les caches nommés
+_shared_backend: Optional["Shared_Cache"] = None
+
+
+def use_shared_cache(backend: Optional["Shared_Cache"]):
+    """Back every namespaced Stale_Cache with a cache shared across processes (None: per process only)"""
+    global _shared_backend
+    _shared_backend = backend
+
+
+def shared_cache() -> Optional["Shared_Cache"]:
+    return _shared_backend
+
+
+class Stale_Cache:
+    """
+    Bounded LRU of cached values (successful upstream bodies) with their fetch time.
+
+    With a namespace, the LRU is the process-local level of the shared cache
+    configured by use_shared_cache: a miss, or a local entry older than
+    max_age, is looked up there, and every put is written through. Fetch
+    times are wall-clock times, comparable between processes.
+    """
+
+    def __init__(self, max_entries: int = 2048, namespace: Optional[str] = None):
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_key(self, key: Tuple) -> str:
+        return f"{self.namespace}:{json.dumps(key, ensure_ascii=False)}"
+
+    def get(self, key: Tuple, max_age: Optional[float] = None) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        backend = _shared_backend if self.namespace else None
+        if backend is not None and (entry is None or (max_age is not None and time.time() - entry[0] >= max_age)):
+            # Un autre processus a peut-être déjà rafraîchi cette entrée
+            shared = backend.get(self._shared_key(key))
+            if shared is not None and (entry is None or shared[0] > entry[0]):
+                entry = shared
+                self._store(key, entry)
+        return entry
+
+    def _store(self, key: Tuple, entry: Tuple[float, Any]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: Tuple, response: Any):
+        fetched_at = time.time()
+        self._store(key, (fetched_at, response))
+        backend = _shared_backend if self.namespace else None
+        if backend is not None:
+            backend.put(self._shared_key(key), response, fetched_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        backend = _shared_backend if self.namespace else None
+        if backend is not None:
+            backend.clear(f"{self.namespace}:")
+
+
+response_cache = Stale_Cache(namespace="upstream")
+_force_revalidate: ContextVar[bool] = ContextVar("force_revalidate", default=False)
+# Les appels amont passent par ce pool pour pouvoir survivre à l'attente
+# du tour et rafraîchir le cache en arrière-plan
+_fetch_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream-fetch")
+_in_flight: Dict[Tuple, "object"] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _cache_key(url: str, params: Optional[Dict], fields: Field_Spec = None) -> Tuple:
+    # Les clés d'API ne font pas partie de la clé de cache
+    items = tuple(sorted(
+        (k, str(v)) for k, v in (params or {}).items() if k not in ("apikey", "api_key")
+    ))
+    if fields is None:
+        return (url, items)
+    return (url, items, json.dumps(fields, sort_keys=True))
+
+
+def _read_body(response, fields: Field_Spec) -> bytes:
+    """Body of a streamed response, reduced to `fields` when the call succeeded"""
+    if fields is None or not 200 <= response.status_code < 300:
+        return response.content
+    from urllib3.exceptions import HTTPError as Transport_Error
+
+    try:
+        # Corps lu en flux : seuls les champs retenus sont construits puis mis en cache
+        response.raw.decode_content = True
+        value = extract(response.raw, fields)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(f"Réponse JSON invalide: {e}")
+    except Transport_Error as e:
+        # Erreurs de lecture du flux, hors de l'enveloppe de requests
+        raise requests.exceptions.ConnectionError(e)
+    finally:
+        response.close()
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _fetch(provider: str, url: str, params: Optional[Dict], timeout: float, key: Tuple,
+           fields: Field_Spec = None, ticket: Optional[Ticket] = None) -> Cached_Response:
+    """Perform the call in a scheduler slot, through the breaker, and cache a successful body"""
+    scheduler = get_scheduler(provider)
+    ticket = ticket or Ticket(*current_class())
+    if ticket.granted is None:
+        scheduler.acquire(ticket, timeout)
+    try:
+        breaker = get_breaker(provider)
+        breaker.check()
+        # La clé de cache garde l'URL publique, seule la cible de l'appel change
+        target = (providers.get(provider) or Provider_Config()).resolve(url)
+        try:
+            response = requests.get(target, params=params, timeout=timeout, stream=fields is not None)
+            content = _read_body(response, fields)
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            raise
+    finally:
+        scheduler.release(ticket)
+    if is_upstream_failure(response.status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    cached = Cached_Response(response.status_code, content, response.url)
+    if 200 <= response.status_code < 300:
+        response_cache.put(key, cached)
+    else:
+        response.raise_for_status()
+    return cached
+
+
+def _submit_fetch(provider: str, url: str, params: Optional[Dict], timeout: float, key: Tuple,
+                  fields: Field_Spec = None):
+    """Start a fetch in the background pool, sharing one in-flight call per key"""
+    # Le pool ne reçoit pas le contexte : la classe de l'appel voyage dans son ticket
+    ticket = Ticket(*current_class())
+    if ticket.priority != INTERACTIVE:
+        # Un appel de fond attend sa place dans le thread appelant : l'ordonnanceur
+        # voit tous les demandeurs, et le pool ne reçoit que des appels prêts à partir
+        get_scheduler(provider).acquire(ticket, timeout)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = _fetch_pool.submit(_fetch, provider, url, params, timeout, key, fields, ticket)
+            _in_flight[key] = future
+            future.add_done_callback(lambda f: _in_flight.pop(key, None))
+            return future
+    # Même appel déjà en cours : la place obtenue n'est pas utilisée
+    get_scheduler(provider).release(ticket)
+    return future
+
+
+@contextlib.contextmanager
+def revalidate() -> Iterator[None]:
+    """Make http_get calls inside the block refetch even when the cached body is fresh"""
+    token = _force_revalidate.set(True)
+    try:
+        yield
+    finally:
+        _force_revalidate.reset(token)
+
+
+def http_get(provider: str, url: str, params: Optional[Dict] = None,
+             fields: Field_Spec = None) -> Cached_Response:
+    """
+    GET an upstream JSON endpoint with a bounded wait.
+
+    With `fields` (a json_extract spec), the body is streamed and only the
+    selected fields are parsed, cached and returned.
+
+    A fresh cached body is returned directly. Otherwise the call is made in
+    the background and awaited for at most the provider timeout (capped by
+    the turn deadline); if a stale body exists the wait is shortened to
+    `revalidate_timeout` and the stale body is served when upstream is slow,
+    failing or open-circuited, while the refresh completes in the background.
+    """
+    config = providers.get(provider) or Provider_Config()
+    key = _cache_key(url, params, fields)
+    entry = response_cache.get(key, max_age=config.fresh_ttl)
+    forced = _force_revalidate.get()
+    stale: Optional[Cached_Response] = None
+    if entry is not None:
+        age = time.time() - entry[0]
+        if age < config.fresh_ttl and not forced:
+            return entry[1]
+        if age < config.max_stale:
+            stale = entry[1]
+
+    if stale is not None and get_breaker(provider).state == "open":
+        return Cached_Response(stale.status_code, stale.content, stale.url, stale=True)
+
+    timeout = request_timeout(config.timeout)
+    future = _submit_fetch(provider, url, params, config.timeout, key, fields)
+    wait = min(timeout, config.revalidate_timeout) if stale is not None and not forced else timeout
+    try:
+        return future.result(timeout=wait)
+    except Future_Timeout:
+        if stale is None:
+            raise requests.exceptions.Timeout(f"{provider}: pas de réponse après {wait:.1f} s")
+    except requests.exceptions.RequestException:
+        if stale is None:
+            raise
+    return Cached_Response(stale.status_code, stale.content, stale.url, stale=True)
@@ -0,0 +1,86 @@
+"""
+Résultats de fonctions d'un chatbot, conservés hors de l'historique.
+
+Un résultat est écrit une seule fois, sous un identifiant dérivé de son
+contenu (<dossier>/<xx>/<id>.json.gz) : l'historique n'en garde que la
+référence, et deux appels au résultat identique partagent le même fichier.
+Les écritures passent par le Conversation_Writer des conversations, en
+arrière-plan, et un résultat en attente d'écriture reste lisible.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Optional, TYPE_CHECKING
+
+import storage
+
+if TYPE_CHECKING:
+    from conversation_store import Conversation_Writer
+
+RESULTS_FOLDER = "results"
+
+
+def result_id(text: str) -> str:
+    """Identifier of a result, derived from its content"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+class Result_Store:
+    """
+    Content-addressed function results of one chatbot folder.
+
+    Args:
+        folder (str): Results folder
+        writer (Conversation_Writer): Background writer (None: synchronous writes)
+        cache_size (int): Results kept in memory
+    """
+
+    def __init__(self, folder: str, writer: Optional["Conversation_Writer"] = None, cache_size: int = 64):
+        self.folder = folder
+        self.writer = writer
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def _base_path(self, result_id: str) -> str:
+        return os.path.join(self.folder, result_id[:2], result_id)
+
+    def _remember(self, result_id: str, text: str):
+        self._cache[result_id] = text
+        self._cache.move_to_end(result_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def write(self, result_id: str, data: Any, fmt: str = "gzip", fsync: bool = False) -> str:
+        """Write one result file (called directly or by the background writer)"""
+        base = self._base_path(result_id)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        return storage.write_file(base, data, fmt, fsync)
+
+    def put(self, text: str) -> str:
+        """Store a result once and return its identifier"""
+        key = result_id(text)
+        if key in self._cache or storage.find_file(self._base_path(key)) is not None:
+            self._remember(key, text)
+            return key
+        data = {"result_id": key, "text": text}
+        if self.writer is not None:
+            self.writer.submit(self, key, data, "gzip")
+        else:
+            self.write(key, data)
+        self._remember(key, text)
+        return key
+
+    def get(self, result_id: str) -> Optional[str]:
+        """Text of a stored result, None if it is unknown"""
+        text = self._cache.get(result_id)
+        if text is not None:
+            self._cache.move_to_end(result_id)
+            return text
+        data = self.writer.pending(self.folder, result_id) if self.writer is not None else None
+        if data is None:
+            path = storage.find_file(self._base_path(result_id))
+            if path is None:
+                return None
+            data = storage.read_file(path)
+        self._remember(result_id, data["text"])
+        return data["text"]
@@ -0,0 +1,366 @@
+"""
+Évaluation des routeurs : un jeu de questions étiquetées (fonction attendue
+et arguments attendus, au moins une question par entrée de functions_dict
+et des questions sans fonction) est posé à chaque routeur, qui est noté sur
+la précision du choix de fonction, l'exactitude des arguments extraits, la
+latence et les tokens de prompt.
+
+Les questions à plusieurs appels dépendants (EVAL_PLAN_SET) sont notées
+dans la colonne "plans" : le plan doit contenir les étapes attendues, avec
+le bon for_each.
+
+Hors ligne, les routeurs interrogent le serveur factice (mock_upstream.py),
+qui rejoue les réponses enregistrées (--replay, router_eval_routes.json par
+défaut), indexées par un hachage du prompt système et de la question :
+chaque variante de routeur, et chaque modification du prompt, a ses propres
+réponses. Une question sans réponse enregistrée reçoit son étiquette, ce qui
+ne mesure que la taille du prompt et le coût du routage : la précision est
+alors affichée "n/a". --live interroge l'API réelle et --record (avec
+--live seulement) ajoute ses réponses au fichier indiqué.
+
+Routeurs : "llm" (Function_Router_LLM), "llm-lookups" (avec
+signal_simple_lookups), "llm-plans" (avec plan_calls), ou tout autre sous
+la forme module:fabrique, la fabrique recevant functions_dict et renvoyant
+un objet doté de route_question(question) (et de route_with_usage pour
+compter les tokens).
+
+Usage: python router_eval.py [--router llm --router llm-lookups] [--replay routes.json]
+                             [--live --record routes.json] [--first-token-ms 0] [--errors] [--json out.json]
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mock_upstream import Mock_OpenAI_Server, default_reply
+
+# (question, function_id attendu, arguments attendus) : seuls les arguments
+# indiqués sont vérifiés, les autres sont libres
+EVAL_SET: Tuple[Tuple[str, int, Optional[Dict]], ...] = (
+    ("Donne-moi les informations détaillées sur l'action Apple (AAPL)", 1, {"symbol": "AAPL"}),
+    ("Tell me about the company behind the ticker NVDA", 1, {"symbol": "NVDA"}),
+    ("Recherche les actions dont le nom contient Tesla", 2, {"query": "Tesla"}),
+    ("Trouve-moi 5 actions liées à 'semiconductor' sur le NYSE", 2, {"query": "semiconductor", "limit": 5, "exchange": "NYSE"}),
+    ("Quel est le cours actuel de MSFT ?", 3, {"symbol": "MSFT"}),
+    ("What's the current share price of Amazon (AMZN)?", 3, {"symbol": "AMZN"}),
+    ("Comment a varié le prix de l'action TSLA ces derniers mois ?", 4, {"symbol": "TSLA"}),
+    ("Montre-moi le bilan trimestriel de GOOGL", 5, {"symbol": "GOOGL", "statement_type": "balance", "period": "quarter"}),
+    ("Analyse le compte de résultat annuel d'Apple (AAPL)", 5, {"symbol": "AAPL", "statement_type": "income", "period": "annual"}),
+    ("Tableau des flux de trésorerie de META entre 2020-01-01 et 2023-12-31",
+     5, {"symbol": "META", "statement_type": "cash", "from_date": "2020-01-01", "to_date": "2023-12-31"}),
+    ("Quelles sont les métriques clés annuelles de NFLX ?", 6, {"symbol": "NFLX", "period": "annual"}),
+    ("Donne-moi les ratios financiers trimestriels d'INTC", 7, {"symbol": "INTC", "period": "quarter"}),
+    ("Vue d'ensemble de l'entreprise ORCL", 8, {"symbol": "ORCL"}),
+    ("Quelles entreprises sont comparables à AMD ?", 9, {"symbol": "AMD"}),
+    ("Quelles sont les notes d'entreprise publiées par IBM ?", 10, {"symbol": "IBM"}),
+    ("Qui sont les dirigeants de Salesforce (CRM) ?", 11, {"symbol": "CRM"}),
+    ("Quelle est la capitalisation boursière d'ADBE ?", 12, {"symbol": "ADBE"}),
+    ("Croissance du chiffre d'affaires et du bénéfice de QCOM sur les 3 dernières années",
+     13, {"symbol": "QCOM", "limit": 3}),
+    ("Quel est le score de santé financière (Altman, Piotroski) d'AVGO ?", 14, {"symbol": "AVGO"}),
+    ("AAPL est-elle sous-évaluée selon l'analyse DCF ?", 15, {"symbol": "AAPL"}),
+    ("Dernières actualités sur l'action NVDA", 16, {"symbol": "NVDA"}),
+    ("News about TSLA published between 2024-11-01 and 2024-11-15",
+     16, {"symbol": "TSLA", "from_date": "2024-11-01", "to_date": "2024-11-15"}),
+    ("Quand MSFT publie-t-elle ses prochains résultats ?", 17, {"symbol": "MSFT"}),
+    ("Cherche sur Google qui a fondé Mistral AI", 18, {"query": "fondateur Mistral AI"}),
+    ("Trouve des offres d'emploi de data scientist à Paris", 19, {"query": "data scientist Paris"}),
+    ("Compare les prix d'un iPhone 15 sur Google Shopping", 20, {"query": "iPhone 15"}),
+    ("Quels sont les gros titres de Google News en France aujourd'hui ?", 21, {"country": "fr"}),
+    ("Quelle est la tendance de recherche pour 'intelligence artificielle' ?", 22, {"query": "intelligence artificielle"}),
+    ("Trouve des articles scientifiques sur les transformers en NLP", 23, {"query": "transformers NLP"}),
+    ("Quels concerts ont lieu à Lyon ce week-end ?", 24, {"query": "concerts Lyon"}),
+    ("Vols de CDG à JFK le 2024-12-20, retour le 2025-01-05",
+     25, {"departure": "CDG", "arrival": "JFK", "outbound_date": "2024-12-20", "return_date": "2025-01-05"}),
+    ("Hôtels à Rome du 2024-12-27 au 2024-12-30", 26, {"query": "Rome", "check_in": "2024-12-27", "check_out": "2024-12-30"}),
+    ("Où manger des sushis à Bordeaux ?", 27, {"query": "sushi Bordeaux"}),
+    ("Cherche des applications de méditation sur l'App Store", 28, {"term": "méditation"}),
+    ("Trouve des vidéos YouTube pour apprendre Python", 29, {"query": "apprendre Python"}),
+    ("Combien coûte une Nintendo Switch d'occasion sur eBay ?", 30, {"query": "Nintendo Switch"}),
+    ("Compare les marges nettes et la croissance du chiffre d'affaires d'AAPL, MSFT et GOOGL",
+     31, {"symbols": ["AAPL", "MSFT", "GOOGL"], "metrics": ["netMargin", "revenueGrowth"]}),
+    ("Explique-moi ce qu'est le ratio cours/bénéfice", 0, None),
+    ("Quelle différence entre une action et une obligation ?", 0, None),
+    ("Bonjour, tu peux m'aider ?", 0, None),
+)
+
+# Questions à plusieurs appels dépendants (variante llm-plans) : étapes attendues
+# (function_id, function_id de l'étape parcourue par for_each, arguments attendus)
+EVAL_PLAN_SET: Tuple[Tuple[str, List[Tuple[int, Optional[int], Optional[Dict]]]], ...] = (
+    ("Comment la valorisation d'AAPL se compare-t-elle à celle de ses concurrents ?",
+     [(9, None, {"symbol": "AAPL"}), (3, 9, None)]),
+    ("Donne-moi le cours de chacun des concurrents de NVDA", [(9, None, {"symbol": "NVDA"}), (3, 9, None)]),
+    ("Quelles sont les métriques clés annuelles des entreprises similaires à MSFT ?",
+     [(9, None, {"symbol": "MSFT"}), (6, 9, {"period": "annual"})]),
+    ("Quelle est la capitalisation boursière des concurrents de TSLA ?", [(9, None, {"symbol": "TSLA"}), (12, 9, None)]),
+    ("Quand les concurrents d'AMD publient-ils leurs prochains résultats ?", [(9, None, {"symbol": "AMD"}), (17, 9, None)]),
+)
+
+# Réponses enregistrées avec --live --record, rejouées par défaut
+DEFAULT_REPLAY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_eval_routes.json")
+
+ROUTERS: Dict[str, Callable[[Dict[int, Dict], str], Any]] = {}
+
+
+def _llm_router(**options):
+    def factory(functions_dict: Dict[int, Dict], model: str):
+        from routeur import Function_Router_LLM
+
+        return Function_Router_LLM(functions_dict, model=model, temperature=0.0, stream=False, **options)
+    return factory
+
+
+ROUTERS["llm"] = _llm_router()
+ROUTERS["llm-lookups"] = _llm_router(signal_simple_lookups=True)
+ROUTERS["llm-plans"] = _llm_router(plan_calls=True)
+
+
+def load_router(spec: str, functions_dict: Dict[int, Dict], model: str):
+    """Build a router from a ROUTERS name or a module:factory path"""
+    if spec in ROUTERS:
+        return ROUTERS[spec](functions_dict, model)
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"routeur inconnu: {spec} (noms: {', '.join(ROUTERS)}, ou module:fabrique)")
+    return getattr(importlib.import_module(module_name), attribute)(functions_dict)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.casefold().split())
+    if isinstance(value, (list, tuple)):
+        return sorted(str(_normalize(item)) for item in value)
+    if isinstance(value, bool) or value is None:
+        return value
+    return str(value)
+
+
+def arguments_match(expected: Optional[Dict], actual: Any) -> bool:
+    """True if every expected argument is present with the same value (case and spacing ignored)"""
+    if not expected:
+        return True
+    if not isinstance(actual, dict):
+        return False
+    return all(key in actual and _normalize(actual[key]) == _normalize(value) for key, value in expected.items())
+
+
+def plan_matches(expected: List[Tuple[int, Optional[int], Optional[Dict]]], plan: Any) -> bool:
+    """True if the plan holds every expected (function_id, for_each parent function_id, arguments) step"""
+    if not isinstance(plan, list):
+        return False
+    by_id = {str(step.get("id")): step for step in plan if isinstance(step, dict)}
+    steps = []
+    for step in by_id.values():
+        parent = None
+        for_each = step.get("for_each")
+        if isinstance(for_each, str) and for_each.startswith("$"):
+            parent = (by_id.get(for_each[1:].split(".", 1)[0]) or {}).get("function_id", -1)
+        steps.append((step.get("function_id"), parent, step.get("input")))
+    for function_id, parent, arguments in expected:
+        match = next((step for step in steps if step[0] == function_id and step[1] == parent
+                      and arguments_match(arguments, step[2])), None)
+        if match is None:
+            return False
+        steps.remove(match)
+    return True
+
+
+def label_plan(expected: List[Tuple[int, Optional[int], Optional[Dict]]]) -> Dict:
+    """Router answer built from a plan label"""
+    steps = []
+    for index, (function_id, parent, arguments) in enumerate(expected):
+        step = {"id": f"s{index}", "function_id": function_id, "input": dict(arguments or {})}
+        if parent is not None:
+            parent_index = next(i for i, e in enumerate(expected) if e[0] == parent and e[1] is None)
+            step["for_each"] = f"$s{parent_index}"
+            step["input"].setdefault("symbol", "$item")
+        steps.append(step)
+    return {"plan": steps}
+
+
+def label_routes() -> Dict[str, Dict]:
+    """Question -> labelled answer, for every question of both sets"""
+    routes = {question: {"function_id": function_id, "input": expected}
+              for question, function_id, expected in EVAL_SET}
+    routes.update({question: label_plan(expected) for question, expected in EVAL_PLAN_SET})
+    return routes
+
+
+def prompt_key(system: str, question: str) -> str:
+    """Replay key of a router call: a prompt edit or another router variant never reuses an answer"""
+    return hashlib.sha1(f"{system}\0{question}".encode("utf-8")).hexdigest()[:16]
+
+
+class Replay:
+    """Mock_OpenAI_Server reply answering router prompts from recorded answers, else from the labels"""
+
+    def __init__(self, recorded: Dict[str, Dict], labels: Optional[Dict[str, Dict]] = None):
+        self.recorded = recorded
+        self.labels = labels
+        # Origine des réponses servies : seules les réponses enregistrées mesurent un routeur
+        self.served = {"recorded": 0, "labels": 0, "missing": 0}
+
+    def __call__(self, payload: Dict) -> str:
+        messages = payload.get("messages", [])
+        system = messages[0].get("content", "") if messages else ""
+        if isinstance(system, str) and system.startswith("Vous êtes un routeur"):
+            question = messages[-1].get("content", "")
+            entry = self.recorded.get(prompt_key(system, question))
+            if entry is not None:
+                self.served["recorded"] += 1
+                return json.dumps(entry["route"])
+            if self.labels is not None and question in self.labels:
+                self.served["labels"] += 1
+                return json.dumps(self.labels[question])
+            self.served["missing"] += 1
+        return default_reply(payload)
+
+
+def _ask(router, question: str) -> Tuple[Dict, Dict, float]:
+    start = time.perf_counter()
+    if hasattr(router, "route_with_usage"):
+        route, usage = router.route_with_usage(question)
+    else:
+        route, usage = router.route_question(question), {}
+    return (route if isinstance(route, dict) else {}), usage, time.perf_counter() - start
+
+
+def evaluate(router, cases=EVAL_SET, plan_cases=EVAL_PLAN_SET) -> Dict:
+    """Ask every question once; return per-question results and the router's summary"""
+    results: List[Dict] = []
+    for question, function_id, expected in cases:
+        route, usage, latency = _ask(router, question)
+        routed = route.get("function_id", 0)
+        results.append({
+            "question": question,
+            "expected": function_id,
+            "routed": routed,
+            "correct": routed == function_id,
+            "arguments_ok": routed == function_id and arguments_match(expected, route.get("input")),
+            "input": route.get("input"),
+            "route": route,
+            "latency": latency,
+            "prompt_tokens": usage.get("prompt_tokens"),
+        })
+    plan_results: List[Dict] = []
+    for question, expected in plan_cases:
+        route, usage, latency = _ask(router, question)
+        plan_results.append({
+            "question": question,
+            "correct": plan_matches(expected, route.get("plan")),
+            "route": route,
+            "latency": latency,
+            "prompt_tokens": usage.get("prompt_tokens"),
+        })
+
+    asked = results + plan_results
+    count = len(asked)
+    latencies = sorted(r["latency"] for r in asked)
+    pick = lambda q: latencies[min(count - 1, int(q * count))] * 1000
+    with_arguments = [r for r in results if r["correct"] and r["expected"]]
+    tokens = [r["prompt_tokens"] for r in asked if r["prompt_tokens"] is not None]
+    return {
+        "accuracy": sum(r["correct"] for r in results) / len(results) if results else None,
+        "arguments": sum(r["arguments_ok"] for r in with_arguments) / len(with_arguments) if with_arguments else None,
+        "plans": sum(r["correct"] for r in plan_results) / len(plan_results) if plan_results else None,
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "prompt_tokens": sum(tokens) / len(tokens) if tokens else None,
+        "results": results,
+        "plan_results": plan_results,
+    }
+
+
+def _rate(value: Optional[float]) -> str:
+    return f"{value:9.1%}" if value is not None else f"{'n/a':>9}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--router", action="append", help="routeur à évaluer (répétable, défaut: llm)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--replay", default=DEFAULT_REPLAY,
+                        help=f"réponses enregistrées à rejouer (défaut: {DEFAULT_REPLAY} s'il existe)")
+    parser.add_argument("--live", action="store_true", help="interroger l'API réelle au lieu du serveur factice")
+    parser.add_argument("--record", help="ajouter à ce fichier les réponses des routeurs (avec --live)")
+    parser.add_argument("--first-token-ms", type=float, default=0.0, help="latence simulée d'une réponse")
+    parser.add_argument("--errors", action="store_true", help="lister les questions mal routées")
+    parser.add_argument("--json", help="écrire les résultats détaillés dans ce fichier")
+    args = parser.parse_args()
+    if args.record and not args.live:
+        # Hors ligne, les réponses viennent du fichier ou des étiquettes : les
+        # enregistrer ferait passer les étiquettes pour des réponses de routeur
+        parser.error("--record n'enregistre que des réponses réelles : ajouter --live")
+
+    from fonction import functions_dict
+
+    missing = sorted(set(functions_dict) - {function_id for _, function_id, _ in EVAL_SET})
+    if missing:
+        print(f"Attention: fonctions sans question étiquetée: {missing}")
+
+    mock = replay = None
+    if not args.live:
+        recorded = {}
+        if args.replay and os.path.exists(args.replay):
+            with open(args.replay, encoding="utf-8") as f:
+                recorded = json.load(f)
+        replay = Replay(recorded, label_routes())
+        mock = Mock_OpenAI_Server(reply=replay, first_token_delay=args.first_token_ms / 1000).start()
+        os.environ["OPENAI_API_BASE"] = mock.api_base
+        os.environ.setdefault("OPENAI_API_KEY", "router-eval")
+        print(f"Hors ligne: {len(recorded)} réponses enregistrées"
+              f"{' (' + args.replay + ')' if recorded else ''}, étiquettes pour les autres questions")
+
+    reports = {}
+    routers = {}
+    print(f"{'routeur':<24} {'précision':>9} {'arguments':>9} {'plans':>9} {'p50 ms':>7} {'p95 ms':>7} {'tokens':>7}")
+    try:
+        for spec in args.router or ["llm"]:
+            routers[spec] = router = load_router(spec, functions_dict, args.model)
+            before = dict(replay.served) if replay is not None else {}
+            report = evaluate(router)
+            if replay is not None and replay.served["labels"] > before["labels"]:
+                # Réponses tirées des étiquettes : le score ne mesurerait que le jeu de test lui-même
+                report.update(accuracy=None, arguments=None, plans=None, replayed_labels=True)
+            reports[spec] = report
+            tokens = f"{report['prompt_tokens']:7.0f}" if report["prompt_tokens"] is not None else f"{'-':>7}"
+            print(f"{spec:<24} {_rate(report['accuracy'])} {_rate(report['arguments'])} {_rate(report['plans'])} "
+                  f"{report['p50_ms']:7.1f} {report['p95_ms']:7.1f} {tokens}")
+            if args.errors and report["accuracy"] is not None:
+                for r in report["results"]:
+                    if not r["arguments_ok"] and (r["expected"] or not r["correct"]):
+                        print(f"    {r['expected']:>2} -> {r['routed']!s:>2} {r['input']!r:.60}  {r['question']}")
+                for r in report["plan_results"]:
+                    if not r["correct"]:
+                        print(f"    plan -> {json.dumps(r['route'], ensure_ascii=False):.60}  {r['question']}")
+    finally:
+        if mock is not None:
+            mock.stop()
+    if any(report.get("replayed_labels") for report in reports.values()):
+        print("n/a : réponses rejouées depuis les étiquettes ; enregistrer le routeur avec --live --record")
+
+    if args.record and reports:
+        recorded = {}
+        if os.path.exists(args.record):
+            with open(args.record, encoding="utf-8") as f:
+                recorded = json.load(f)
+        for spec, report in reports.items():
+            system = getattr(routers[spec], "functions_description", None)
+            if system is None or report.get("replayed_labels"):
+                continue
+            for r in report["results"] + report["plan_results"]:
+                recorded[prompt_key(system, r["question"])] = {"router": spec, "question": r["question"],
+                                                               "route": r["route"]}
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump(recorded, f, ensure_ascii=False, indent=1)
+        print(f"Réponses enregistrées dans {args.record}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,21 @@
+import json
+from typing import Dict, Tuple
+
+from llm import OpenAI_LLM
+
+
 class Function_Router_LLM(OpenAI_LLM):
-    def __init__(self, functions_dict: Dict[int, Dict], **kwargs):
+    """Routes questions to functions_dict entries; safe to share across threads like OpenAI_LLM"""
+
+    def __init__(self, functions_dict: Dict[int, Dict], signal_simple_lookups: bool = False,
+                 plan_calls: bool = False, **kwargs):
         super().__init__(**kwargs)
         self.functions_dict = functions_dict
+        # Demande au routeur de distinguer les recherches factuelles simples
+        # (réponse par gabarit) des questions d'analyse
+        self.signal_simple_lookups = signal_simple_lookups
+        # Autorise un plan d'appels dépendants (voir planner) à la place d'une fonction unique
+        self.plan_calls = plan_calls
         # Créer le prompt pour décrire les fonctions disponibles
         self.functions_description = self._create_functions_description()
 
@@ -9,7 +23,19 @@ class Function_Router_LLM(OpenAI_LLM):
         description = "Vous êtes un routeur qui analyse les questions et décide quelle fonction utiliser.\n"
         description += "Répondez uniquement avec un dictionnaire JSON contenant:\n"
         description += "- 'function_id': le numéro de la fonction à utiliser (0 si aucune fonction nécessaire)\n"
-        description += "- 'input': les paramètres d'entrée pour la fonction si applicable\n\n"
+        description += "- 'input': les paramètres d'entrée pour la fonction si applicable\n"
+        if self.signal_simple_lookups:
+            description += "- 'answer_mode': 'template' si la question demande seulement la valeur brute retournée par la fonction (cours, capitalisation, DCF...), 'llm' si elle demande une analyse, une comparaison ou une explication\n"
+            description += "- 'language': 'fr' ou 'en', la langue de la question\n"
+        if self.plan_calls:
+            description += "Si la question demande plusieurs appels dont certains dépendent du résultat d'autres "
+            description += "(ex: comparer une action à ses concurrents), répondez plutôt avec {'plan': [...]}, "
+            description += "une liste d'étapes {'id', 'function_id', 'input'} : la valeur \"$<id>\" reprend le "
+            description += "résultat d'une étape précédente (\"$<id>.<champ>\" un de ses champs), et "
+            description += "'for_each': \"$<id>\" répète l'étape pour chaque élément de ce résultat, noté \"$item\". "
+            description += "Exemple: {\"plan\": [{\"id\": \"peers\", \"function_id\": 9, \"input\": {\"symbol\": \"AAPL\"}}, "
+            description += "{\"id\": \"quotes\", \"function_id\": 3, \"for_each\": \"$peers\", \"input\": {\"symbol\": \"$item\"}}]}\n"
+        description += "\n"
         description += "Fonctions disponibles:\n"
         description += "0: Aucune fonction - répondre directement à la question\n"
         
@@ -21,22 +47,21 @@ class Function_Router_LLM(OpenAI_LLM):
 
     def route_question(self, question: str) -> Dict:
         """Analyse la question et retourne l'ID de la fonction à utiliser et ses paramètres pour ton info nous sommes le 28 novembre 2024"""
+        return self.route_with_usage(question)[0]
+
+    def route_with_usage(self, question: str) -> Tuple[Dict, Dict]:
+        """Route a question; also returns the API token usage of the call (empty on error)"""
         messages = [
             {"role": "system", "content": self.functions_description},
             {"role": "user", "content": question}
         ]
         
-        # Désactiver le streaming pour cette requête
-        original_stream = self.stream
-        self.stream = False
-        
         try:
-            response = self._make_request(messages)
+            # Pas de streaming pour cette requête, sans modifier l'instance partagée
+            response = self._make_request(messages, stream=False)
             response_data = response.json()
             response_text = response_data["choices"][0]["message"]["content"]
-            return json.loads(response_text)
+            return json.loads(response_text), response_data.get("usage") or {}
         except Exception as e:
             print(f"Erreur lors du routage: {e}")
-            return {"function_id": 0, "input": None}
-        finally:
-            self.stream = original_stream
+            return {"function_id": 0, "input": None}, {}
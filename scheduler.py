@@ -0,0 +1,228 @@
+"""
+Ordonnancement des appels amont (OpenAI, FMP, SerpAPI), partagés entre les
+conversations en direct et les travaux de fond.
+
+Chaque fournisseur a un nombre fixe d'appels simultanés (Provider_Config.
+concurrency). Un appel prend une place avant de partir et la rend à la
+réponse :
+
+- Classes de priorité : un appel interactif passe toujours avant un appel
+  de fond (lots, préchargement), et une réserve de places n'est jamais
+  donnée au fond : il n'occupe que la capacité laissée libre.
+- Équité pondérée entre locataires : au sein d'une classe, les places sont
+  attribuées par ordre d'étiquette de fin virtuelle (WFQ), si bien que
+  chaque locataire en reçoit une part proportionnelle à son poids, quel
+  que soit le nombre d'appels qu'il met en file.
+- Contrôle d'admission : une file pleine refuse l'appel tout de suite
+  (ConnectionError, comme un disjoncteur ouvert), et une attente plus
+  longue que le délai permis se termine en Timeout.
+
+La classe et le locataire suivent le contexte, comme le délai du tour :
+
+    with request_class(BATCH, tenant="prefetch"):
+        ...
+"""
+import contextlib
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from llm import requests
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+DEFAULT_TENANT = "default"
+
+_current: ContextVar[Tuple[str, str]] = ContextVar("request_class", default=(INTERACTIVE, DEFAULT_TENANT))
+
+
+@contextlib.contextmanager
+def request_class(priority: Optional[str] = None, tenant: Optional[str] = None) -> Iterator[None]:
+    """Run upstream calls inside the block with this priority and/or tenant"""
+    current_priority, current_tenant = _current.get()
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {PRIORITIES}")
+    token = _current.set((priority or current_priority, tenant or current_tenant))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current_class() -> Tuple[str, str]:
+    """(priority, tenant) of the calls made from here"""
+    return _current.get()
+
+
+class Ticket:
+    """One call waiting for, or holding, a scheduler slot"""
+    __slots__ = ("priority", "tenant", "finish", "seq", "granted", "queued_at")
+
+    def __init__(self, priority: str, tenant: str):
+        self.priority = priority
+        self.tenant = tenant
+        self.finish = 0.0
+        self.seq = 0
+        self.granted: Optional[str] = None
+        self.queued_at = 0.0
+
+
+class Upstream_Scheduler:
+    """
+    Concurrency slots of one provider, granted by priority then weighted fair share.
+
+    Args:
+        name (str): Provider name, used in error messages
+        capacity (int): Simultaneous calls
+        interactive_reserve (float): Fraction of the capacity kept from batch calls (batch keeps one slot)
+        max_queue (int): Waiting calls per priority class before new ones are refused
+        batch_max_wait (float): Seconds a batch call may wait for a slot
+        weights (Dict[str, float]): Tenant weights (default 1.0)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int = 16,
+        interactive_reserve: float = 0.25,
+        max_queue: int = 256,
+        batch_max_wait: float = 30.0,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.interactive_reserve = interactive_reserve
+        self.max_queue = max_queue
+        self.batch_max_wait = batch_max_wait
+        self.weights: Dict[str, float] = dict(weights or {})
+        self.in_use = {priority: 0 for priority in PRIORITIES}
+        self._queues: Dict[str, List[Tuple[float, int, Ticket]]] = {priority: [] for priority in PRIORITIES}
+        # Temps virtuel par classe et dernière étiquette de fin par locataire
+        self._virtual = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish: Dict[str, Dict[str, float]] = {priority: {} for priority in PRIORITIES}
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.waited = {priority: 0.0 for priority in PRIORITIES}
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def batch_limit(self) -> int:
+        """Slots batch calls may hold at most, never fewer than one"""
+        reserved = math.ceil(self.capacity * self.interactive_reserve)
+        # Avec une seule place, le lot la prend quand aucun appel interactif n'attend
+        # (ceux-ci passent toujours avant) : sinon il n'aurait jamais de place
+        return max(1, self.capacity - reserved)
+
+    # ---- file d'attente (verrou tenu) ------------------------------------
+
+    def _enqueue(self, ticket: Ticket):
+        weight = self.weights.get(ticket.tenant, 1.0)
+        last = self._last_finish[ticket.priority]
+        start = max(self._virtual[ticket.priority], last.get(ticket.tenant, 0.0))
+        ticket.finish = start + 1.0 / weight
+        ticket.seq = next(self._seq)
+        last[ticket.tenant] = ticket.finish
+        heapq.heappush(self._queues[ticket.priority], (ticket.finish, ticket.seq, ticket))
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues[ticket.priority]
+        queue.remove((ticket.finish, ticket.seq, ticket))
+        heapq.heapify(queue)
+
+    def _next(self) -> Optional[Ticket]:
+        """Ticket to grant next, if a slot is available for it"""
+        if sum(self.in_use.values()) >= self.capacity:
+            return None
+        if self._queues[INTERACTIVE]:
+            return self._queues[INTERACTIVE][0][2]
+        if self._queues[BATCH] and self.in_use[BATCH] < self.batch_limit:
+            return self._queues[BATCH][0][2]
+        return None
+
+    # ---- API ---------------------------------------------------------------
+
+    def acquire(self, ticket: Ticket, timeout: Optional[float] = None):
+        """
+        Wait for a slot.
+
+        Raises requests ConnectionError when the class queue is full, and
+        Timeout when no slot was granted within timeout (batch calls wait at
+        most batch_max_wait).
+        """
+        if ticket.priority == BATCH:
+            timeout = self.batch_max_wait if timeout is None else min(timeout, self.batch_max_wait)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if len(self._queues[ticket.priority]) >= self.max_queue:
+                self.rejected += 1
+                raise requests.exceptions.ConnectionError(f"{self.name}: file d'attente pleine")
+            ticket.queued_at = time.monotonic()
+            self._enqueue(ticket)
+            while self._next() is not ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._remove(ticket)
+                    self.timed_out += 1
+                    self._condition.notify_all()
+                    raise requests.exceptions.Timeout(f"{self.name}: aucune place après {timeout:.1f} s")
+                self._condition.wait(remaining)
+            heapq.heappop(self._queues[ticket.priority])
+            self._virtual[ticket.priority] = ticket.finish
+            ticket.granted = ticket.priority
+            self.in_use[ticket.priority] += 1
+            self.granted[ticket.priority] += 1
+            self.waited[ticket.priority] += time.monotonic() - ticket.queued_at
+            # Une autre place peut être libre pour le suivant
+            self._condition.notify_all()
+
+    def release(self, ticket: Ticket):
+        with self._condition:
+            if ticket.granted is not None:
+                self.in_use[ticket.granted] -= 1
+                ticket.granted = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, timeout: Optional[float] = None) -> Iterator[Ticket]:
+        """Hold a slot, in the current priority class and tenant, for the block"""
+        ticket = Ticket(*current_class())
+        self.acquire(ticket, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                "capacity": self.capacity,
+                "in_use": dict(self.in_use),
+                "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+                "granted": dict(self.granted),
+                "mean_wait": {p: self.waited[p] / self.granted[p] if self.granted[p] else 0.0 for p in PRIORITIES},
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+schedulers: Dict[str, Upstream_Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str) -> Upstream_Scheduler:
+    """Return the shared scheduler of a provider, sized from its Provider_Config"""
+    scheduler = schedulers.get(provider)
+    if scheduler is None:
+        from resilience import Provider_Config, providers
+
+        config = providers.get(provider) or Provider_Config()
+        with _schedulers_lock:
+            scheduler = schedulers.setdefault(provider, Upstream_Scheduler(provider, config.concurrency))
+    return scheduler
@@ -0,0 +1,530 @@
+"""
+Serveur HTTP asynchrone exposant Enhanced_OpenAI_Chatbot, avec une session
+(et donc un conversation_id) par conversation et le streaming SSE des tokens.
+
+Routes:
+    GET    /health                  état du serveur
+    POST   /sessions                crée une session -> {"conversation_id"}
+    DELETE /sessions/<id>           libère une session en mémoire
+    POST   /chat                    {"message", "conversation_id"?, "stream"?}
+
+L'en-tête X-Tenant impute les appels amont d'un tour à un locataire, pour
+le partage équitable de la capacité amont (scheduler.py).
+
+Avec "stream": true (ou Accept: text/event-stream), /chat répond en SSE:
+`session`, puis un `token` par fragment, puis `done` (ou `error`).
+
+Usage: python server.py [--host 127.0.0.1] [--port 8000]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from chatbot import OpenAI_Chatbot
+from conversation_store import is_valid_conversation_id, shared_writer
+from resilience import shared_cache, use_shared_cache
+from scheduler import DEFAULT_TENANT, schedulers
+
+_END = object()
+
+_STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error",
+    502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout"
+}
+
+
+class Turn_Cancelled(Exception):
+    """Raised inside a chatbot turn whose client is gone or whose deadline passed"""
+
+
+def _run_turn(chatbot: OpenAI_Chatbot, message: str, on_token: Callable[[str], None]) -> str:
+    """Run one chatbot turn; a cancelled turn leaves no unanswered question in the history"""
+    size = len(chatbot.messages)
+    try:
+        return chatbot(message, on_token=on_token)
+    except Turn_Cancelled:
+        del chatbot.messages[size:]
+        raise
+
+
+class HTTP_Error(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def read_request(reader: asyncio.StreamReader, max_body_size: int) -> Tuple[str, str, Dict[str, str], bytes]:
+    """Read one HTTP/1.1 request: method, path, lower-cased headers and body"""
+    request_line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip()
+    try:
+        method, path, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTP_Error(400, "Requête invalide")
+    headers = {}
+    while True:
+        line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip()
+        if not line:
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0) or 0)
+    if length > max_body_size:
+        raise HTTP_Error(413, "Corps de requête trop volumineux")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def _json_body(body: bytes) -> Dict:
+    """Request body as a JSON object, HTTP 400 otherwise"""
+    try:
+        data = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTP_Error(400, "JSON invalide")
+    if not isinstance(data, dict):
+        raise HTTP_Error(400, "JSON invalide")
+    return data
+
+
+async def wait_disconnect(reader: asyncio.StreamReader):
+    """Return once the client has closed its side of the connection"""
+    # Le corps est déjà lu : le client n'envoie plus rien, seule la fin du flux arrive
+    try:
+        while await reader.read(64 * 1024):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data: Dict):
+    body = json.dumps(data, ensure_ascii=False).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+
+class Session:
+    __slots__ = ("chatbot", "lock", "last_used")
+
+    def __init__(self, chatbot: OpenAI_Chatbot):
+        self.chatbot = chatbot
+        # Un seul tour à la fois par conversation
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class Chatbot_Server:
+    """
+    Single event loop HTTP server running chatbot turns in a bounded thread pool.
+
+    Args:
+        chatbot_factory (Callable): Builds a chatbot, called with verbose, name and turn_timeout
+        max_sessions (int): Sessions kept in memory; the least recently used idle one is evicted
+        max_concurrent_turns (int): Turns running at once; extra requests get 503
+        turn_timeout (float): Seconds allowed for one turn, streaming included
+        read_timeout (float): Seconds allowed to receive the request
+        stream_queue_size (int): Chunks buffered per stream before the upstream read is paused
+        shutdown_grace (float): Seconds given to in-flight requests on shutdown
+        create_missing (bool): Start a new conversation under an unknown conversation_id
+            instead of answering 404 (workers behind dispatcher.py, which assigns the IDs)
+    """
+
+    def __init__(
+        self,
+        chatbot_factory: Callable[..., OpenAI_Chatbot],
+        name: str = "serveur",
+        max_sessions: int = 1000,
+        max_concurrent_turns: int = 32,
+        turn_timeout: float = 120.0,
+        read_timeout: float = 10.0,
+        stream_queue_size: int = 64,
+        max_body_size: int = 1 << 20,
+        shutdown_grace: float = 30.0,
+        create_missing: bool = False
+    ):
+        self.chatbot_factory = chatbot_factory
+        self.name = name
+        self.max_sessions = max_sessions
+        self.max_concurrent_turns = max_concurrent_turns
+        self.turn_timeout = turn_timeout
+        self.read_timeout = read_timeout
+        self.stream_queue_size = stream_queue_size
+        self.max_body_size = max_body_size
+        self.shutdown_grace = shutdown_grace
+        self.create_missing = create_missing
+
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # Sessions en cours de création : les requêtes simultanées attendent la première
+        self._creating: Dict[str, asyncio.Future] = {}
+        self.active_turns = 0
+        self.draining = False
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_turns, thread_name_prefix="chatbot-turn"
+        )
+
+    # ---- cycle de vie -------------------------------------------------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> Tuple[str, int]:
+        """Start listening and return the bound (host, port)"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def shutdown(self):
+        """Stop accepting connections, let in-flight requests finish, cancel the rest, then flush saves"""
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+        pending = set(self._connections)
+        if pending:
+            _, still_pending = await asyncio.wait(pending, timeout=self.shutdown_grace)
+            for task in still_pending:
+                task.cancel()
+            if still_pending:
+                await asyncio.wait(still_pending)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        await asyncio.get_running_loop().run_in_executor(None, shared_writer().flush, self.shutdown_grace)
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8000,
+                            on_ready: Optional[Callable[[str, int], None]] = None):
+        """Serve until SIGINT or SIGTERM, then shut down gracefully"""
+        bound_host, bound_port = await self.start(host, port)
+        if on_ready is not None:
+            on_ready(bound_host, bound_port)
+        else:
+            print(f"Serveur chatbot sur http://{bound_host}:{bound_port}")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        print("Arrêt du serveur...")
+        await self.shutdown()
+
+    # ---- sessions -----------------------------------------------------
+
+    async def create_session(self, conversation_id: Optional[str] = None) -> Session:
+        """Create a session, reloading conversation_id from disk when given"""
+        self._evict_sessions()
+        loop = asyncio.get_running_loop()
+        chatbot = await loop.run_in_executor(
+            self._executor, lambda: self.chatbot_factory(
+                verbose=False, name=self.name, turn_timeout=self.turn_timeout
+            )
+        )
+        if conversation_id is not None:
+            try:
+                await loop.run_in_executor(self._executor, chatbot.load_conversation, conversation_id)
+            except FileNotFoundError:
+                if not self.create_missing:
+                    raise HTTP_Error(404, f"Conversation {conversation_id} introuvable")
+                chatbot.conversation_id = conversation_id
+        session = Session(chatbot)
+        self.sessions[chatbot.conversation_id] = session
+        return session
+
+    async def get_session(self, conversation_id: Optional[str]) -> Session:
+        if conversation_id is None:
+            return await self.create_session()
+        if not is_valid_conversation_id(conversation_id):
+            # Il sert de nom de fichier à la sauvegarde
+            raise HTTP_Error(400, "conversation_id invalide (lettres, chiffres, _ et -, 64 au plus)")
+        session = self.sessions.get(conversation_id)
+        if session is None:
+            pending = self._creating.get(conversation_id)
+            if pending is not None:
+                return await asyncio.shield(pending)
+            pending = asyncio.get_running_loop().create_future()
+            # Exception lue même si aucune autre requête n'attend cette création
+            pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._creating[conversation_id] = pending
+            try:
+                session = await self.create_session(conversation_id)
+            except asyncio.CancelledError:
+                pending.cancel()
+                raise
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                del self._creating[conversation_id]
+            pending.set_result(session)
+            return session
+        self.sessions.move_to_end(conversation_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def _evict_sessions(self):
+        """Drop least recently used idle sessions to stay under max_sessions"""
+        if len(self.sessions) < self.max_sessions:
+            return
+        for conversation_id, session in list(self.sessions.items()):
+            if not session.lock.locked():
+                del self.sessions[conversation_id]
+                if len(self.sessions) < self.max_sessions:
+                    return
+        raise HTTP_Error(503, "Trop de sessions actives")
+
+    # ---- HTTP ---------------------------------------------------------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(
+                    self._read_request(reader), self.read_timeout
+                )
+                await self._dispatch(reader, writer, method, path, headers, body)
+            except HTTP_Error as e:
+                await self._send_json(writer, e.status, {"error": e.message})
+            except asyncio.TimeoutError:
+                await self._send_json(writer, 408, {"error": "Délai de lecture dépassé"})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                await self._send_json(writer, 500, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        return await read_request(reader, self.max_body_size)
+
+    async def _dispatch(self, reader, writer, method: str, path: str, headers: Dict[str, str], body: bytes):
+        path = path.split("?", 1)[0].rstrip("/") or "/"
+        if path == "/health":
+            cache = shared_cache()
+            await self._send_json(writer, 200, {
+                "status": "draining" if self.draining else "ok",
+                "sessions": len(self.sessions),
+                "active_turns": self.active_turns,
+                "upstream": {name: scheduler.stats() for name, scheduler in schedulers.items()},
+                "shared_cache": cache.stats() if cache is not None else None
+            })
+        elif path == "/sessions" and method == "POST":
+            self._check_accepting()
+            conversation_id = None
+            if self.create_missing and body:
+                conversation_id = _json_body(body).get("conversation_id")
+            session = await self.get_session(conversation_id)
+            await self._send_json(writer, 200, {"conversation_id": session.chatbot.conversation_id})
+        elif path.startswith("/sessions/") and method == "DELETE":
+            conversation_id = path[len("/sessions/"):]
+            if self.sessions.pop(conversation_id, None) is None:
+                raise HTTP_Error(404, f"Session {conversation_id} introuvable")
+            await self._send_json(writer, 200, {"deleted": conversation_id})
+        elif path == "/chat":
+            if method != "POST":
+                raise HTTP_Error(405, "Utiliser POST")
+            await self._chat(reader, writer, headers, body)
+        else:
+            raise HTTP_Error(404, f"Route {path} inconnue")
+
+    def _check_accepting(self):
+        if self.draining:
+            raise HTTP_Error(503, "Serveur en cours d'arrêt")
+        if self.active_turns >= self.max_concurrent_turns:
+            raise HTTP_Error(503, "Capacité maximale atteinte, réessayer plus tard")
+
+    # ---- tours de conversation ----------------------------------------
+
+    async def _chat(self, reader, writer, headers: Dict[str, str], body: bytes):
+        data = _json_body(body)
+        message = data.get("message")
+        if not isinstance(message, str) or not message:
+            raise HTTP_Error(400, "Champ 'message' manquant")
+        stream = data.get("stream", "text/event-stream" in headers.get("accept", ""))
+
+        self._check_accepting()
+        self.active_turns += 1
+        try:
+            session = await self.get_session(data.get("conversation_id"))
+            deadline = asyncio.get_running_loop().time() + self.turn_timeout
+            try:
+                await asyncio.wait_for(session.lock.acquire(), self.turn_timeout)
+            except asyncio.TimeoutError:
+                raise HTTP_Error(504, "Conversation occupée par un autre tour")
+            session.chatbot.tenant = headers.get("x-tenant") or DEFAULT_TENANT
+            if stream:
+                await self._stream_turn(writer, session, message, deadline)
+            else:
+                await self._complete_turn(reader, writer, session, message, deadline)
+        finally:
+            self.active_turns -= 1
+
+    def _start_turn(self, session: Session, run_turn: Callable[[], str]) -> asyncio.Future:
+        """Run the turn in the pool; the session lock is released when the thread is done"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, run_turn)
+
+        def _finished(f: asyncio.Future):
+            session.lock.release()
+            session.last_used = time.monotonic()
+            if not f.cancelled():
+                f.exception()
+
+        future.add_done_callback(_finished)
+        return future
+
+    async def _complete_turn(self, reader, writer, session: Session, message: str, deadline: float):
+        cancelled = threading.Event()
+
+        def on_token(token: str):
+            if cancelled.is_set():
+                raise Turn_Cancelled()
+
+        future = self._start_turn(session, lambda: _run_turn(session.chatbot, message, on_token))
+        loop = asyncio.get_running_loop()
+        # Sans flux, rien n'est écrit avant la fin du tour : le départ du client
+        # se voit à la fin de sa connexion, et annule le tour
+        disconnected = asyncio.ensure_future(wait_disconnect(reader))
+        try:
+            done, _ = await asyncio.wait({future, disconnected}, timeout=max(0.0, deadline - loop.time()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnected.cancel()
+        if future not in done:
+            cancelled.set()
+            if disconnected in done:
+                raise ConnectionError("Client déconnecté")
+            raise HTTP_Error(504, "Délai de réponse dépassé")
+        response = future.result()
+        await self._send_json(writer, 200, {
+            "conversation_id": session.chatbot.conversation_id,
+            "response": response
+        })
+
+    async def _stream_turn(self, writer, session: Session, message: str, deadline: float):
+        loop = asyncio.get_running_loop()
+        # File bornée : si le client lit lentement, le thread du tour attend
+        # avant de consommer la suite du flux amont
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.stream_queue_size)
+        cancelled = threading.Event()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def on_token(token: str):
+            if cancelled.is_set():
+                raise Turn_Cancelled()
+            put(token)
+
+        def cancel():
+            cancelled.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+        def run_turn() -> str:
+            try:
+                return _run_turn(session.chatbot, message, on_token)
+            finally:
+                if not cancelled.is_set():
+                    put(_END)
+
+        future = self._start_turn(session, run_turn)
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            await self._send_event(writer, "session", {"conversation_id": session.chatbot.conversation_id})
+            while True:
+                token = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                if token is _END:
+                    break
+                await self._send_event(writer, "token", {"token": token})
+            response = await future
+            await self._send_event(writer, "done", {"response": response})
+        except asyncio.TimeoutError:
+            cancel()
+            await self._send_event(writer, "error", {"error": "Délai de réponse dépassé"})
+        except (ConnectionError, asyncio.CancelledError):
+            cancel()
+            raise
+        except Exception as e:
+            cancel()
+            await self._send_event(writer, "error", {"error": str(e)})
+
+    # ---- écriture -----------------------------------------------------
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, data: Dict):
+        await send_json(writer, status, data)
+
+    async def _send_event(self, writer: asyncio.StreamWriter, event: str, data: Dict):
+        payload = json.dumps(data, ensure_ascii=False)
+        writer.write(f"event: {event}\ndata: {payload}\n\n".encode())
+        # drain() suspend l'envoi tant que le tampon du client est plein
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--max-concurrent-turns", type=int, default=32)
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--shutdown-grace", type=float, default=30.0)
+    parser.add_argument("--tool-calling", action="store_true",
+                        help="appel de fonctions natif au lieu du routeur")
+    parser.add_argument("--archive-idle-days", type=float, default=7.0,
+                        help="archiver les conversations inactives depuis N jours (0: jamais)")
+    parser.add_argument("--save-delay", type=float, default=0.0,
+                        help="secondes d'attente d'une sauvegarde, pour regrouper les tours rapprochés")
+    parser.add_argument("--fsync", action="store_true", help="synchroniser chaque sauvegarde sur disque")
+    parser.add_argument("--shared-cache", metavar="PATH",
+                        help="cache SQLite des résultats amont partagé avec d'autres processus")
+    args = parser.parse_args()
+
+    from conversation_store import Conversation_Archiver
+    from main import build_chatbot
+
+    writer = shared_writer()
+    writer.delay, writer.fsync = args.save_delay, args.fsync
+    if args.shared_cache:
+        from shared_cache import Shared_Cache
+
+        use_shared_cache(Shared_Cache(args.shared_cache))
+
+    server = Chatbot_Server(
+        functools.partial(build_chatbot, tool_calling=args.tool_calling),
+        max_sessions=args.max_sessions,
+        max_concurrent_turns=args.max_concurrent_turns,
+        turn_timeout=args.turn_timeout,
+        shutdown_grace=args.shutdown_grace
+    )
+    archiver = None
+    if args.archive_idle_days > 0:
+        archiver = Conversation_Archiver(idle_after=args.archive_idle_days * 86400).start()
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    finally:
+        if archiver is not None:
+            archiver.stop()
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
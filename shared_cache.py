@@ -0,0 +1,131 @@
+"""
+Cache partagé entre les processus d'un même hôte, dans un fichier SQLite en
+mode WAL, derrière les caches de resilience (corps des réponses amont) et
+de fonction (historiques FMP).
+
+- Lectures sans verrou : en mode WAL un lecteur lit un instantané et ne
+  bloque ni n'attend les écrivains ; chaque thread a sa connexion.
+- Mises à jour atomiques : une entrée est remplacée en une seule
+  instruction, et jamais par un résultat plus ancien que celui en place.
+- Expiration : une entrée est ignorée passé son TTL, puis supprimée par un
+  balayage périodique qui borne aussi le nombre d'entrées.
+
+Les valeurs sont sérialisées avec pickle : le fichier n'est lu que par les
+processus de l'application, comme les autres caches locaux.
+"""
+import os
+import pickle
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+DEFAULT_PATH = "data/cache/upstream.sqlite"
+
+
+class Shared_Cache:
+    """
+    Cached values shared by the processes of one host, in a SQLite WAL file.
+
+    Args:
+        path (str): Database file
+        ttl (float): Seconds an entry is kept after its fetch
+        max_entries (int): Entries kept at most, the oldest fetches being evicted first
+        sweep_interval (float): Seconds between two eviction passes of a process
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = 24 * 3600.0, max_entries: int = 50000,
+                 sweep_interval: float = 60.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def _connection(self):
+        """Connection of the calling thread, opened on first use (and again after a fork)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            import sqlite3
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Mode autocommit : chaque instruction est sa propre transaction
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, fetched_at REAL NOT NULL, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_expiry ON entries (expires_at)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        """(fetch time, value) of an unexpired entry, None otherwise"""
+        try:
+            row = self._connection().execute(
+                "SELECT fetched_at, value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0], pickle.loads(row[1])
+        except Exception:
+            # Le cache partagé ne fait jamais échouer un appel : une erreur vaut un défaut de cache
+            self.errors += 1
+            return None
+
+    def put(self, key: str, value: Any, fetched_at: Optional[float] = None):
+        """Store a value, unless another process already stored a more recent one"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT INTO entries (key, fetched_at, expires_at, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET fetched_at = excluded.fetched_at, "
+                "expires_at = excluded.expires_at, value = excluded.value "
+                "WHERE excluded.fetched_at >= entries.fetched_at",
+                (key, fetched_at, fetched_at + self.ttl, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            )
+            self.writes += 1
+            self._maybe_sweep(connection)
+        except Exception:
+            self.errors += 1
+
+    def _maybe_sweep(self, connection):
+        """Drop expired entries, then the oldest ones beyond max_entries, at most once per interval"""
+        now = time.time()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + self.sweep_interval
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            excess = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY fetched_at LIMIT ?)",
+                    (excess,)
+                )
+        finally:
+            self._sweep_lock.release()
+
+    def clear(self, prefix: str = ""):
+        """Remove every entry whose key starts with prefix"""
+        try:
+            self._connection().execute(
+                "DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {"path": self.path, "hits": self.hits, "misses": self.misses,
+                "writes": self.writes, "errors": self.errors}
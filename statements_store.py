@@ -0,0 +1,308 @@
+"""
+Stockage colonnaire local des états financiers (NumPy) et calcul vectorisé
+des métriques dérivées : croissance, marges et ratios, sur plusieurs périodes
+et plusieurs symboles à la fois.
+
+Chaque symbole est conservé dans data/statements/<période>/<SYMBOLE>.npz :
+les dates des périodes (les plus récentes en premier), les noms des postes et
+une matrice float64 [postes x périodes] regroupant compte de résultat, bilan
+et tableau de flux de trésorerie.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+STATEMENT_TYPES = ("income", "balance", "cash")
+# Symboles acceptés dans un chemin de fichier (ils viennent du routeur) : pas
+# de séparateur, et au moins une lettre ou un chiffre (ni "." ni "..")
+SYMBOL_PATTERN = re.compile(r"^(?=.*[A-Z0-9])[A-Z0-9.\-^]{1,15}$")
+
+# Métriques définies comme un rapport entre deux postes
+RATIO_METRICS: Dict[str, Tuple[str, str]] = {
+    "grossMargin": ("grossProfit", "revenue"),
+    "operatingMargin": ("operatingIncome", "revenue"),
+    "netMargin": ("netIncome", "revenue"),
+    "ebitdaMargin": ("ebitda", "revenue"),
+    "freeCashFlowMargin": ("freeCashFlow", "revenue"),
+    "rdToRevenue": ("researchAndDevelopmentExpenses", "revenue"),
+    "currentRatio": ("totalCurrentAssets", "totalCurrentLiabilities"),
+    "debtToEquity": ("totalDebt", "totalStockholdersEquity"),
+    "debtToAssets": ("totalDebt", "totalAssets"),
+    "returnOnEquity": ("netIncome", "totalStockholdersEquity"),
+    "returnOnAssets": ("netIncome", "totalAssets"),
+    "cashConversion": ("operatingCashFlow", "netIncome"),
+}
+
+# Métriques de croissance d'une période sur la précédente
+GROWTH_METRICS: Dict[str, str] = {
+    "revenueGrowth": "revenue",
+    "grossProfitGrowth": "grossProfit",
+    "operatingIncomeGrowth": "operatingIncome",
+    "netIncomeGrowth": "netIncome",
+    "epsGrowth": "eps",
+    "freeCashFlowGrowth": "freeCashFlow",
+    "totalAssetsGrowth": "totalAssets",
+}
+
+# Métriques classées par ordre croissant : moins d'endettement est mieux
+LOWER_IS_BETTER = {"debtToEquity", "debtToAssets"}
+
+DEFAULT_METRICS = ("revenueGrowth", "grossMargin", "operatingMargin", "netMargin",
+                   "returnOnEquity", "debtToEquity", "currentRatio")
+
+
+class Symbol_Statements:
+    """Line items of one symbol as a [items x periods] matrix, most recent period first"""
+    __slots__ = ("symbol", "period", "dates", "items", "values", "fetched_at", "_index")
+
+    def __init__(self, symbol: str, period: str, dates: np.ndarray, items: Sequence[str],
+                 values: np.ndarray, fetched_at: float):
+        self.symbol = symbol
+        self.period = period
+        self.dates = dates
+        self.items = tuple(items)
+        self.values = values
+        self.fetched_at = fetched_at
+        self._index = {item: i for i, item in enumerate(self.items)}
+
+    @classmethod
+    def from_records(cls, symbol: str, period: str, statements: Iterable[List[Dict]]) -> "Symbol_Statements":
+        """Merge FMP statement lists (one per statement type) on their period date"""
+        by_date: Dict[str, Dict[str, float]] = {}
+        for records in statements:
+            if not isinstance(records, list):
+                continue
+            for record in records:
+                if not isinstance(record, dict) or "date" not in record:
+                    continue
+                row = by_date.setdefault(str(record["date"])[:10], {})
+                for key, value in record.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        row[key] = float(value)
+
+        dates = sorted(by_date, reverse=True)
+        items = sorted({key for row in by_date.values() for key in row})
+        values = np.full((len(items), len(dates)), np.nan)
+        index = {item: i for i, item in enumerate(items)}
+        for column, day in enumerate(dates):
+            for key, value in by_date[day].items():
+                values[index[key], column] = value
+        return cls(symbol, period, np.array(dates, dtype="U10"), items, values, time.time())
+
+    def item(self, name: str) -> np.ndarray:
+        """Values of a line item across periods (NaN if unknown)"""
+        i = self._index.get(name)
+        if i is None:
+            return np.full(len(self.dates), np.nan)
+        return self.values[i]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp, dates=self.dates, items=np.array(self.items, dtype="U"),
+            values=self.values, fetched_at=np.array(self.fetched_at)
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, symbol: str, period: str, path: str) -> "Symbol_Statements":
+        with np.load(path) as data:
+            return cls(symbol, period, data["dates"], data["items"].tolist(),
+                       data["values"], float(data["fetched_at"]))
+
+
+class Statement_Store:
+    """
+    Per-symbol columnar store of statement line items, in memory and on disk.
+
+    Args:
+        root (str): Storage folder
+        max_age (float): Seconds before a symbol's statements are fetched again
+        limit (int): Periods requested per statement when fetching
+        max_workers (int): Symbols fetched in parallel
+    """
+
+    def __init__(self, root: str = "data/statements", max_age: float = 24 * 3600.0,
+                 limit: int = 10, max_workers: int = 8):
+        self.root = root
+        self.max_age = max_age
+        self.limit = limit
+        self.max_workers = max_workers
+        self._symbols: Dict[Tuple[str, str], Symbol_Statements] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str, period: str) -> str:
+        if not SYMBOL_PATTERN.match(symbol):
+            raise ValueError(f"Symbole invalide: {symbol!r}")
+        if period not in ("annual", "quarter"):
+            raise ValueError(f"Période invalide: {period!r} (annual ou quarter)")
+        return os.path.join(self.root, period, f"{symbol}.npz")
+
+    def put(self, statements: Symbol_Statements, persist: bool = True):
+        with self._lock:
+            self._symbols[(statements.symbol, statements.period)] = statements
+        if persist:
+            statements.save(self._path(statements.symbol, statements.period))
+
+    def get(self, symbol: str, period: str = "annual") -> Symbol_Statements:
+        """Return a symbol's statements, from memory, disk or FMP in that order"""
+        symbol = symbol.strip().upper()
+        key = (symbol, period)
+        cached = self._symbols.get(key)
+        if cached is not None and time.time() - cached.fetched_at < self.max_age:
+            return cached
+        path = self._path(symbol, period)
+        if os.path.exists(path):
+            stored = Symbol_Statements.load(symbol, period, path)
+            if time.time() - stored.fetched_at < self.max_age:
+                with self._lock:
+                    self._symbols[key] = stored
+                return stored
+        return self.fetch(symbol, period)
+
+    def fetch(self, symbol: str, period: str = "annual") -> Symbol_Statements:
+        """Download the three statements of a symbol and store them"""
+        from fonction import get_financial_statements
+
+        statements = Symbol_Statements.from_records(symbol, period, [
+            get_financial_statements(symbol, statement_type, period, limit=self.limit)
+            for statement_type in STATEMENT_TYPES
+        ])
+        if len(statements.dates):
+            self.put(statements)
+        return statements
+
+    def get_many(self, symbols: Iterable[str], period: str = "annual") -> List[Symbol_Statements]:
+        """Load several symbols, fetching the missing ones in parallel"""
+        symbols = list(dict.fromkeys(s.strip().upper() for s in symbols))
+        # Chaque tâche garde le contexte de l'appelant (délai du tour, classe d'ordonnancement)
+        contexts = [contextvars.copy_context() for _ in symbols]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(lambda s, context: context.run(self.get, s, period), symbols, contexts))
+
+    def panel(self, symbols: Iterable[str], items: Sequence[str], periods: int = 5,
+              period: str = "annual") -> Tuple[List[str], np.ndarray]:
+        """
+        Stack line items of many symbols into a [symbols x items x periods] array.
+
+        Periods are aligned by position (most recent first), NaN where missing.
+        """
+        loaded = self.get_many(symbols, period)
+        return [s.symbol for s in loaded], build_panel(loaded, items, periods)
+
+
+def build_panel(statements: Sequence[Symbol_Statements], items: Sequence[str], periods: int) -> np.ndarray:
+    panel = np.full((len(statements), len(items), periods), np.nan)
+    for s, symbol_statements in enumerate(statements):
+        width = min(periods, len(symbol_statements.dates))
+        for i, item in enumerate(items):
+            row = symbol_statements._index.get(item)
+            if row is not None:
+                panel[s, i, :width] = symbol_statements.values[row, :width]
+    return panel
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    out = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=(denominator != 0) & ~np.isnan(denominator))
+    return out
+
+
+def growth(values: np.ndarray) -> np.ndarray:
+    """Period-over-period growth along the last axis (most recent first); last period is NaN"""
+    out = np.full(values.shape, np.nan)
+    previous = values[..., 1:]
+    out[..., :-1] = _safe_divide(values[..., :-1] - previous, np.abs(previous))
+    return out
+
+
+def compute_metrics(statements: Sequence[Symbol_Statements], metrics: Sequence[str],
+                    periods: int = 5) -> Dict[str, np.ndarray]:
+    """
+    Compute derived metrics for all symbols at once.
+
+    Returns a [symbols x periods] array per metric. Growth needs one extra
+    period, which is loaded but not returned.
+    """
+    unknown = [m for m in metrics if m not in RATIO_METRICS and m not in GROWTH_METRICS]
+    if unknown:
+        raise ValueError(f"Métriques inconnues: {', '.join(unknown)}")
+
+    items = sorted({item for m in metrics for item in RATIO_METRICS.get(m, ())}
+                   | {GROWTH_METRICS[m] for m in metrics if m in GROWTH_METRICS})
+    index = {item: i for i, item in enumerate(items)}
+    panel = build_panel(statements, items, periods + 1)
+
+    results = {}
+    for metric in metrics:
+        if metric in RATIO_METRICS:
+            numerator, denominator = RATIO_METRICS[metric]
+            values = _safe_divide(panel[:, index[numerator]], panel[:, index[denominator]])
+        else:
+            values = growth(panel[:, index[GROWTH_METRICS[metric]]])
+        results[metric] = values[:, :periods]
+    return results
+
+
+_default_store: Optional[Statement_Store] = None
+
+
+def default_store() -> Statement_Store:
+    global _default_store
+    if _default_store is None:
+        _default_store = Statement_Store()
+    return _default_store
+
+
+def _json_value(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def compare_financials(
+    symbols: Union[str, List[str]],
+    metrics: Optional[Union[str, List[str]]] = None,
+    period: str = "annual",
+    periods: int = 3
+) -> Dict:
+    """
+    Compare des métriques dérivées des états financiers entre plusieurs entreprises.
+
+    Args:
+        symbols (Union[str, List[str]]): Symboles, en liste ou séparés par des virgules
+        metrics (Union[str, List[str]]): Métriques (défaut: croissance, marges, ROE, endettement, liquidité)
+        period (str): Période ('annual' ou 'quarter')
+        periods (int): Nombre de périodes les plus récentes (défaut: 3)
+
+    Returns:
+        Dict: Valeurs par métrique et par symbole, et classement sur la dernière période
+              (du meilleur au moins bon : décroissant, croissant pour l'endettement)
+    """
+    if isinstance(symbols, str):
+        symbols = [s for s in symbols.replace(" ", "").split(",") if s]
+    if isinstance(metrics, str):
+        metrics = [m for m in metrics.replace(" ", "").split(",") if m]
+    metrics = list(metrics or DEFAULT_METRICS)
+    # Le routeur peut transmettre une chaîne
+    periods = int(periods)
+
+    statements = default_store().get_many(symbols, period)
+    values = compute_metrics(statements, metrics, periods)
+    names = [s.symbol for s in statements]
+
+    result = {"period": period, "metrics": {}, "ranking": {}}
+    for metric, matrix in values.items():
+        result["metrics"][metric] = {
+            name: [_json_value(v) for v in row] for name, row in zip(names, matrix)
+        }
+        latest = matrix[:, 0]
+        key = latest if metric in LOWER_IS_BETTER else -latest
+        order = [i for i in np.argsort(np.nan_to_num(key, nan=np.inf)) if not np.isnan(latest[i])]
+        result["ranking"][metric] = [names[i] for i in order]
+    return result
@@ -0,0 +1,85 @@
+"""
+Formats de stockage des conversations et des données mises en cache.
+
+- "json"    : JSON indenté (format historique), extension .json
+- "compact" : JSON minifié, extension .json
+- "gzip"    : JSON minifié compressé (gzip), extension .json.gz
+
+La relecture détecte le format au contenu : un fichier écrit dans n'importe
+quel format se relit avec read_file() / decode().
+"""
+import gzip
+import json
+import os
+from typing import Any, Optional
+
+FORMATS = ("json", "compact", "gzip")
+EXTENSIONS = {"json": ".json", "compact": ".json", "gzip": ".json.gz"}
+# Ordre de recherche d'un fichier dont on ne connaît que le nom de base
+SEARCH_EXTENSIONS = (".json.gz", ".json")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def encode(data: Any, fmt: str = "compact", compresslevel: int = 6) -> bytes:
+    """Serialize data in the given storage format"""
+    if fmt == "json":
+        return json.dumps(data, indent=2).encode("utf-8")
+    if fmt not in FORMATS:
+        raise ValueError(f"Format de stockage inconnu: {fmt}")
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if fmt == "gzip":
+        # mtime=0 : même contenu, mêmes octets
+        return gzip.compress(raw, compresslevel=compresslevel, mtime=0)
+    return raw
+
+
+def decode(raw: bytes) -> Any:
+    """Deserialize bytes written in any storage format"""
+    if raw[:2] == _GZIP_MAGIC:
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def write_file(base_path: str, data: Any, fmt: str = "compact", fsync: bool = False) -> str:
+    """
+    Atomically write data to base_path + the format's extension.
+
+    Copies of the same base name in other formats are removed, so a
+    conversation never exists twice on disk. With fsync, the content is on
+    disk before the file replaces the previous one. Returns the written path.
+    """
+    path = base_path + EXTENSIONS[fmt]
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode(data, fmt))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    for extension in SEARCH_EXTENSIONS:
+        other = base_path + extension
+        if other != path and os.path.exists(other):
+            os.remove(other)
+    return path
+
+
+def find_file(base_path: str) -> Optional[str]:
+    """Return the existing file for base_path, whatever its format"""
+    for extension in SEARCH_EXTENSIONS:
+        if os.path.exists(base_path + extension):
+            return base_path + extension
+    return None
+
+
+def read_file(path: str) -> Any:
+    with open(path, "rb") as f:
+        return decode(f.read())
+
+
+def strip_extension(filename: str) -> str:
+    """Remove a storage extension from a file name"""
+    for extension in SEARCH_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
@@ -0,0 +1,107 @@
+"""
+Test de charge multithread : un seul OpenAI_LLM et un seul Function_Router_LLM
+partagés par N threads, chaque appel avec ses propres options (stream,
+max_tokens, temperature), contre le serveur factice local. Chaque réponse
+doit refléter exactement les options de la requête qui l'a produite.
+
+Usage: python stress_threads.py [--threads 16] [--calls 50]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+
+from mock_upstream import Mock_OpenAI_Server
+
+
+def echo_reply(payload):
+    """Answer with the options the server actually received"""
+    system = payload["messages"][0].get("content", "")
+    if isinstance(system, str) and system.startswith("Vous êtes un routeur"):
+        return json.dumps({"function_id": 3, "input": {"symbol": payload["messages"][-1]["content"]}})
+    return json.dumps({
+        "tag": payload["messages"][-1]["content"],
+        "stream": payload["stream"],
+        "max_tokens": payload["max_tokens"],
+        "temperature": payload["temperature"],
+    })
+
+
+def read_text(response, stream: bool) -> str:
+    if not stream:
+        return response.json()["choices"][0]["message"]["content"]
+    chunks = []
+    for line in response.iter_lines():
+        line = line.decode("utf-8")
+        if line.startswith("data: ") and line[6:] != "[DONE]":
+            chunks.append(json.loads(line[6:])["choices"][0]["delta"].get("content", ""))
+    return "".join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    server = Mock_OpenAI_Server(reply=echo_reply).start()
+    os.environ.setdefault("OPENAI_API_KEY", "stress")
+
+    from fonction import functions_dict
+    from llm import OpenAI_LLM
+    from routeur import Function_Router_LLM
+
+    llm = OpenAI_LLM(api_base=server.api_base, stream=True, max_tokens=100, temperature=0.5)
+    router = Function_Router_LLM(functions_dict, api_base=server.api_base, stream=True)
+    errors = []
+    barrier = threading.Barrier(args.threads)
+
+    def worker(index: int):
+        rng = random.Random(index)
+        barrier.wait()
+        for call in range(args.calls):
+            tag = f"T{index}-{call}"
+            try:
+                if rng.random() < 0.3:
+                    # Le routeur force stream=False pour lui-même, jamais pour les autres
+                    route = router.route_question(tag)
+                    if route.get("input", {}).get("symbol") != tag:
+                        errors.append(f"{tag}: routage incorrect {route}")
+                    continue
+                shared = router if rng.random() < 0.3 else llm
+                stream = rng.random() < 0.5
+                max_tokens = rng.randint(1, 4000)
+                temperature = round(rng.random(), 2)
+                response = shared._make_request(
+                    [{"role": "user", "content": tag}],
+                    stream=stream, max_tokens=max_tokens, temperature=temperature
+                )
+                echoed = json.loads(read_text(response, stream))
+                expected = {"tag": tag, "stream": stream, "max_tokens": max_tokens, "temperature": temperature}
+                if echoed != expected:
+                    errors.append(f"{tag}: attendu {expected}, reçu {echoed}")
+            except Exception as e:
+                errors.append(f"{tag}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.stop()
+
+    # Les valeurs par défaut des instances partagées ne doivent pas avoir bougé
+    if (llm.stream, llm.max_tokens, llm.temperature) != (True, 100, 0.5) or router.stream is not True:
+        errors.append("les options par défaut d'une instance partagée ont été modifiées")
+
+    total = args.threads * args.calls
+    print(f"{total} appels sur {args.threads} threads, {server.request_count} requêtes, {len(errors)} erreur(s)")
+    for error in errors[:10]:
+        print(f"  {error}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
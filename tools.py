@@ -0,0 +1,68 @@
+"""
+Schémas d'outils pour l'appel de fonctions natif de l'API chat completions,
+générés à partir des entrées de functions_dict (description et paramètres
+décrits sous la forme "type - description").
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+_TYPES = {
+    "str": {"type": "string"},
+    "int": {"type": "integer"},
+    "float": {"type": "number"},
+    "bool": {"type": "boolean"},
+    "dict": {"type": "object"},
+    "list[str]": {"type": "array", "items": {"type": "string"}},
+    "list[int]": {"type": "array", "items": {"type": "integer"}},
+}
+# Un paramètre décrit avec une valeur par défaut ou comme optionnel n'est pas requis
+_OPTIONAL = re.compile(r"défaut|optionnel|default|optional", re.IGNORECASE)
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_-]")
+
+
+def parameter_schema(spec: str) -> Tuple[Dict, bool]:
+    """JSON schema of one parameter description, and whether it is required"""
+    type_name, separator, description = spec.partition(" - ")
+    if not separator:
+        type_name, description = "str", spec
+    schema = dict(_TYPES.get(type_name.strip().lower(), {"type": "string"}))
+    schema["description"] = description.strip()
+    return schema, not _OPTIONAL.search(description)
+
+
+def tool_name(function_id: int, entry: Dict) -> str:
+    """Tool name of an entry: its target function name, else function_<id>"""
+    target: Optional[str] = getattr(entry, "target", None)
+    name = target.rpartition(":")[2] if target else f"function_{function_id}"
+    return _INVALID_NAME.sub("_", name)[:64]
+
+
+def build_tools(functions_dict: Dict[int, Dict]) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Build the `tools` payload for functions_dict.
+
+    Returns:
+        Tuple[List[Dict], Dict[str, int]]: Tool schemas, and function_id by tool name
+    """
+    tools = []
+    ids: Dict[str, int] = {}
+    for function_id, entry in functions_dict.items():
+        name = tool_name(function_id, entry)
+        if name in ids:
+            name = f"{name}_{function_id}"
+        properties = {}
+        required = []
+        for parameter, spec in entry.get("parameters", {}).items():
+            properties[parameter], is_required = parameter_schema(str(spec))
+            if is_required:
+                required.append(parameter)
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": entry["description"],
+                "parameters": {"type": "object", "properties": properties, "required": required},
+            },
+        })
+        ids[name] = function_id
+    return tools, ids